@@ -0,0 +1,4 @@
+# Gravação/reprodução das chamadas externas (CASSETTE_MODE); desligada por padrão
+from agent.utils.cassette import install_cassettes
+
+install_cassettes()
@@ -1,65 +1,47 @@
 import os
 import json
+import asyncio
 from typing import Literal
 
+from langchain_core.runnables import RunnableLambda
 from langgraph.prebuilt import ToolNode, tools_condition
 from langchain.messages import HumanMessage, AIMessage, SystemMessage
 from langgraph.graph import StateGraph, START, END
 from langgraph.types import interrupt
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel
-from langchain_cerebras import ChatCerebras
-from langchain_groq import ChatGroq
-from langchain_openai import OpenAI
 
-from agent.utils.prompt import CHAT_SYSTEM_PROMPT, WELCOME_MESSAGE, ROUTER_PROMPT, GUIDE_SYSTEM_PROMPT
+from agent.utils.blobs import offload, resolve_messages
+from agent.utils.gateway import get_gateway
+from agent.utils.pdf import prerender
+from agent.utils.guide import (
+    generate_guide_content, agenerate_guide_content, extract_guide, normalize_content, user_data_hash,
+    validate_answers, QUESTIONS_MAP, FORM_FIELDS,
+)
+from agent.utils.prompt import CHAT_SYSTEM_PROMPT, WELCOME_MESSAGE, ROUTER_PROMPT
+from agent.utils.resilience import timeout_for
+from agent.utils.speculative import get_speculative_guides, GUIDE_SPECULATION
 from agent.utils.state import StateSchema
 from agent.utils.tools import TOOLS_CHAT
 
-MODEL_NAME = "gemini-2.5-flash"
-
-def create_agent_graph(checkpointer=None):
-
-    # Configuração do LLM
-    # llm = ChatGoogleGenerativeAI(
-    #     api_key=os.getenv("GOOGLE_API_KEY"),
-    #     model=MODEL_NAME,
-    #     temperature=0,
-    #     max_tokens=20000,
-    #     timeout=None,
-    #     max_retries=1,
-    # )
-
-    llm = ChatGroq(
-        temperature=0,
-        model_name="openai/gpt-oss-120b",
-        api_key= os.getenv("GROQ_API_KEY"),
-        max_retries=3,
-        timeout=None
-    )
+# "etapas": dados pessoais, saúde e confirmação em três interrupções; "unico": um formulário só
+GUIDE_FORM_MODE = os.getenv("GUIDE_FORM_MODE", "etapas")
 
-    # llm = ChatCerebras(
-    #     temperature=0,
-    #     model="gpt-oss-120b",
-    #     api_key=os.getenv("CEREBRAS_API_KEY"),
-    #     max_retries=3,
-    #     timeout=None
-    # )
+EXIT_GUIDE_MESSAGE = "Entendido! Cancelei a criação do guia. Se quiser tentar novamente ou conversar sobre outro assunto, estou por aqui!"
 
-    graph = StateGraph(state_schema=StateSchema)
+DEGRADED_CHAT_MESSAGE = (
+    "Desculpe, estou com instabilidade para responder agora. 😔 "
+    "Por favor, tente novamente em alguns instantes."
+)
+
+def create_agent_graph(checkpointer=None, llm=None, form_mode=None):
 
-    # --- FUNÇÃO AUXILIAR DE NORMALIZAÇÃO ---
-    def normalize_content(content):
-        """Converte listas de dicionários do Gemini em texto puro string."""
-        if isinstance(content, list):
-            text_parts = []
-            for item in content:
-                if isinstance(item, dict) and item.get('type') == 'text':
-                    text_parts.append(item.get('text', ''))
-                elif isinstance(item, str):
-                    text_parts.append(item)
-            return "".join(text_parts)
-        return str(content)
+    # Configuração do LLM: todos os nós passam pelo gateway de provedores
+    if llm is None:
+        llm = get_gateway()
+
+    form_mode = form_mode or GUIDE_FORM_MODE
+
+    graph = StateGraph(state_schema=StateSchema)
 
     # --- NODES ---
 
@@ -69,33 +51,100 @@ def create_agent_graph(checkpointer=None):
             "messages": [AIMessage(content=WELCOME_MESSAGE)]
         }
   
-    def router_node(state: StateSchema) -> str:
-        class RouterOutput(BaseModel):
-            route: str
+    class RouterOutput(BaseModel):
+        route: str
 
+    def _route(response) -> dict:
+        route = response.route if response is not None else "chat_node"
+        if route not in ["chat_node", "guide_node"]:
+            route = "chat_node"
+        return {"route": route}
+
+    def router_node(state: StateSchema) -> str:
         system_message = SystemMessage(content=ROUTER_PROMPT)
         try:
-            response = llm.with_structured_output(RouterOutput).invoke([system_message, *state["messages"]])
-            route = response.route
+            response = llm.with_structured_output(RouterOutput).hedged().invoke([system_message, *resolve_messages(state["messages"])])
         except Exception:
-            route = "chat_node"
+            response = None
+        return _route(response)
 
-        if route not in ["chat_node", "guide_node"]:
-            route = "chat_node"
-        return {"route": route}
+    async def arouter_node(state: StateSchema) -> str:
+        system_message = SystemMessage(content=ROUTER_PROMPT)
+        try:
+            messages = await asyncio.to_thread(resolve_messages, state["messages"])
+            response = await llm.with_structured_output(RouterOutput).hedged().ainvoke([system_message, *messages])
+        except Exception:
+            response = None
+        return _route(response)
 
     def chat_node(state: StateSchema) -> StateSchema:
         system_prompt = SystemMessage(content=CHAT_SYSTEM_PROMPT)
-        response = llm.bind_tools(tools=TOOLS_CHAT).invoke([system_prompt, *state["messages"]])
+        try:
+            # Documentos e guias grandes estão no blob store: resolve só para a chamada
+            messages = resolve_messages(state["messages"])
+            response = llm.bind_tools(tools=TOOLS_CHAT).invoke([system_prompt, *messages])
+        except Exception as e:
+            # Modo degradado: nenhum provedor respondeu dentro do prazo do turno
+            print(f"[ERROR AGENT] Falha no chat: {e}")
+            return {"messages": [AIMessage(content=DEGRADED_CHAT_MESSAGE)]}
         
         # Normaliza a resposta do chat comum
         response.content = normalize_content(response.content)
         
         return {"messages": [response]}
 
+    async def achat_node(state: StateSchema) -> StateSchema:
+        system_prompt = SystemMessage(content=CHAT_SYSTEM_PROMPT)
+        try:
+            messages = await asyncio.to_thread(resolve_messages, state["messages"])
+            response = await llm.bind_tools(tools=TOOLS_CHAT).ainvoke([system_prompt, *messages])
+        except Exception as e:
+            print(f"[ERROR AGENT] Falha no chat: {e}")
+            return {"messages": [AIMessage(content=DEGRADED_CHAT_MESSAGE)]}
+
+        response.content = normalize_content(response.content)
+        return {"messages": [response]}
+
     def guide_node(state: StateSchema) -> StateSchema:
         return {
-            "messages": [AIMessage(content="Antes de prosseguirmos, gostaria de fazer algumas perguntas para personalizar melhor o guia para você.")]
+            "messages": [AIMessage(content="Antes de prosseguirmos, gostaria de fazer algumas perguntas para personalizar melhor o guia para você.")],
+            # Uma saída anterior do guia não pode encerrar este novo fluxo
+            "exit_guide": False
+        }
+
+    def questionnaire(state: StateSchema) -> StateSchema:
+        """Modo de formulário único: todas as perguntas em uma interrupção, já com os valores atuais."""
+        user_data = dict(state.get("user_data", {}) or {})
+        answer = interrupt({
+            "mensagem": "Por favor, responda às perguntas abaixo para personalizarmos o seu guia.",
+            "perguntas": {field: QUESTIONS_MAP[field] for field in FORM_FIELDS},
+            "valores": {field: user_data.get(field, "") for field in FORM_FIELDS},
+            "erros": state.get("form_errors") or {},
+        })
+
+        if answer.get("exit"):
+            return {
+                "exit_guide": True,
+                "messages": [AIMessage(content=EXIT_GUIDE_MESSAGE)]
+            }
+
+        answers = {field: str(answer.get(field, "") or "").strip() for field in FORM_FIELDS}
+        errors = validate_answers(answers)
+        if errors:
+            return {"form_errors": errors}
+
+        if not answers["exames_tratamentos"]:
+            answers["exames_tratamentos"] = "Não informado"
+        changed = [field for field in FORM_FIELDS if str(user_data.get(field, "")) != answers[field]]
+        user_data.update(answers)
+        # O guia só continua válido se nenhum campo que o influencia mudou
+        if set(changed) - {"email"}:
+            user_data.pop("guide", None)
+        return {"user_data": user_data, "form_errors": {}, "changed_fields": changed}
+
+    def keep_guide(state: StateSchema) -> StateSchema:
+        return {
+            "messages": [AIMessage(content="Seus dados foram atualizados e o guia que já geramos continua válido. 📋 Quer que eu envie o guia para o seu email?")]
         }
     
     def personal_questions(state: StateSchema) -> StateSchema:
@@ -111,7 +160,7 @@ def create_agent_graph(checkpointer=None):
         if answer.get("exit"):
             return {
                 "exit_guide": True,
-                "messages": [AIMessage(content="Entendido! Cancelei a criação do guia. Se quiser tentar novamente ou conversar sobre outro assunto, estou por aqui!")]
+                "messages": [AIMessage(content=EXIT_GUIDE_MESSAGE)]
             }
         
         user_data["nome"] = answer.get("nome", "Não informado")
@@ -145,7 +194,7 @@ def create_agent_graph(checkpointer=None):
         if answer.get("exit"):
             return {
                 "exit_guide": True,
-                "messages": [AIMessage(content="Entendido! Cancelei a criação do guia. Se quiser tentar novamente ou conversar sobre outro assunto, estou por aqui!")]
+                "messages": [AIMessage(content=EXIT_GUIDE_MESSAGE)]
             }
 
         user_data["ciclo_menstrual"] = answer.get("ciclo_menstrual", "Não informado")
@@ -174,6 +223,10 @@ def create_agent_graph(checkpointer=None):
             lines.append(sep)
             lines.append("Se quiser alterar algo, clique em 'Corrigir'. Caso contrário, confirme.")
             content = "\n".join(lines)
+
+            # Começa a escrever o guia enquanto a usuária revisa os dados
+            if GUIDE_SPECULATION:
+                get_speculative_guides().start(user_data_hash(user_data), generate_guide_content, llm, dict(user_data))
         return {"messages": [AIMessage(content=content)]}
 
     def ask_confirmation(state: StateSchema) -> StateSchema:
@@ -181,91 +234,74 @@ def create_agent_graph(checkpointer=None):
         question = "Voce confirma que essas informações estão corretas e completas para prosseguirmos com o guia?"
 
         answer = interrupt(question)
+        if not answer["confirmation"]:
+            # Os dados vão mudar: o guia especulado não serve mais
+            get_speculative_guides().cancel(user_data_hash(state.get("user_data", {}) or {}))
         return {"confirmation": answer["confirmation"]}
 
-    def generate_guide(state: StateSchema) -> StateSchema:
-        user_data = state.get("user_data", {}) or {}
-        system_message = SystemMessage(content=GUIDE_SYSTEM_PROMPT)
-
-        # Mapeamento das perguntas feitas ao usuário
-        questions_map = {
-            "email": "Qual é o seu email? (Usaremos para enviar o guia personalizado)",
-            "nome": "Qual é seu nome?",
-            "idade": "Qual é sua idade?",
-            "ciclo_menstrual": "Como está o seu ciclo menstrual? (Quando foi sua última menstruação, ela tem sido regular em frequência e fluxo? Você já completou 12 meses consecutivos sem menstruar?)",
-            "sintomas_fisicos": "Quais sintomas físicos novos ou incômodos você tem sentido? (Por exemplo: ondas de calor, suores noturnos, alterações no sono, cansaço, ressecamento vaginal, mudanças na libido, ganho de peso, queda de cabelo ou infecções urinárias?)",
-            "saude_emocional": "Como você tem se sentido emocional e mentalmente? (Você notou flutuações de humor, ansiedade, irritabilidade, desânimo, ou dificuldade de memória e concentração?)",
-            "habitos_historico": "Como estão seus hábitos de saúde e histórico médico? (Incluindo medicamentos ou suplementos que você usa, seu histórico pessoal ou familiar de doenças crônicas, especialmente câncer de mama, sua rotina de alimentação, exercícios, consumo de álcool ou fumo.)",
-            "exames_tratamentos": "Quando você realizou seus últimos exames preventivos e quais tratamentos você gostaria de discutir? (Como Papanicolau, mamografia e densitometria óssea. Você já tentou algo para os sintomas ou tem interesse em discutir opções, como a terapia de reposição hormonal?)"
-        }
+    def _guide_result(state: StateSchema, content: str) -> StateSchema:
+        guide_content = extract_guide(content)
 
-        prompt_parts = [
-            "Crie um guia personalizado de menopausa com base nas seguintes informações coletadas:\n\n"
-        ]
+        if "user_data" not in state: state["user_data"] = {}
+        # Salva STR, não LISTA. O guia fica no blob store e o estado guarda a referência.
+        state["user_data"]["guide"] = offload(guide_content)
+        # O PDF fica pronto enquanto a usuária lê o guia; o send_pdf só anexa os bytes
+        prerender(guide_content)
 
-        filtered_data = {k: v for k, v in user_data.items() if k != "guide"}
-        
-        if filtered_data:
-            prompt_parts.append("=== DADOS DA PACIENTE ===\n\n")
-            for key, value in filtered_data.items():
-                label = questions_map.get(key, key)
-                val_str = str(value) if value is not None else "Não informado"
-                prompt_parts.append(f"{label} {val_str}\n\n")
-
-        prompt_parts.append(
-            "\nGere o guia completo seguindo EXATAMENTE o formato especificado no system prompt, "
-            "incluindo os marcadores [INICIO_GUIA] e [FIM_GUIA]. "
-            "Use as perguntas e respostas acima como contexto para personalizar o guia de forma detalhada e relevante."
-        )
+        return {
+            "messages": [AIMessage(content=offload(content))],
+            "user_data": state["user_data"]
+        }
 
-        user_message = HumanMessage(content="".join(prompt_parts))
+    def _guide_error(state: StateSchema, e: Exception) -> StateSchema:
+        error_msg = f"Erro técnico ao gerar guia: {str(e)}"
+        print(f"[ERROR AGENT] {error_msg}") 
+        return {
+            "messages": [AIMessage(content=f"❌ {error_msg}")],
+            "user_data": state.get("user_data", {})
+        }
+
+    def generate_guide(state: StateSchema) -> StateSchema:
+        user_data = state.get("user_data", {}) or {}
 
         try:
-            response = llm.invoke([system_message, user_message])
-            
-            # Normaliza o conteúdo AQUI antes de qualquer outra coisa
-            content = normalize_content(response.content)
-            # Atualiza o objeto response para que o app receba string limpa também
-            response.content = content 
-            
-            guide_content = content
-            if "[INICIO_GUIA]" in content and "[FIM_GUIA]" in content:
-                try:
-                    start_idx = content.find("[INICIO_GUIA]") + len("[INICIO_GUIA]")
-                    end_idx = content.find("[FIM_GUIA]")
-                    guide_content = content[start_idx:end_idx].strip()
-                except:
-                    guide_content = content
-            
-            if "user_data" not in state: state["user_data"] = {}
-            # Salva STR, não LISTA.
-            state["user_data"]["guide"] = guide_content
+            # Aproveita a geração especulativa (pronta ou em andamento), se houver
+            content = get_speculative_guides().take(user_data_hash(user_data), timeout=timeout_for("llm"))
+            if content is None:
+                # Modo "secoes" gera um trecho por tema em paralelo; "unico" faz uma só chamada
+                content = generate_guide_content(llm, user_data)
+            return _guide_result(state, content)
+        except Exception as e:
+            return _guide_error(state, e)
 
-            return {
-                "messages": [response],
-                "user_data": state["user_data"]
-            }
-        
+    async def agenerate_guide(state: StateSchema) -> StateSchema:
+        user_data = state.get("user_data", {}) or {}
+
+        try:
+            content = await get_speculative_guides().atake(user_data_hash(user_data), timeout=timeout_for("llm"))
+            if content is None:
+                content = await agenerate_guide_content(llm, user_data)
+            # offload grava no blob store (disco ou KV): fora do event loop
+            return await asyncio.to_thread(_guide_result, state, content)
         except Exception as e:
-            error_msg = f"Erro técnico ao gerar guia: {str(e)}"
-            print(f"[ERROR AGENT] {error_msg}") 
-            return {
-                "messages": [AIMessage(content=f"❌ {error_msg}")],
-                "user_data": state.get("user_data", {})
-            }
+            return _guide_error(state, e)
 
     tool_node = ToolNode(tools=TOOLS_CHAT, name="tools_chat")
     
     graph.add_node("welcome_node", welcome_node)
-    graph.add_node("chat_node", chat_node)
+    # Nós que esperam por rede têm as duas versões: invoke() usa a síncrona e
+    # ainvoke()/astream() a assíncrona, multiplexando as conversas no event loop
+    graph.add_node("chat_node", RunnableLambda(chat_node, afunc=achat_node, name="chat_node"))
     graph.add_node("tools_chat", tool_node)
-    graph.add_node("router_node", router_node)
+    graph.add_node("router_node", RunnableLambda(router_node, afunc=arouter_node, name="router_node"))
     graph.add_node("guide_node", guide_node)
     graph.add_node("personal_questions", personal_questions)
     graph.add_node("health_questions", health_questions)
     graph.add_node("show_user_data_node", show_user_data_node)
     graph.add_node("ask_confirmation", ask_confirmation)
-    graph.add_node("generate_guide", generate_guide)
+    graph.add_node("generate_guide", RunnableLambda(generate_guide, afunc=agenerate_guide, name="generate_guide"))
+    graph.add_node("questionnaire", questionnaire)
+    graph.add_node("keep_guide", keep_guide)
 
 
     # Definição de arestas
@@ -281,7 +317,7 @@ def create_agent_graph(checkpointer=None):
 
     graph.add_conditional_edges("chat_node", tools_condition, {"tools": "tools_chat", "__end__": END})
     graph.add_edge("tools_chat", "chat_node")
-    graph.add_edge("guide_node", "personal_questions")
+    graph.add_edge("guide_node", "questionnaire" if form_mode == "unico" else "personal_questions")
 
     # Condição para verificar se o usuário saiu
     def check_exit(state: StateSchema) -> Literal["continue", "end"]:
@@ -303,6 +339,23 @@ def create_agent_graph(checkpointer=None):
     
     graph.add_edge("show_user_data_node", "ask_confirmation")
 
+    # Formulário único: repete só a interrupção se houver erro e só gera o guia se algo relevante mudou
+    def questionnaire_condition(state: StateSchema) -> Literal["questionnaire", "generate_guide", "keep_guide", "end"]:
+        if state.get("exit_guide"):
+            return "end"
+        if state.get("form_errors"):
+            return "questionnaire"
+        if (state.get("user_data") or {}).get("guide"):
+            return "keep_guide"
+        return "generate_guide"
+
+    graph.add_conditional_edges(
+        "questionnaire",
+        questionnaire_condition,
+        {"questionnaire": "questionnaire", "generate_guide": "generate_guide", "keep_guide": "keep_guide", "end": END}
+    )
+    graph.add_edge("keep_guide", END)
+
     def data_condition(state: StateSchema) -> Literal["personal_questions", "generate_guide"]:
         return "generate_guide" if state.get("confirmation") else "personal_questions"
 
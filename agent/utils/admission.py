@@ -0,0 +1,307 @@
+import os
+import time
+import asyncio
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from typing import Optional
+
+# --- Configurações Globais ---
+ADMISSION_INITIAL_LIMIT = float(os.getenv("ADMISSION_INITIAL_LIMIT", "8"))
+ADMISSION_MIN_LIMIT = float(os.getenv("ADMISSION_MIN_LIMIT", "1"))
+ADMISSION_MAX_LIMIT = float(os.getenv("ADMISSION_MAX_LIMIT", "32"))
+# Diretório compartilhado para limitar a concorrência entre processos (opcional)
+ADMISSION_LOCK_DIR = os.getenv("ADMISSION_LOCK_DIR")
+ADMISSION_GLOBAL_LIMIT = int(os.getenv("ADMISSION_GLOBAL_LIMIT", "16"))
+# Intervalo mínimo entre duas reduções multiplicativas (uma rajada de 429 conta uma vez)
+AIMD_DECREASE_COOLDOWN_S = 2.0
+
+# Prioridades: menor valor é atendido primeiro
+PRIORITY_SHORT = 0   # roteador e chat
+PRIORITY_LONG = 1    # generate_guide e outras gerações longas
+
+
+class AdmissionTimeout(TimeoutError):
+    pass
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """Detecta respostas 429 dos diferentes SDKs (Groq, Cerebras, OpenAI, Gemini)."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    text = str(error).lower()
+    return "429" in text or "rate limit" in text or "resource_exhausted" in text
+
+
+def current_session() -> str:
+    """thread_id da conversa em execução (lido da config do LangGraph), usado para a fila justa."""
+    try:
+        from langgraph.config import get_config
+        return str(get_config().get("configurable", {}).get("thread_id", "default"))
+    except Exception:
+        return "default"
+
+
+class _Ticket:
+    __slots__ = ("session", "priority", "enqueued_at", "granted", "waker")
+
+    def __init__(self, session, priority, waker=None):
+        self.session = session
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        # Chamadas assíncronas são acordadas pelo event loop em vez da Condition
+        self.waker = waker
+
+
+class _CrossProcessSlots:
+    """Semáforo entre processos com N arquivos de trava (flock) em um diretório compartilhado."""
+
+    def __init__(self, directory: str, size: int):
+        import fcntl  # só existe em POSIX; a trava entre processos é opcional
+        self._fcntl = fcntl
+        os.makedirs(directory, exist_ok=True)
+        self.paths = [os.path.join(directory, f"slot_{i}.lock") for i in range(size)]
+
+    def acquire(self, timeout: Optional[float]):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_CREAT | os.O_RDWR)
+                try:
+                    self._fcntl.flock(fd, self._fcntl.LOCK_EX | self._fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise AdmissionTimeout("Nenhuma vaga global de LLM livre a tempo.")
+            time.sleep(0.05)
+
+    def release(self, fd):
+        self._fcntl.flock(fd, self._fcntl.LOCK_UN)
+        os.close(fd)
+
+
+class AdmissionController:
+    """Limita as chamadas de LLM simultâneas do processo com fila justa e limite adaptativo (AIMD).
+
+    - Fila por prioridade: chamadas curtas (roteador/chat) passam na frente de gerações longas.
+    - Dentro de cada prioridade, as sessões são atendidas em round-robin.
+    - O limite cresce +1 por "janela" de sucessos e cai pela metade ao receber 429.
+    """
+
+    def __init__(self, initial_limit=ADMISSION_INITIAL_LIMIT, min_limit=ADMISSION_MIN_LIMIT,
+                 max_limit=ADMISSION_MAX_LIMIT, lock_dir=ADMISSION_LOCK_DIR, global_limit=ADMISSION_GLOBAL_LIMIT):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = max(min_limit, min(initial_limit, max_limit))
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        # prioridade -> (sessão -> fila de tickets), em ordem de round-robin
+        self._queues = {PRIORITY_SHORT: OrderedDict(), PRIORITY_LONG: OrderedDict()}
+        self._last_decrease = 0.0
+        self._cross = _CrossProcessSlots(lock_dir, global_limit) if lock_dir else None
+        # Métricas
+        self._waits = deque(maxlen=500)
+        self._granted = 0
+        self._timeouts = 0
+        self._rate_limited = 0
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    # --- Fila ---
+
+    def _queue_depth_locked(self) -> int:
+        return sum(len(q) for sessions in self._queues.values() for q in sessions.values())
+
+    def _dispatch_locked(self):
+        """Concede vagas livres aos próximos tickets (prioridade, depois round-robin por sessão)."""
+        while self._in_flight < self.limit:
+            ticket = None
+            for priority in sorted(self._queues):
+                sessions = self._queues[priority]
+                if sessions:
+                    session, queue = next(iter(sessions.items()))
+                    ticket = queue.popleft()
+                    # A sessão volta para o fim da fila (round-robin)
+                    del sessions[session]
+                    if queue:
+                        sessions[session] = queue
+                    break
+            if ticket is None:
+                return
+            ticket.granted = True
+            self._in_flight += 1
+            if ticket.waker is not None:
+                ticket.waker()
+            self._cond.notify_all()
+
+    def _remove_locked(self, ticket):
+        sessions = self._queues[ticket.priority]
+        queue = sessions.get(ticket.session)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del sessions[ticket.session]
+
+    def acquire(self, priority=PRIORITY_SHORT, session=None, timeout: Optional[float] = None):
+        session = session or current_session()
+        ticket = _Ticket(session, priority)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queues[priority].setdefault(session, deque()).append(ticket)
+            self._dispatch_locked()
+            while not ticket.granted:
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    self._remove_locked(ticket)
+                    self._timeouts += 1
+                    raise AdmissionTimeout("Fila de LLM cheia: tempo de espera esgotado.")
+                self._cond.wait(left)
+            waited = time.monotonic() - ticket.enqueued_at
+            self._waits.append(waited)
+            self._granted += 1
+
+        if self._cross is None:
+            return None
+        try:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            return self._cross.acquire(left)
+        except AdmissionTimeout:
+            self.release()
+            raise
+
+    async def aacquire(self, priority=PRIORITY_SHORT, session=None, timeout: Optional[float] = None):
+        """Como acquire(), mas espera no event loop sem ocupar uma thread."""
+        session = session or current_session()
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        ticket = _Ticket(session, priority, wake)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._queues[priority].setdefault(session, deque()).append(ticket)
+            self._dispatch_locked()
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            cancelled = isinstance(e, asyncio.CancelledError)
+            with self._cond:
+                if not ticket.granted:
+                    self._remove_locked(ticket)
+                    if cancelled:
+                        raise
+                    self._timeouts += 1
+                    raise AdmissionTimeout("Fila de LLM cheia: tempo de espera esgotado.") from None
+            if cancelled:
+                # A vaga foi concedida junto com o cancelamento: devolve antes de propagar
+                self.release()
+                raise
+            # O timeout chegou junto com a vaga: segue com ela
+        with self._cond:
+            self._waits.append(time.monotonic() - ticket.enqueued_at)
+            self._granted += 1
+
+        if self._cross is None:
+            return None
+        try:
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            return await asyncio.to_thread(self._cross.acquire, left)
+        except AdmissionTimeout:
+            self.release()
+            raise
+
+    def release(self, cross_fd=None):
+        if cross_fd is not None:
+            self._cross.release(cross_fd)
+        with self._cond:
+            self._in_flight -= 1
+            self._dispatch_locked()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_SHORT, session=None, timeout: Optional[float] = None):
+        """Ocupa uma vaga durante a chamada e ajusta o limite conforme o resultado."""
+        cross_fd = self.acquire(priority, session, timeout)
+        try:
+            yield
+        except Exception as e:
+            self.on_result(rate_limited=is_rate_limited(e))
+            raise
+        else:
+            self.on_result(rate_limited=False)
+        finally:
+            self.release(cross_fd)
+
+    @asynccontextmanager
+    async def aslot(self, priority=PRIORITY_SHORT, session=None, timeout: Optional[float] = None):
+        cross_fd = await self.aacquire(priority, session, timeout)
+        try:
+            yield
+        except Exception as e:
+            self.on_result(rate_limited=is_rate_limited(e))
+            raise
+        else:
+            self.on_result(rate_limited=False)
+        finally:
+            self.release(cross_fd)
+
+    # --- AIMD ---
+
+    def on_result(self, rate_limited: bool):
+        with self._cond:
+            if rate_limited:
+                self._rate_limited += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= AIMD_DECREASE_COOLDOWN_S:
+                    self._limit = max(self.min_limit, self._limit / 2)
+                    self._last_decrease = now
+                    print(f"[ADMISSÃO] 429 recebido; limite de concorrência reduzido para {self.limit}")
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._dispatch_locked()
+
+    # --- Métricas ---
+
+    def metrics(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            depth_by_priority = {
+                "curta" if p == PRIORITY_SHORT else "longa": sum(len(q) for q in sessions.values())
+                for p, sessions in self._queues.items()
+            }
+
+            def pct(q):
+                return waits[min(len(waits) - 1, int(round(q * (len(waits) - 1))))] if waits else 0.0
+
+            return {
+                "limite": self.limit,
+                "em_andamento": self._in_flight,
+                "fila": self._queue_depth_locked(),
+                "fila_por_prioridade": depth_by_priority,
+                "espera_p50_s": round(pct(0.50), 4),
+                "espera_p95_s": round(pct(0.95), 4),
+                "concedidas": self._granted,
+                "timeouts": self._timeouts,
+                "respostas_429": self._rate_limited,
+            }
+
+
+# --- SINGLETON ---
+
+_admission_instance = None
+_admission_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Retorna o controlador de admissão único do processo."""
+    global _admission_instance
+    with _admission_lock:
+        if _admission_instance is None:
+            _admission_instance = AdmissionController()
+    return _admission_instance
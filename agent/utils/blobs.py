@@ -0,0 +1,154 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import zstandard
+
+from agent.utils.cache import DiskCache
+from agent.utils.kv import shared_cache
+
+# --- Configurações Globais ---
+BLOB_DIR = os.getenv("BLOB_DIR", os.path.join(".cache", "blobs"))
+BLOB_MAX_MB = float(os.getenv("BLOB_MAX_MB", "1024"))
+# Textos menores que isso ficam no próprio estado (a referência não compensaria)
+BLOB_MIN_BYTES = int(os.getenv("BLOB_MIN_BYTES", "2048"))
+BLOB_MEMORY_ENTRIES = 128
+# Na camada compartilhada os blobs expiram sozinhos: o dobro do TTL das conversas que os referenciam
+BLOB_TTL_S = 2 * float(os.getenv("CHECKPOINT_TTL_H", "72")) * 3600
+
+BLOB_REF_PREFIX = "blob:sha256:"
+BLOB_MISSING_MSG = "⚠️ Conteúdo não está mais disponível (expirou)."
+
+
+class BlobMissingError(LookupError):
+    """A referência aponta para um blob que não existe mais (despejado ou expirado)."""
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX) and len(value) == len(BLOB_REF_PREFIX) + 64
+
+
+class BlobStore:
+    """Textos grandes endereçados por conteúdo (sha256), fora dos checkpoints.
+
+    O estado do grafo guarda só a referência "blob:sha256:<hash>"; o texto é comprimido
+    com zstd no armazenamento (disco local ou camada compartilhada) e resolvido sob demanda,
+    com um LRU em memória (o conteúdo é imutável).
+    """
+
+    def __init__(self, directory: str = BLOB_DIR, max_bytes: int = int(BLOB_MAX_MB * 1024 * 1024),
+                 min_bytes: int = BLOB_MIN_BYTES, backend=None):
+        self.disk = backend if backend is not None else DiskCache(directory, max_bytes)
+        self.min_bytes = min_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _codecs(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=3)
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.compressor, self._local.decompressor
+
+    def _remember(self, digest: str, text: str):
+        with self._lock:
+            self._memory[digest] = text
+            self._memory.move_to_end(digest)
+            while len(self._memory) > BLOB_MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def put(self, text: str) -> str:
+        """Grava o texto e retorna a referência."""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        # Mesmo conteúdo, mesma chave: só regrava se ainda não existir (se existir, renova o TTL/LRU)
+        if not self.disk.touch(digest):
+            compressor, _ = self._codecs()
+            self.disk.set_bytes(digest, compressor.compress(data))
+        self._remember(digest, text)
+        return BLOB_REF_PREFIX + digest
+
+    def get(self, ref: str) -> Optional[str]:
+        digest = ref[len(BLOB_REF_PREFIX):]
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return self._memory[digest]
+        data = self.disk.get_bytes(digest)
+        if data is None:
+            return None
+        self.disk.touch(digest)  # na camada compartilhada, um blob lido continua vivo por mais um TTL
+        _, decompressor = self._codecs()
+        text = decompressor.decompress(data).decode("utf-8")
+        self._remember(digest, text)
+        return text
+
+    def offload(self, text: str) -> str:
+        """Retorna a referência se o texto for grande; caso contrário, o próprio texto."""
+        if not isinstance(text, str) or len(text.encode("utf-8")) < self.min_bytes:
+            return text
+        return self.put(text)
+
+    def resolve(self, value, strict: bool = False):
+        """Troca uma referência pelo texto (valores comuns passam direto).
+
+        Blob ausente vira o aviso BLOB_MISSING_MSG, ou BlobMissingError com `strict` (quando o
+        texto vai para fora, como o PDF do email, e o aviso não pode tomar o lugar do conteúdo).
+        """
+        if not is_blob_ref(value):
+            return value
+        text = self.get(value)
+        if text is None:
+            print(f"[WARNING] Blob não encontrado: {value[:24]}...")
+            if strict:
+                raise BlobMissingError(value)
+            return BLOB_MISSING_MSG
+        return text
+
+    def resolve_messages(self, messages: list) -> list:
+        """Cópias das mensagens com o conteúdo resolvido, para enviar ao LLM."""
+        resolved = []
+        for message in messages:
+            if is_blob_ref(message.content):
+                message = message.model_copy(update={"content": self.resolve(message.content)})
+            resolved.append(message)
+        return resolved
+
+    def expire(self, max_age_s: float) -> int:
+        """Apaga blobs sem acesso há mais de `max_age_s` segundos. Retorna quantos foram apagados."""
+        return self.disk.expire(max_age_s)
+
+    def stats(self) -> dict:
+        stats = self.disk.stats()
+        stats["em_memoria"] = len(self._memory)
+        return stats
+
+
+# --- SINGLETON ---
+
+_blob_store_instance = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Retorna o armazenamento de blobs único do processo."""
+    global _blob_store_instance
+    with _blob_store_lock:
+        if _blob_store_instance is None:
+            _blob_store_instance = BlobStore(backend=shared_cache(
+                "blobs", BLOB_TTL_S, lambda: DiskCache(BLOB_DIR, int(BLOB_MAX_MB * 1024 * 1024))))
+    return _blob_store_instance
+
+
+def offload(text: str) -> str:
+    return get_blob_store().offload(text)
+
+
+def resolve(value, strict: bool = False):
+    return get_blob_store().resolve(value, strict)
+
+
+def resolve_messages(messages: list) -> list:
+    return get_blob_store().resolve_messages(messages)
@@ -0,0 +1,231 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+def content_key(*parts) -> str:
+    """Chave de conteúdo: sha256 das partes (strings) separadas por um delimitador nulo."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class DiskCache:
+    """Cache em disco endereçado por conteúdo, com limite de tamanho e despejo LRU.
+
+    Cada entrada é um arquivo `<dir>/<2 primeiros hex>/<chave>`; o mtime marca o último
+    acesso, de modo que o despejo remove primeiro as entradas menos usadas.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes = None  # calculado sob demanda
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _total_locked(self) -> int:
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        return self._total_bytes
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # marca o acesso para o LRU
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return data
+
+    def set_bytes(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        with self._lock:
+            # Total antes do replace: a varredura da primeira escrita não pode contar o arquivo novo
+            total = self._total_locked()
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            self._total_bytes = total - previous + len(data)
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def touch(self, key: str) -> bool:
+        """Marca o acesso (LRU) sem ler o conteúdo. Retorna False se a entrada não existir."""
+        try:
+            os.utime(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get(self, key: str) -> Optional[str]:
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def set(self, key: str, value: str):
+        self.set_bytes(key, value.encode("utf-8"))
+
+    def delete(self, key: str):
+        with self._lock:
+            try:
+                size = os.path.getsize(self._path(key))
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                return
+            if self._total_bytes is not None:
+                self._total_bytes -= size
+
+    def _evict_locked(self):
+        # Despeja até 90% do limite para não despejar a cada escrita
+        target = int(self.max_bytes * 0.9)
+        total = 0
+        entries = sorted(self._entries(), reverse=True)  # mais recentes primeiro
+        for _, size, path in entries:
+            total += size
+            if total > target:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        self._total_bytes = total
+
+    def expire(self, max_age_s: float) -> int:
+        """Remove entradas sem acesso há mais de `max_age_s` segundos. Retorna quantas foram apagadas."""
+        cutoff = time.time() - max_age_s
+        with self._lock:
+            removed = 0
+            for mtime, size, path in self._entries():
+                if mtime < cutoff:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except FileNotFoundError:
+                        pass
+            self._total_bytes = None  # recalculado na próxima escrita
+            return removed
+
+    def clear(self) -> int:
+        """Remove todas as entradas. Retorna quantas foram apagadas."""
+        with self._lock:
+            removed = 0
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            self._total_bytes = 0
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._entries()
+            return {
+                "entradas": len(entries),
+                "bytes": sum(size for _, size, _ in entries),
+                "limite_bytes": self.max_bytes,
+                "acertos": self.hits,
+                "faltas": self.misses,
+            }
+
+
+class MemoryCache:
+    """LRU em memória do processo com a mesma interface do DiskCache (limite por número de entradas)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def set_bytes(self, key: str, data: bytes):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def touch(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._entries.move_to_end(key)
+            return True
+
+    def get(self, key: str) -> Optional[str]:
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def set(self, key: str, value: str):
+        self.set_bytes(key, value.encode("utf-8"))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def expire(self, max_age_s: float) -> int:
+        return 0
+
+    def clear(self) -> int:
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entradas": len(self._entries), "limite_entradas": self.max_entries,
+                    "acertos": self.hits, "faltas": self.misses}
@@ -0,0 +1,318 @@
+import os
+import json
+import time
+import base64
+import asyncio
+import smtplib
+import builtins
+import threading
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode
+
+import httpx
+import zstandard
+from dotenv import load_dotenv
+
+from agent.utils.cache import content_key
+
+load_dotenv()
+
+# --- Configurações Globais ---
+# "" (desligado), "gravar" (chama os serviços e grava as interações) ou "reproduzir" (só a fita, sem rede)
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+CASSETTE_NAME = os.getenv("CASSETTE_NAME", "padrao")
+# Latência na reprodução: "0" (velocidade máxima), segundos fixos por interação ou "gravada"
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "0")
+
+RECORD, REPLAY = "gravar", "reproduzir"
+# Parâmetros de URL que nunca entram na chave nem no arquivo (credenciais)
+SECRET_PARAMS = {"key", "api_key", "apikey"}
+KEPT_HEADERS = {"content-type"}
+
+
+class CassetteMiss(RuntimeError):
+    """A reprodução recebeu uma requisição que não está na fita."""
+
+
+def request_kind(url: httpx.URL) -> str:
+    host, path = url.host, url.path
+    if "qdrant" in host or path.startswith("/collections"):
+        return "qdrant"
+    if "embed" in path:
+        return "embedding"
+    if any(name in host for name in ("groq", "cerebras", "openai", "generativelanguage", "googleapis")):
+        return "llm"
+    return "http"
+
+
+def _canonical_url(url: httpx.URL) -> str:
+    query = sorted((k, v) for k, v in parse_qsl(url.query.decode("utf-8")) if k.lower() not in SECRET_PARAMS)
+    return f"{url.scheme}://{url.host}{url.path}" + (f"?{urlencode(query)}" if query else "")
+
+
+def _canonical_body(body: bytes) -> str:
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+    except (ValueError, UnicodeDecodeError):
+        return body.hex()
+
+
+def _text(value) -> str:
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else str(value)
+
+
+def _smtp_failure(error: Exception) -> dict:
+    """Campos gravados de um envio SMTP que falhou (qualquer exceção, não só as respostas do servidor)."""
+    failure = {"s": getattr(error, "smtp_code", 0), "classe": type(error).__name__,
+               "erro": _text(getattr(error, "smtp_error", error))}
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        failure["destinatarios"] = {addr: [code, _text(msg)] for addr, (code, msg) in error.recipients.items()}
+    return failure
+
+
+def _smtp_error(episode: dict) -> Exception:
+    """Recria a exceção de um envio SMTP gravado."""
+    from agent.utils import outbox
+
+    name, code, message = episode.get("classe"), episode["s"], episode.get("erro", "falha gravada")
+    if name is None:
+        return smtplib.SMTPResponseException(code, message)  # fitas gravadas antes da classe
+    cls = getattr(smtplib, name, None) or getattr(outbox, name, None) or getattr(builtins, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return smtplib.SMTPException(f"{name}: {message}")
+    if issubclass(cls, smtplib.SMTPRecipientsRefused):
+        return cls({addr: (c, m.encode("utf-8")) for addr, (c, m) in episode.get("destinatarios", {}).items()})
+    if issubclass(cls, smtplib.SMTPSenderRefused):
+        return cls(code, message.encode("utf-8"), "")
+    if issubclass(cls, smtplib.SMTPResponseException):
+        return cls(code, message.encode("utf-8"))
+    return cls(message)
+
+
+class Cassette:
+    """Fita de interações (HTTP dos clientes de LLM, embeddings e Qdrant, e o envio SMTP).
+
+    Cada interação é uma linha JSON acrescentada a `<dir>/<nome>.jsonl`, com a chave da
+    requisição (método, URL sem credenciais e corpo canônico, em sha256) e a resposta com o
+    corpo comprimido (zstd). Requisições iguais gravadas várias vezes são reproduzidas na
+    ordem em que aconteceram (depois, repete a última).
+    """
+
+    def __init__(self, name: str = CASSETTE_NAME, mode: str = REPLAY, directory: str = CASSETTE_DIR,
+                 latency: str = CASSETTE_LATENCY):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"CASSETTE_MODE inválido: {mode!r} (use '{RECORD}' ou '{REPLAY}')")
+        self.mode = mode
+        self.path = os.path.join(directory, f"{name}.jsonl")
+        self.latency = latency
+        self.episodes = {}  # chave -> respostas na ordem de gravação
+        self._served = {}
+        self._lock = threading.Lock()
+        self._compressor = zstandard.ZstdCompressor(level=10)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self.counts = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        episode = json.loads(line)
+                        self.episodes.setdefault(episode["k"], []).append(episode)
+        elif mode == REPLAY:
+            raise FileNotFoundError(f"Fita {self.path} não existe: grave antes com CASSETTE_MODE={RECORD}")
+        os.makedirs(directory, exist_ok=True)
+
+    # --- Gravação e busca ---
+
+    def _count(self, kind: str, outcome: str):
+        counts = self.counts.setdefault(kind, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+    def _append(self, episode: dict):
+        with self._lock:
+            # A mesma resposta para a mesma requisição não precisa de outra linha
+            if any(e.get("b") == episode.get("b") and e.get("s") == episode.get("s")
+                   and e.get("classe") == episode.get("classe") for e in self.episodes.get(episode["k"], [])):
+                return
+            self.episodes.setdefault(episode["k"], []).append(episode)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(episode, ensure_ascii=False) + "\n")
+
+    def _next(self, key: str, kind: str, summary: str) -> dict:
+        with self._lock:
+            episodes = self.episodes.get(key)
+            if not episodes:
+                self._count(kind, "faltas")
+                print(f"[WARNING] Interação fora da fita {self.path}: {summary}")
+                raise CassetteMiss(f"{summary} não está na fita {self.path}")
+            index = self._served.get(key, 0)
+            self._served[key] = index + 1
+            self._count(kind, "reproduzidas")
+            return episodes[min(index, len(episodes) - 1)]
+
+    def _delay(self, episode: dict) -> float:
+        if self.latency == "gravada":
+            return episode.get("t", 0.0)
+        return float(self.latency or 0)
+
+    def _pack(self, data: bytes) -> str:
+        return base64.b64encode(self._compressor.compress(data)).decode("ascii")
+
+    def _unpack(self, data: str) -> bytes:
+        return self._decompressor.decompress(base64.b64decode(data))
+
+    # --- HTTP ---
+
+    def _http_key(self, request: httpx.Request, body: bytes):
+        url = _canonical_url(request.url)
+        summary = f"{request.method} {url}"
+        return content_key(request.method, url, _canonical_body(body)), summary
+
+    def _http_episode(self, key, kind, summary, response: httpx.Response, elapsed: float) -> dict:
+        return {
+            "k": key, "tipo": kind, "req": summary, "s": response.status_code,
+            "h": {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS},
+            "b": self._pack(response.content), "t": round(elapsed, 4),
+        }
+
+    def _http_response(self, episode: dict, request, response_cls):
+        return response_cls(episode["s"], headers=episode.get("h"), content=self._unpack(episode["b"]),
+                            request=request)
+
+    def handle(self, request: httpx.Request, send, response_cls=httpx.Response) -> httpx.Response:
+        kind = request_kind(request.url)
+        key, summary = self._http_key(request, request.read())
+        if self.mode == REPLAY:
+            episode = self._next(key, kind, summary)
+            delay = self._delay(episode)
+            if delay:
+                time.sleep(delay)
+            return self._http_response(episode, request, response_cls)
+
+        start = time.perf_counter()
+        response = send()
+        # Respostas em streaming são lidas inteiras na gravação (a reprodução entrega o mesmo conteúdo)
+        response.read()
+        self._append(self._http_episode(key, kind, summary, response, time.perf_counter() - start))
+        self._count(kind, "gravadas")
+        return response
+
+    async def ahandle(self, request: httpx.Request, send, response_cls=httpx.Response) -> httpx.Response:
+        kind = request_kind(request.url)
+        key, summary = self._http_key(request, await request.aread())
+        if self.mode == REPLAY:
+            episode = self._next(key, kind, summary)
+            delay = self._delay(episode)
+            if delay:
+                await asyncio.sleep(delay)
+            return self._http_response(episode, request, response_cls)
+
+        start = time.perf_counter()
+        response = await send()
+        await response.aread()
+        episode = self._http_episode(key, kind, summary, response, time.perf_counter() - start)
+        await asyncio.to_thread(self._append, episode)
+        self._count(kind, "gravadas")
+        return response
+
+    # --- SMTP ---
+
+    def smtp_send(self, msg, send):
+        """Envio de uma mensagem do outbox: na reprodução, repete o resultado gravado sem abrir conexão."""
+        summary = f"SMTP {msg.get('To')} {msg.get('Subject')}"
+        key = content_key("smtp", msg.get("To"), msg.get("Subject"))
+        if self.mode == REPLAY:
+            episode = self._next(key, "smtp", summary)
+            delay = self._delay(episode)
+            if delay:
+                time.sleep(delay)
+            if episode["s"] != 250 or "classe" in episode:
+                raise _smtp_error(episode)
+            return None
+
+        start = time.perf_counter()
+        episode = {"k": key, "tipo": "smtp", "req": summary, "s": 250}
+        try:
+            return send()
+        except Exception as e:
+            # Toda falha é gravada (desconexão, timeout, autenticação, recusa definitiva) para ser repetida
+            episode.update(_smtp_failure(e))
+            raise
+        finally:
+            episode["t"] = round(time.perf_counter() - start, 4)
+            self._append(episode)
+            self._count("smtp", "gravadas")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "modo": self.mode,
+                "arquivo": self.path,
+                "interacoes": sum(len(e) for e in self.episodes.values()),
+                "por_tipo": {kind: dict(c) for kind, c in self.counts.items()},
+            }
+
+
+# --- Instalação nos clientes ---
+
+def _http_modules() -> list:
+    """httpx e o fork httpx2 (usado pelo SDK da OpenAI), quando instalado: a mesma API de transporte."""
+    modules = [httpx]
+    try:
+        import httpx2
+        modules.append(httpx2)
+    except ImportError:
+        pass
+    return modules
+
+
+def _patch_transports(module):
+    original = module.HTTPTransport.handle_request
+    original_async = module.AsyncHTTPTransport.handle_async_request
+
+    def handle_request(transport, request):
+        return _cassette_instance.handle(request, lambda: original(transport, request), module.Response)
+
+    async def handle_async_request(transport, request):
+        return await _cassette_instance.ahandle(request, lambda: original_async(transport, request), module.Response)
+
+    module.HTTPTransport.handle_request = handle_request
+    module.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+
+# --- SINGLETON ---
+
+_cassette_instance = None
+_cassette_lock = threading.Lock()
+
+
+def install_cassettes(mode: str = CASSETTE_MODE, name: str = CASSETTE_NAME,
+                      directory: str = CASSETTE_DIR) -> Optional[Cassette]:
+    """Liga a fita nos transportes do httpx/httpx2 (Groq, Cerebras, Gemini, Qdrant e OpenAI) e no SMTP do outbox.
+
+    Sem modo definido não faz nada. Clientes que não usam httpx (ex.: google-genai com aiohttp
+    instalado, modelos de embedding locais) seguem sem a fita.
+    """
+    global _cassette_instance
+    if not mode:
+        return None
+    with _cassette_lock:
+        if _cassette_instance is None:
+            from agent.utils import outbox
+
+            _cassette_instance = Cassette(name, mode, directory)
+            for module in _http_modules():
+                _patch_transports(module)
+            original_send = outbox.SmtpConnection.send
+
+            def smtp_send(connection, msg):
+                return _cassette_instance.smtp_send(msg, lambda: original_send(connection, msg))
+
+            outbox.SmtpConnection.send = smtp_send
+            print(f"[SISTEMA] Fita de interações em modo '{mode}': {_cassette_instance.path} "
+                  f"({sum(len(e) for e in _cassette_instance.episodes.values())} gravadas)")
+    return _cassette_instance
+
+
+def get_cassette() -> Optional[Cassette]:
+    return _cassette_instance
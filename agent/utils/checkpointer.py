@@ -0,0 +1,416 @@
+import os
+import json
+import time
+import asyncio
+import random
+import sqlite3
+import threading
+from typing import Any, AsyncIterator, Iterator, Optional
+
+import ormsgpack
+import zstandard
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP, BaseCheckpointSaver, CheckpointTuple, get_checkpoint_id, get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from agent.utils.blobs import get_blob_store
+from agent.utils.kv import get_kv, KV_PREFIX
+
+# --- Configurações Globais ---
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(".cache", "checkpoints.sqlite"))
+# Quantos checkpoints manter por conversa (o último basta para retomar; os demais servem de histórico)
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "5"))
+# Conversas sem atividade há mais tempo que isso são apagadas pela manutenção
+CHECKPOINT_TTL_S = float(os.getenv("CHECKPOINT_TTL_H", "72")) * 3600
+CHECKPOINT_MAINTENANCE_S = float(os.getenv("CHECKPOINT_MAINTENANCE_S", "600"))
+# Payloads menores que isso não compensam a compressão
+ZSTD_MIN_BYTES = 256
+ZSTD_LEVEL = 3
+
+
+class ZstdSerializer(SerializerProtocol):
+    """Envolve o serializador padrão (msgpack) e comprime com zstd os payloads maiores.
+
+    O tipo gravado ganha o sufixo "+zstd", então bancos antigos (sem compressão) continuam legíveis.
+    """
+
+    SUFFIX = "+zstd"
+
+    def __init__(self, serde: SerializerProtocol = None, level: int = ZSTD_LEVEL):
+        self.serde = serde or JsonPlusSerializer()
+        self.level = level
+        self._local = threading.local()  # compressores do zstd não são thread-safe
+
+    def _codecs(self):
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(level=self.level)
+            self._local.decompressor = zstandard.ZstdDecompressor()
+        return self._local.compressor, self._local.decompressor
+
+    def dumps_typed(self, obj: Any) -> tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(obj)
+        if len(data) < ZSTD_MIN_BYTES:
+            return type_, data
+        compressor, _ = self._codecs()
+        return type_ + self.SUFFIX, compressor.compress(data)
+
+    def loads_typed(self, data: tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            _, decompressor = self._codecs()
+            return self.serde.loads_typed((type_[:-len(self.SUFFIX)], decompressor.decompress(payload)))
+        return self.serde.loads_typed(data)
+
+
+class ThreadedAsyncMixin:
+    """Métodos assíncronos do checkpointer rodando os síncronos em threads.
+
+    Permite usar o mesmo checkpointer com ainvoke()/astream() sem bloquear o event loop
+    (o SqliteSaver não tem versão assíncrona e a camada compartilhada usa o cliente síncrono).
+    """
+
+    async def aget_tuple(self, config) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+class PrunedSqliteSaver(ThreadedAsyncMixin, SqliteSaver):
+    """SqliteSaver em modo WAL que mantém só os últimos N checkpoints de cada conversa.
+
+    Também registra a última atividade de cada conversa, usada pela manutenção para
+    apagar conversas expiradas (TTL) e devolver espaço ao disco.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, *, serde: SerializerProtocol = None,
+                 keep_last: int = CHECKPOINT_KEEP_LAST, ttl_s: float = CHECKPOINT_TTL_S):
+        super().__init__(conn, serde=serde or ZstdSerializer())
+        self.keep_last = max(1, keep_last)
+        self.ttl_s = ttl_s
+        self.pruned = 0
+        self.expired_threads = 0
+        self._stop = threading.Event()
+        self._maintenance_thread = None
+
+    @classmethod
+    def from_path(cls, path: str, **kwargs) -> "PrunedSqliteSaver":
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = sqlite3.connect(path, check_same_thread=False)
+        # auto_vacuum só tem efeito se definido antes da criação das tabelas
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return cls(conn, **kwargs)
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                (thread_id, time.time()),
+            )
+            # checkpoint_id é um uuid6: a ordem lexicográfica é a ordem cronológica
+            cur.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                       SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                       ORDER BY checkpoint_id DESC LIMIT ?)""",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last),
+            )
+            removed = cur.rowcount
+            if removed > 0:
+                self.pruned += removed
+                cur.execute(
+                    """DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                           SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)""",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+        return saved
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+
+    # --- Manutenção ---
+
+    def maintenance(self) -> dict:
+        """Apaga conversas expiradas, trunca o WAL e devolve páginas livres ao disco."""
+        cutoff = time.time() - self.ttl_s
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,))
+            expired = [row[0] for row in cur.fetchall()]
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        self.expired_threads += len(expired)
+        # Blobs (documentos/guias) referenciados pelos checkpoints: folga de 2x o TTL das conversas
+        expired_blobs = get_blob_store().expire(2 * self.ttl_s)
+        with self.cursor() as cur:
+            cur.execute("PRAGMA incremental_vacuum")
+            cur.fetchall()
+        with self.cursor(transaction=False) as cur:
+            cur.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            cur.fetchall()
+        if expired:
+            print(f"[SISTEMA] Checkpointer: {len(expired)} conversa(s) expirada(s) removida(s).")
+        return {"conversas_expiradas": len(expired), "blobs_expirados": expired_blobs}
+
+    def _maintenance_loop(self, interval_s: float):
+        while not self._stop.wait(interval_s):
+            try:
+                self.maintenance()
+            except Exception as e:
+                print(f"[WARNING] Falha na manutenção do checkpointer: {e}")
+
+    def start_maintenance(self, interval_s: float = CHECKPOINT_MAINTENANCE_S):
+        if self._maintenance_thread is None:
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, args=(interval_s,), daemon=True, name="checkpoint-maintenance"
+            )
+            self._maintenance_thread.start()
+        return self
+
+    def stop_maintenance(self):
+        self._stop.set()
+
+    def stats(self) -> dict:
+        with self.cursor(transaction=False) as cur:
+            threads = cur.execute("SELECT COUNT(*) FROM thread_activity").fetchone()[0]
+            checkpoints = cur.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+            writes = cur.execute("SELECT COUNT(*) FROM writes").fetchone()[0]
+            page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+            pages = cur.execute("PRAGMA page_count").fetchone()[0]
+            free_pages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+        return {
+            "conversas": threads,
+            "checkpoints": checkpoints,
+            "writes": writes,
+            "bytes_banco": page_size * pages,
+            "bytes_livres": page_size * free_pages,
+            "checkpoints_podados": self.pruned,
+            "conversas_expiradas": self.expired_threads,
+        }
+
+
+class KVSaver(ThreadedAsyncMixin, BaseCheckpointSaver):
+    """Checkpointer na camada compartilhada (protocolo do Redis): qualquer réplica retoma qualquer thread_id.
+
+    Layout das chaves (prefixo KV_PREFIX):
+    - ckpts:<thread>:<ns>        lista dos checkpoint_id, do mais novo para o mais antigo (podada em N);
+    - ckpt:<thread>:<ns>:<id>    registro do checkpoint (pai, tipo, checkpoint, metadata);
+    - writes:<thread>:<ns>:<id>  hash "<task_id>:<idx>" -> write pendente;
+    - ns:<thread>                namespaces da conversa (para apagar a conversa inteira).
+    Toda escrita renova o TTL das chaves da conversa, então a expiração dispensa a manutenção.
+    """
+
+    def __init__(self, client, *, serde: SerializerProtocol = None,
+                 keep_last: int = CHECKPOINT_KEEP_LAST, ttl_s: float = CHECKPOINT_TTL_S):
+        super().__init__(serde=serde or ZstdSerializer())
+        self.client = client
+        self.keep_last = max(1, keep_last)
+        self.ttl_s = int(ttl_s)
+        self.pruned = 0
+
+    # --- Chaves ---
+
+    @staticmethod
+    def _index_key(thread_id, ns):
+        return f"{KV_PREFIX}ckpts:{thread_id}:{ns}"
+
+    @staticmethod
+    def _checkpoint_key(thread_id, ns, checkpoint_id):
+        return f"{KV_PREFIX}ckpt:{thread_id}:{ns}:{checkpoint_id}"
+
+    @staticmethod
+    def _writes_key(thread_id, ns, checkpoint_id):
+        return f"{KV_PREFIX}writes:{thread_id}:{ns}:{checkpoint_id}"
+
+    @staticmethod
+    def _ns_key(thread_id):
+        return f"{KV_PREFIX}ns:{thread_id}"
+
+    @staticmethod
+    def _text(value) -> str:
+        return value.decode("utf-8") if isinstance(value, bytes) else value
+
+    # --- Leitura ---
+
+    def _load(self, thread_id: str, ns: str, checkpoint_id: str) -> Optional[CheckpointTuple]:
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self._checkpoint_key(thread_id, ns, checkpoint_id))
+        pipe.hgetall(self._writes_key(thread_id, ns, checkpoint_id))
+        record, writes = pipe.execute()
+        if record is None:
+            return None
+        parent_id, type_, checkpoint, metadata = ormsgpack.unpackb(record)
+        pending = []
+        for field, value in (writes or {}).items():
+            task_id, idx = self._text(field).rsplit(":", 1)
+            task_path, channel, w_type, w_value = ormsgpack.unpackb(value)
+            pending.append(((task_path, task_id, int(idx)), task_id, channel, w_type, w_value))
+        pending.sort(key=lambda item: item[0])
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            self.serde.loads_typed((type_, checkpoint)),
+            json.loads(metadata) if metadata else {},
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+            if parent_id else None,
+            [(task_id, channel, self.serde.loads_typed((w_type, w_value)))
+             for _, task_id, channel, w_type, w_value in pending],
+        )
+
+    def get_tuple(self, config) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            latest = self.client.lindex(self._index_key(thread_id, ns), 0)
+            if latest is None:
+                return None
+            checkpoint_id = self._text(latest)
+        return self._load(thread_id, ns, checkpoint_id)
+
+    def list(self, config, *, filter=None, before=None, limit=None) -> Iterator[CheckpointTuple]:
+        if config is None:
+            raise ValueError("KVSaver.list exige um thread_id.")
+        thread_id = str(config["configurable"]["thread_id"])
+        namespaces = (
+            [config["configurable"]["checkpoint_ns"]] if "checkpoint_ns" in config["configurable"]
+            else sorted(self._text(ns) for ns in self.client.smembers(self._ns_key(thread_id))) or [""]
+        )
+        before_id = get_checkpoint_id(before) if before else None
+        yielded = 0
+        for ns in namespaces:
+            ids = [self._text(i) for i in self.client.lrange(self._index_key(thread_id, ns), 0, -1)]
+            for checkpoint_id in ids:
+                if before_id and checkpoint_id >= before_id:
+                    continue
+                item = self._load(thread_id, ns, checkpoint_id)
+                if item is None:
+                    continue
+                if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                    continue
+                yield item
+                yielded += 1
+                if limit is not None and yielded >= limit:
+                    return
+
+    # --- Escrita ---
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = config["configurable"]["checkpoint_ns"]
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        serialized_metadata = json.dumps(get_checkpoint_metadata(config, metadata), ensure_ascii=False)
+        record = ormsgpack.packb([config["configurable"].get("checkpoint_id"), type_, serialized,
+                                  serialized_metadata.encode("utf-8", "ignore")])
+        index_key = self._index_key(thread_id, ns)
+
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(self._checkpoint_key(thread_id, ns, checkpoint["id"]), record, ex=self.ttl_s)
+        pipe.lpush(index_key, checkpoint["id"])
+        pipe.lrange(index_key, self.keep_last, -1)
+        pipe.ltrim(index_key, 0, self.keep_last - 1)
+        pipe.expire(index_key, self.ttl_s)
+        pipe.sadd(self._ns_key(thread_id), ns)
+        pipe.expire(self._ns_key(thread_id), self.ttl_s)
+        dropped = [self._text(i) for i in pipe.execute()[2]]
+
+        if dropped:
+            self.pruned += len(dropped)
+            keys = [self._checkpoint_key(thread_id, ns, i) for i in dropped]
+            keys += [self._writes_key(thread_id, ns, i) for i in dropped]
+            self.client.delete(*keys)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = str(config["configurable"]["checkpoint_ns"])
+        key = self._writes_key(thread_id, ns, config["configurable"]["checkpoint_id"])
+        # Mesma semântica do SqliteSaver: canais especiais substituem, os demais não sobrescrevem
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        pipe = self.client.pipeline(transaction=True)
+        for idx, (channel, value) in enumerate(writes):
+            field = f"{task_id}:{WRITES_IDX_MAP.get(channel, idx)}"
+            packed = ormsgpack.packb([task_path, channel, *self.serde.dumps_typed(value)])
+            if replace:
+                pipe.hset(key, field, packed)
+            else:
+                pipe.hsetnx(key, field, packed)
+        pipe.expire(key, self.ttl_s)
+        pipe.execute()
+
+    def delete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        namespaces = [self._text(ns) for ns in self.client.smembers(self._ns_key(thread_id))] or [""]
+        keys = [self._ns_key(thread_id)]
+        for ns in namespaces:
+            ids = [self._text(i) for i in self.client.lrange(self._index_key(thread_id, ns), 0, -1)]
+            keys.append(self._index_key(thread_id, ns))
+            keys += [self._checkpoint_key(thread_id, ns, i) for i in ids]
+            keys += [self._writes_key(thread_id, ns, i) for i in ids]
+        self.client.delete(*keys)
+
+    def get_next_version(self, current, channel=None) -> str:
+        # Mesmo formato do SqliteSaver: "<versão>.<aleatório>", crescente como string
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    def maintenance(self) -> dict:
+        # Checkpoints expiram pelo TTL do próprio KV
+        return {"conversas_expiradas": 0}
+
+    def stats(self) -> dict:
+        return {"backend": "kv", "checkpoints_podados": self.pruned}
+
+
+# --- SINGLETON ---
+
+_checkpointer_instance = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer():
+    """Retorna o checkpointer único do processo: na camada compartilhada (KV_URL) ou no SQLite local."""
+    global _checkpointer_instance
+    with _checkpointer_lock:
+        if _checkpointer_instance is None:
+            client = get_kv()
+            if client is not None:
+                _checkpointer_instance = KVSaver(client)
+                print("[SISTEMA] Checkpoints persistidos na camada compartilhada")
+            else:
+                _checkpointer_instance = PrunedSqliteSaver.from_path(CHECKPOINT_DB).start_maintenance()
+                print(f"[SISTEMA] Checkpoints persistidos em {CHECKPOINT_DB}")
+    return _checkpointer_instance
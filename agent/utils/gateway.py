@@ -0,0 +1,536 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeout
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from dotenv import load_dotenv
+
+from agent.utils.admission import get_admission, is_rate_limited, AdmissionTimeout, PRIORITY_SHORT
+from agent.utils.resilience import get_breaker, timeout_for, CircuitBreaker, DeadlineExceeded
+
+load_dotenv()
+
+# --- Configurações Globais ---
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))  # teto; o prazo do turno pode reduzir
+HEDGE_DEFAULT_DELAY_S = float(os.getenv("LLM_HEDGE_DELAY_S", "1.5"))
+STATS_WINDOW = 50
+# Acima desta taxa de erro (na janela) o provedor é considerado não saudável
+MAX_ERROR_RATE = 0.5
+
+
+class ProviderStats:
+    """Janela deslizante de latência e erros de um provedor."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self._samples = deque(maxlen=window)  # (latência em s, sucesso)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self._lock:
+            self._samples.append((latency, ok))
+
+    def _latencies(self):
+        with self._lock:
+            return sorted(lat for lat, ok in self._samples if ok)
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            return sum(1 for _, ok in self._samples if not ok) / len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        lats = self._latencies()
+        if not lats:
+            return None
+        idx = min(len(lats) - 1, int(round(q * (len(lats) - 1))))
+        return lats[idx]
+
+    def p50(self) -> Optional[float]:
+        return self.percentile(0.50)
+
+    def p95(self) -> Optional[float]:
+        return self.percentile(0.95)
+
+    def healthy(self) -> bool:
+        # Poucas amostras ainda não dizem nada sobre a saúde do provedor
+        return self.count < 4 or self.error_rate() < MAX_ERROR_RATE
+
+    def snapshot(self) -> dict:
+        return {
+            "amostras": self.count,
+            "p50_s": self.p50(),
+            "p95_s": self.p95(),
+            "taxa_erro": round(self.error_rate(), 3),
+        }
+
+
+@dataclass
+class Provider:
+    """Um provedor de LLM. O cliente LangChain é criado sob demanda."""
+    name: str
+    model: str
+    factory: Callable[[], Any]
+    stats: ProviderStats = field(default_factory=ProviderStats)
+    _client: Any = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.factory()
+        return self._client
+
+    @property
+    def breaker(self):
+        return get_breaker(f"llm:{self.name}")
+
+
+# --- Fábricas de provedores ---
+
+def _groq_provider(model="openai/gpt-oss-120b"):
+    def factory():
+        from langchain_groq import ChatGroq
+        return ChatGroq(
+            temperature=0,
+            model_name=model,
+            api_key=os.getenv("GROQ_API_KEY"),
+            max_retries=0,
+            timeout=LLM_TIMEOUT_S,
+        )
+    return Provider("groq", model, factory)
+
+
+def _cerebras_provider(model="gpt-oss-120b"):
+    def factory():
+        from langchain_cerebras import ChatCerebras
+        return ChatCerebras(
+            temperature=0,
+            model=model,
+            api_key=os.getenv("CEREBRAS_API_KEY"),
+            max_retries=0,
+            timeout=LLM_TIMEOUT_S,
+        )
+    return Provider("cerebras", model, factory)
+
+
+def _gemini_provider(model="gemini-2.5-flash"):
+    def factory():
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            api_key=os.getenv("GOOGLE_API_KEY"),
+            model=model,
+            temperature=0,
+            max_tokens=20000,
+            timeout=LLM_TIMEOUT_S,
+            max_retries=0,
+        )
+    return Provider("gemini", model, factory)
+
+
+def openai_compatible_provider(name, base_url, model, api_key="sk-local"):
+    """Provedor genérico compatível com a API da OpenAI (ex.: servidores fake locais)."""
+    def factory():
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            model=model,
+            temperature=0,
+            max_retries=0,
+            timeout=LLM_TIMEOUT_S,
+        )
+    return Provider(name, model, factory)
+
+
+_BUILTIN_PROVIDERS = {
+    "groq": ("GROQ_API_KEY", _groq_provider),
+    "cerebras": ("CEREBRAS_API_KEY", _cerebras_provider),
+    "gemini": ("GOOGLE_API_KEY", _gemini_provider),
+}
+
+
+def providers_from_env() -> list:
+    """Monta a lista de provedores a partir das variáveis de ambiente.
+
+    LLM_PROVIDERS define a ordem de preferência (padrão: groq,cerebras,gemini);
+    só entram provedores cuja chave de API estiver configurada.
+    LLM_OPENAI_COMPAT aceita uma lista JSON de {"name", "base_url", "model", "api_key"}.
+    """
+    providers = []
+    order = os.getenv("LLM_PROVIDERS", "groq,cerebras,gemini")
+    for name in [n.strip() for n in order.split(",") if n.strip()]:
+        if name not in _BUILTIN_PROVIDERS:
+            continue
+        key_env, builder = _BUILTIN_PROVIDERS[name]
+        if os.getenv(key_env):
+            providers.append(builder())
+
+    compat = os.getenv("LLM_OPENAI_COMPAT")
+    if compat:
+        for spec in json.loads(compat):
+            providers.append(openai_compatible_provider(
+                spec["name"], spec["base_url"], spec.get("model", "fake-model"), spec.get("api_key", "sk-local")
+            ))
+
+    if not providers:
+        # Mantém o comportamento original (Groq) mesmo sem chave, para o erro aparecer na chamada
+        providers.append(_groq_provider())
+    return providers
+
+
+class AllProvidersFailed(RuntimeError):
+    pass
+
+
+class _CallHandle:
+    """Chamada síncrona em uma thread do executor, que quem espera pode abandonar no timeout.
+
+    A thread não pode ser interrompida: ao abandonar, a vaga de admissão é devolvida na hora,
+    e o resultado que chegar depois não mexe mais nas estatísticas nem no circuit breaker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._release = None
+        self.abandoned = False
+
+    def hold(self, release) -> bool:
+        """Guarda a liberação da vaga; False (e devolve a vaga) se a chamada já foi abandonada."""
+        with self._lock:
+            if not self.abandoned:
+                self._release = release
+                return True
+        release()
+        return False
+
+    def finish(self) -> bool:
+        """Devolve a vaga (se ainda não devolvida) e diz se o resultado ainda conta."""
+        with self._lock:
+            release, self._release = self._release, None
+            counted = not self.abandoned
+        if release:
+            release()
+        return counted
+
+    def abandon(self):
+        with self._lock:
+            self.abandoned = True
+            release, self._release = self._release, None
+        if release:
+            release()
+
+
+class LLMGateway:
+    """Ponto único de acesso aos LLMs usado por todos os nós.
+
+    Ordena os provedores saudáveis pela latência mediana observada, faz failover
+    em caso de erro e, quando pedido, dispara uma requisição "hedge" em um
+    segundo provedor se o primeiro passar do seu p95.
+    """
+
+    def __init__(self, providers: list, max_workers: int = 64):
+        if not providers:
+            raise ValueError("O gateway precisa de pelo menos um provedor.")
+        self.providers = providers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-gateway")
+
+    # --- Seleção ---
+
+    def ranked(self) -> list:
+        """Provedores saudáveis primeiro, do mais rápido ao mais lento."""
+        def key(p):
+            # Provedores sem amostras são experimentados primeiro
+            p50 = p.stats.p50()
+            unhealthy = not p.stats.healthy() or p.breaker.state == CircuitBreaker.OPEN
+            return (unhealthy, p50 if p50 is not None else 0.0)
+        return sorted(self.providers, key=key)
+
+    def model_signature(self) -> str:
+        """Identifica o conjunto de modelos que pode responder (usado em chaves de cache)."""
+        return ",".join(sorted(f"{p.name}:{p.model}" for p in self.providers))
+
+    def stats(self) -> dict:
+        return {p.name: {**p.stats.snapshot(), "breaker": p.breaker.state} for p in self.providers}
+
+    # --- Execução ---
+
+    def _call(self, provider, binder, messages, kwargs, priority, handle: _CallHandle):
+        # A espera na fila de admissão não entra na latência do provedor
+        admission = get_admission()
+        cross_fd = admission.acquire(priority, timeout=timeout_for("llm"))
+        if not handle.hold(lambda: admission.release(cross_fd)):
+            return None  # abandonada ainda na fila: nem chega ao provedor
+        start = time.perf_counter()
+        try:
+            runnable = binder(provider.client) if binder else provider.client
+            result = runnable.invoke(messages, **kwargs)
+        except Exception as e:
+            admission.on_result(rate_limited=is_rate_limited(e))
+            if handle.finish():
+                provider.stats.record(time.perf_counter() - start, False)
+                provider.breaker.record_failure()
+            raise
+        admission.on_result(rate_limited=False)
+        if handle.finish():
+            provider.stats.record(time.perf_counter() - start, True)
+            provider.breaker.record_success()
+        return result
+
+    def _submit(self, provider, binder, messages, kwargs, priority=PRIORITY_SHORT):
+        # Copia o contexto para que o prazo do turno e a sessão cheguem à thread do provedor
+        ctx = contextvars.copy_context()
+        handle = _CallHandle()
+        future = self._executor.submit(ctx.run, self._call, provider, binder, messages, kwargs, priority, handle)
+        future.handle = handle
+        return future
+
+    def _available(self, candidates):
+        """Provedores cujo circuit breaker permite uma chamada agora (consome a vaga de teste)."""
+        for provider in candidates:
+            if provider.breaker.allow():
+                yield provider
+
+    def invoke(self, messages, binder=None, hedge=False, timeout=None, priority=PRIORITY_SHORT, **kwargs):
+        timeout = timeout_for("llm", timeout)
+        candidates = self.ranked()
+        if hedge and len(candidates) > 1:
+            return self._invoke_hedged(candidates, binder, messages, timeout, kwargs, priority)
+
+        errors = []
+        deadline = time.monotonic() + timeout
+        for provider in self._available(candidates):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            future = self._submit(provider, binder, messages, kwargs, priority)
+            try:
+                return future.result(timeout=left)
+            except DeadlineExceeded as e:
+                # O orçamento do turno acabou, não o provedor: nenhum outro teria tempo
+                errors.append(f"{provider.name}: {e}")
+                break
+            except AdmissionTimeout as e:
+                # Fila cheia não é falha do provedor (AdmissionTimeout também é um TimeoutError)
+                errors.append(f"{provider.name}: {e}")
+            except FutureTimeout:
+                future.handle.abandon()
+                provider.breaker.record_failure()
+                errors.append(f"{provider.name}: timeout após {left:.1f}s")
+            except Exception as e:
+                errors.append(f"{provider.name}: {e}")
+        raise AllProvidersFailed("; ".join(errors) or "Nenhum provedor de LLM disponível.")
+
+    def _invoke_hedged(self, candidates, binder, messages, timeout, kwargs, priority):
+        available = self._available(candidates)
+        primary = next(available, None)
+        if primary is None:
+            raise AllProvidersFailed("Nenhum provedor de LLM disponível.")
+        delay = primary.stats.p95() or HEDGE_DEFAULT_DELAY_S
+        start = time.monotonic()
+        deadline = start + timeout
+
+        pending = {self._submit(primary, binder, messages, kwargs, priority): primary}
+        hedged = False
+        errors = []
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            wait_s = remaining if hedged else max(0.0, min(start + delay - time.monotonic(), remaining))
+            done, _ = wait(pending, timeout=wait_s, return_when=FIRST_COMPLETED)
+            if not done and not hedged:
+                hedged = True
+                secondary = next(available, None)
+                if secondary is not None:
+                    print(f"[GATEWAY] {primary.name} passou de {delay:.2f}s; disparando hedge em {secondary.name}")
+                    pending[self._submit(secondary, binder, messages, kwargs, priority)] = secondary
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    # Falha rápida não espera o hedge: passa para o próximo provedor disponível
+                    fallback = next(available, None)
+                    if fallback is not None:
+                        pending[self._submit(fallback, binder, messages, kwargs, priority)] = fallback
+                    continue
+                # A requisição perdedora segue na thread, mas sem vaga e sem contar no breaker
+                for loser in pending:
+                    loser.handle.abandon()
+                return result
+        for future, provider in pending.items():
+            future.handle.abandon()
+            provider.breaker.record_failure()
+            errors.append(f"{provider.name}: timeout após {timeout:.1f}s")
+        raise AllProvidersFailed("; ".join(errors) or "Nenhum provedor de LLM disponível.")
+
+    # --- Execução assíncrona (mesma política, sem ocupar threads enquanto espera) ---
+
+    async def _acall(self, provider, binder, messages, kwargs, priority):
+        async with get_admission().aslot(priority, timeout=timeout_for("llm")):
+            start = time.perf_counter()
+            try:
+                runnable = binder(provider.client) if binder else provider.client
+                result = await runnable.ainvoke(messages, **kwargs)
+            except Exception:
+                provider.stats.record(time.perf_counter() - start, False)
+                provider.breaker.record_failure()
+                raise
+            provider.stats.record(time.perf_counter() - start, True)
+            provider.breaker.record_success()
+            return result
+
+    async def ainvoke(self, messages, binder=None, hedge=False, timeout=None, priority=PRIORITY_SHORT, **kwargs):
+        timeout = timeout_for("llm", timeout)
+        candidates = self.ranked()
+        if hedge and len(candidates) > 1:
+            return await self._ainvoke_hedged(candidates, binder, messages, timeout, kwargs, priority)
+
+        errors = []
+        deadline = time.monotonic() + timeout
+        for provider in self._available(candidates):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            try:
+                return await asyncio.wait_for(self._acall(provider, binder, messages, kwargs, priority), left)
+            except DeadlineExceeded as e:
+                errors.append(f"{provider.name}: {e}")
+                break
+            except AdmissionTimeout as e:
+                errors.append(f"{provider.name}: {e}")
+            except asyncio.TimeoutError:
+                provider.breaker.record_failure()
+                errors.append(f"{provider.name}: timeout após {left:.1f}s")
+            except Exception as e:
+                errors.append(f"{provider.name}: {e}")
+        raise AllProvidersFailed("; ".join(errors) or "Nenhum provedor de LLM disponível.")
+
+    async def _ainvoke_hedged(self, candidates, binder, messages, timeout, kwargs, priority):
+        available = self._available(candidates)
+        primary = next(available, None)
+        if primary is None:
+            raise AllProvidersFailed("Nenhum provedor de LLM disponível.")
+        delay = primary.stats.p95() or HEDGE_DEFAULT_DELAY_S
+        start = time.monotonic()
+        deadline = start + timeout
+
+        def launch(provider):
+            pending[asyncio.ensure_future(self._acall(provider, binder, messages, kwargs, priority))] = provider
+
+        pending = {}
+        launch(primary)
+        try:
+            hedged = False
+            errors = []
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                wait_s = remaining if hedged else max(0.0, min(start + delay - time.monotonic(), remaining))
+                done, _ = await asyncio.wait(pending, timeout=wait_s, return_when=asyncio.FIRST_COMPLETED)
+                if not done and not hedged:
+                    hedged = True
+                    secondary = next(available, None)
+                    if secondary is not None:
+                        print(f"[GATEWAY] {primary.name} passou de {delay:.2f}s; disparando hedge em {secondary.name}")
+                        launch(secondary)
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        # Falha rápida não espera o hedge: passa para o próximo provedor disponível
+                        fallback = next(available, None)
+                        if fallback is not None:
+                            launch(fallback)
+            for provider in pending.values():
+                provider.breaker.record_failure()
+                errors.append(f"{provider.name}: timeout após {timeout:.1f}s")
+            raise AllProvidersFailed("; ".join(errors) or "Nenhum provedor de LLM disponível.")
+        finally:
+            # Diferente das threads, a requisição perdedora pode ser cancelada de fato
+            for task in pending:
+                task.cancel()
+
+    # --- Interface no estilo LangChain usada pelos nós ---
+
+    def bind_tools(self, tools, **kw):
+        return GatewayView(self, lambda m: m.bind_tools(tools, **kw))
+
+    def with_structured_output(self, schema, **kw):
+        return GatewayView(self, lambda m: m.with_structured_output(schema, **kw))
+
+    def hedged(self):
+        return GatewayView(self, None, hedge=True)
+
+    def with_priority(self, priority):
+        return GatewayView(self, None, priority=priority)
+
+
+class GatewayView:
+    """Visão do gateway com uma transformação do modelo (tools, saída estruturada) e opções."""
+
+    def __init__(self, gateway: LLMGateway, binder=None, hedge=False, priority=PRIORITY_SHORT):
+        self.gateway = gateway
+        self.binder = binder
+        self.hedge = hedge
+        self.priority = priority
+
+    def _compose(self, outer):
+        inner = self.binder
+        if inner is None:
+            return outer
+        return lambda m: outer(inner(m))
+
+    def bind_tools(self, tools, **kw):
+        return GatewayView(self.gateway, self._compose(lambda m: m.bind_tools(tools, **kw)), self.hedge, self.priority)
+
+    def with_structured_output(self, schema, **kw):
+        return GatewayView(self.gateway, self._compose(lambda m: m.with_structured_output(schema, **kw)), self.hedge, self.priority)
+
+    def hedged(self):
+        return GatewayView(self.gateway, self.binder, True, self.priority)
+
+    def with_priority(self, priority):
+        return GatewayView(self.gateway, self.binder, self.hedge, priority)
+
+    def model_signature(self) -> str:
+        return self.gateway.model_signature()
+
+    def invoke(self, messages, **kwargs):
+        return self.gateway.invoke(messages, binder=self.binder, hedge=self.hedge, priority=self.priority, **kwargs)
+
+    async def ainvoke(self, messages, **kwargs):
+        return await self.gateway.ainvoke(messages, binder=self.binder, hedge=self.hedge, priority=self.priority, **kwargs)
+
+
+# --- SINGLETON ---
+
+_gateway_instance = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """Retorna a instância única do gateway de LLMs."""
+    global _gateway_instance
+    with _gateway_lock:
+        if _gateway_instance is None:
+            providers = providers_from_env()
+            print(f"[SISTEMA] Gateway de LLM com provedores: {', '.join(p.name for p in providers)}")
+            _gateway_instance = LLMGateway(providers)
+    return _gateway_instance
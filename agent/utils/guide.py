@@ -0,0 +1,315 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from agent.utils.admission import PRIORITY_LONG
+from agent.utils.cache import DiskCache, content_key
+from agent.utils.kv import shared_cache
+from agent.utils.prompt import GUIDE_SYSTEM_PROMPT, GUIDE_SECTION_SYSTEM_PROMPT
+from agent.utils.resilience import submit
+
+# --- Configurações Globais ---
+# "secoes": uma chamada por tema, em paralelo (map-reduce); "unico": uma chamada para o guia inteiro
+GUIDE_MODE = os.getenv("GUIDE_MODE", "secoes")
+
+# Cache de guias em disco, endereçado por (respostas normalizadas, versão do prompt, modelo)
+GUIDE_CACHE = os.getenv("GUIDE_CACHE", "1") == "1"
+GUIDE_CACHE_DIR = os.getenv("GUIDE_CACHE_DIR", os.path.join(".cache", "guides"))
+GUIDE_CACHE_MAX_MB = float(os.getenv("GUIDE_CACHE_MAX_MB", "50"))
+# Validade das entradas quando o cache está na camada compartilhada (KV_URL)
+GUIDE_CACHE_TTL_S = float(os.getenv("GUIDE_CACHE_TTL_H", "720")) * 3600
+
+GUIDE_START = "[INICIO_GUIA]"
+GUIDE_END = "[FIM_GUIA]"
+
+# Mapeamento das perguntas feitas ao usuário
+QUESTIONS_MAP = {
+    "email": "Qual é o seu email? (Usaremos para enviar o guia personalizado)",
+    "nome": "Qual é seu nome?",
+    "idade": "Qual é sua idade?",
+    "ciclo_menstrual": "Como está o seu ciclo menstrual? (Quando foi sua última menstruação, ela tem sido regular em frequência e fluxo? Você já completou 12 meses consecutivos sem menstruar?)",
+    "sintomas_fisicos": "Quais sintomas físicos novos ou incômodos você tem sentido? (Por exemplo: ondas de calor, suores noturnos, alterações no sono, cansaço, ressecamento vaginal, mudanças na libido, ganho de peso, queda de cabelo ou infecções urinárias?)",
+    "saude_emocional": "Como você tem se sentido emocional e mentalmente? (Você notou flutuações de humor, ansiedade, irritabilidade, desânimo, ou dificuldade de memória e concentração?)",
+    "habitos_historico": "Como estão seus hábitos de saúde e histórico médico? (Incluindo medicamentos ou suplementos que você usa, seu histórico pessoal ou familiar de doenças crônicas, especialmente câncer de mama, sua rotina de alimentação, exercícios, consumo de álcool ou fumo.)",
+    "exames_tratamentos": "Quando você realizou seus últimos exames preventivos e quais tratamentos você gostaria de discutir? (Como Papanicolau, mamografia e densitometria óssea. Você já tentou algo para os sintomas ou tem interesse em discutir opções, como a terapia de reposição hormonal?)"
+}
+
+# Seções do modo paralelo, na ordem fixa em que aparecem no guia
+GUIDE_SECTIONS = [
+    ("ciclo_menstrual", "🩸 Ciclo Menstrual"),
+    ("sintomas_fisicos", "🩺 Sintomas Físicos"),
+    ("saude_emocional", "💭 Saúde Emocional e Mental"),
+    ("habitos_historico", "🥗 Hábitos e Histórico de Saúde"),
+    ("exames_tratamentos", "🔬 Exames e Tratamentos"),
+]
+
+GUIDE_FOOTER = (
+    "---\n"
+    "*Este guia foi gerado para auxiliar na preparação da sua consulta médica. "
+    "Leve-o impresso ou em formato digital.*"
+)
+SECTION_FAILED_NOTE = "_Não foi possível gerar esta seção agora. Converse sobre este tema com seu médico._"
+GUIDE_READY_MESSAGE = "Pronto! Seu guia personalizado foi gerado com sucesso! 📋✨ Gostaria que eu enviasse este guia para o seu email?"
+
+
+def normalize_content(content):
+    """Converte listas de dicionários do Gemini em texto puro string."""
+    if isinstance(content, list):
+        text_parts = []
+        for item in content:
+            if isinstance(item, dict) and item.get('type') == 'text':
+                text_parts.append(item.get('text', ''))
+            elif isinstance(item, str):
+                text_parts.append(item)
+        return "".join(text_parts)
+    return str(content)
+
+
+def extract_guide(content: str) -> str:
+    """Retorna o trecho entre os marcadores do guia (ou o texto inteiro, se não houver marcadores)."""
+    if GUIDE_START in content and GUIDE_END in content:
+        start_idx = content.find(GUIDE_START) + len(GUIDE_START)
+        end_idx = content.find(GUIDE_END)
+        return content[start_idx:end_idx].strip()
+    return content
+
+
+# --- Formulário único (todas as perguntas em uma só interrupção) ---
+
+PERSONAL_FIELDS = ("nome", "idade", "email")
+HEALTH_FIELDS = ("ciclo_menstrual", "sintomas_fisicos", "saude_emocional", "habitos_historico", "exames_tratamentos")
+FORM_FIELDS = PERSONAL_FIELDS + HEALTH_FIELDS
+# Os mesmos campos obrigatórios dos formulários do app (exames é opcional)
+REQUIRED_FIELDS = FORM_FIELDS[:-1]
+
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def validate_answers(answers: dict) -> dict:
+    """Valida as respostas do formulário. Retorna {campo: mensagem} (vazio se tudo certo)."""
+    errors = {}
+    for field in REQUIRED_FIELDS:
+        if not str(answers.get(field) or "").strip():
+            errors[field] = "Campo obrigatório."
+    idade = str(answers.get("idade") or "").strip()
+    if idade and not (idade.isdigit() and 1 <= int(idade) <= 120):
+        errors["idade"] = "Informe a idade em anos (apenas números)."
+    email = str(answers.get("email") or "").strip()
+    if email and not _EMAIL_RE.match(email):
+        errors["email"] = "Email inválido."
+    return errors
+
+
+# Campos que não influenciam o conteúdo do guia
+_KEY_EXCLUDED_FIELDS = ("email", "guide")
+
+
+def normalized_user_data(user_data: dict) -> dict:
+    """Respostas normalizadas (sem email/guia, texto aparado) usadas como chave do guia."""
+    return {
+        k: " ".join(str(v).split()) if v is not None else None
+        for k, v in sorted(user_data.items())
+        if k not in _KEY_EXCLUDED_FIELDS
+    }
+
+
+def user_data_hash(user_data: dict) -> str:
+    payload = json.dumps(normalized_user_data(user_data), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def patient_data_block(user_data: dict) -> str:
+    parts = ["=== DADOS DA PACIENTE ===\n\n"]
+    for key, value in user_data.items():
+        if key == "guide":
+            continue
+        label = QUESTIONS_MAP.get(key, key)
+        val_str = str(value) if value is not None else "Não informado"
+        parts.append(f"{label} {val_str}\n\n")
+    return "".join(parts)
+
+
+# --- Modo único ---
+
+def build_guide_messages(user_data: dict) -> list:
+    prompt_parts = [
+        "Crie um guia personalizado de menopausa com base nas seguintes informações coletadas:\n\n"
+    ]
+
+    filtered_data = {k: v for k, v in user_data.items() if k != "guide"}
+    if filtered_data:
+        prompt_parts.append(patient_data_block(filtered_data))
+
+    prompt_parts.append(
+        "\nGere o guia completo seguindo EXATAMENTE o formato especificado no system prompt, "
+        "incluindo os marcadores [INICIO_GUIA] e [FIM_GUIA]. "
+        "Use as perguntas e respostas acima como contexto para personalizar o guia de forma detalhada e relevante."
+    )
+    return [SystemMessage(content=GUIDE_SYSTEM_PROMPT), HumanMessage(content="".join(prompt_parts))]
+
+
+def generate_guide_single(llm, user_data: dict) -> str:
+    response = llm.with_priority(PRIORITY_LONG).invoke(build_guide_messages(user_data))
+    return normalize_content(response.content)
+
+
+async def agenerate_guide_single(llm, user_data: dict) -> str:
+    response = await llm.with_priority(PRIORITY_LONG).ainvoke(build_guide_messages(user_data))
+    return normalize_content(response.content)
+
+
+# --- Modo paralelo por seções (map-reduce) ---
+
+def build_section_messages(user_data: dict, key: str, title: str) -> list:
+    system_message = SystemMessage(content=GUIDE_SECTION_SYSTEM_PROMPT.replace("{titulo}", title))
+    user_message = HumanMessage(content=(
+        "Informações coletadas da paciente (use todas como contexto):\n\n"
+        f"{patient_data_block(user_data)}"
+        f"Escreva APENAS a seção \"{title}\", focada na resposta sobre: {QUESTIONS_MAP[key]}"
+    ))
+    return [system_message, user_message]
+
+
+def _patient_header(user_data: dict) -> str:
+    lines = ["# Guia Personalizado para Consulta sobre Menopausa", "", "## 📋 Informações da Paciente"]
+    for key, label in (("nome", "Nome"), ("idade", "Idade")):
+        lines.append(f"- **{label}:** {user_data.get(key, 'Não informado')}")
+    return "\n".join(lines)
+
+
+def _section_text(response, title: str) -> str:
+    text = normalize_content(response.content).strip()
+    # Garante o título correto mesmo que o modelo o omita
+    if not text.startswith("##"):
+        text = f"## {title}\n\n{text}"
+    return text
+
+
+def _generate_section(llm, user_data: dict, key: str, title: str) -> str:
+    response = llm.with_priority(PRIORITY_LONG).invoke(build_section_messages(user_data, key, title))
+    return _section_text(response, title)
+
+
+async def _agenerate_section(llm, user_data: dict, key: str, title: str) -> str:
+    response = await llm.with_priority(PRIORITY_LONG).ainvoke(build_section_messages(user_data, key, title))
+    return _section_text(response, title)
+
+
+def _assemble_guide(user_data: dict, results: list) -> str:
+    """Monta o guia na ordem fixa; `results` traz o texto ou a exceção de cada seção."""
+    sections = []
+    failures = 0
+    for (_, title), result in zip(GUIDE_SECTIONS, results):
+        if isinstance(result, BaseException):
+            failures += 1
+            print(f"[ERROR AGENT] Falha ao gerar a seção '{title}': {result}")
+            sections.append(f"## {title}\n\n{SECTION_FAILED_NOTE}")
+        else:
+            sections.append(result)
+
+    if failures == len(GUIDE_SECTIONS):
+        raise RuntimeError("Nenhuma seção do guia pôde ser gerada.")
+
+    guide = "\n\n".join([_patient_header(user_data), *sections, GUIDE_FOOTER])
+    return f"{GUIDE_START}\n{guide}\n{GUIDE_END}\n\n{GUIDE_READY_MESSAGE}"
+
+
+def generate_guide_sections(llm, user_data: dict) -> str:
+    """Gera as seções em paralelo e monta o guia na ordem fixa, dentro dos marcadores."""
+    futures = [submit(_generate_section, llm, user_data, key, title) for key, title in GUIDE_SECTIONS]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return _assemble_guide(user_data, results)
+
+
+async def agenerate_guide_sections(llm, user_data: dict) -> str:
+    """Versão assíncrona: as seções rodam como corrotinas concorrentes no event loop."""
+    results = await asyncio.gather(
+        *(_agenerate_section(llm, user_data, key, title) for key, title in GUIDE_SECTIONS),
+        return_exceptions=True,
+    )
+    return _assemble_guide(user_data, results)
+
+
+# --- Cache de guias ---
+
+_guide_cache_instance = None
+
+
+def get_guide_cache():
+    """Retorna a instância única do cache de guias (camada compartilhada ou disco local)."""
+    global _guide_cache_instance
+    if _guide_cache_instance is None:
+        _guide_cache_instance = shared_cache(
+            "guides", GUIDE_CACHE_TTL_S,
+            lambda: DiskCache(GUIDE_CACHE_DIR, int(GUIDE_CACHE_MAX_MB * 1024 * 1024)),
+        )
+    return _guide_cache_instance
+
+
+def prompt_version(mode: str) -> str:
+    """Muda sempre que os prompts ou o formato do guia mudam, invalidando o cache automaticamente."""
+    return content_key(mode, GUIDE_SYSTEM_PROMPT, GUIDE_SECTION_SYSTEM_PROMPT, GUIDE_SECTIONS, GUIDE_FOOTER, GUIDE_READY_MESSAGE)[:16]
+
+
+def model_signature(llm) -> str:
+    if hasattr(llm, "model_signature"):
+        return llm.model_signature()
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+def guide_cache_key(llm, user_data: dict, mode: str) -> str:
+    return content_key(user_data_hash(user_data), prompt_version(mode), model_signature(llm))
+
+
+def generate_guide_content(llm, user_data: dict, mode: str = None) -> str:
+    """Gera a resposta completa do nó (guia entre marcadores + mensagem para a usuária)."""
+    mode = mode or GUIDE_MODE
+    cache = get_guide_cache() if GUIDE_CACHE else None
+    key = guide_cache_key(llm, user_data, mode) if cache else None
+
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            print(f"[SISTEMA] Guia servido do cache ({key[:10]}...)")
+            return cached
+
+    if mode == "secoes":
+        content = generate_guide_sections(llm, user_data)
+    else:
+        content = generate_guide_single(llm, user_data)
+
+    # Só guarda guias completos (com marcadores e sem seções que falharam)
+    if cache is not None and GUIDE_END in content and SECTION_FAILED_NOTE not in content:
+        cache.set(key, content)
+    return content
+
+
+async def agenerate_guide_content(llm, user_data: dict, mode: str = None) -> str:
+    """Versão assíncrona do generate_guide_content (o cache é consultado fora do event loop)."""
+    mode = mode or GUIDE_MODE
+    cache = get_guide_cache() if GUIDE_CACHE else None
+    key = guide_cache_key(llm, user_data, mode) if cache else None
+
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            print(f"[SISTEMA] Guia servido do cache ({key[:10]}...)")
+            return cached
+
+    if mode == "secoes":
+        content = await agenerate_guide_sections(llm, user_data)
+    else:
+        content = await agenerate_guide_single(llm, user_data)
+
+    if cache is not None and GUIDE_END in content and SECTION_FAILED_NOTE not in content:
+        await asyncio.to_thread(cache.set, key, content)
+    return content
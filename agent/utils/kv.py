@@ -0,0 +1,345 @@
+import os
+import time
+import fnmatch
+import threading
+from typing import Optional
+
+from agent.utils.resilience import get_breaker, CircuitOpenError, DEPENDENCY_TIMEOUTS_S
+
+# --- Configurações Globais ---
+# Camada compartilhada entre réplicas: "redis://host:6379/0" (ou qualquer servidor que fale o
+# protocolo do Redis) ou "memory://" (dicionário do próprio processo, útil em testes).
+# Sem KV_URL, cada processo usa o SQLite/disco locais.
+KV_URL = os.getenv("KV_URL")
+KV_PREFIX = os.getenv("KV_PREFIX", "tide:")
+
+
+def _as_bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode("utf-8")
+
+
+class LocalKV:
+    """Subconjunto dos comandos do Redis usados pelo app, em memória do processo.
+
+    Mesma interface (e mesmos retornos em bytes) do cliente `redis.Redis`, então serve de
+    substituto em testes e também como armazenamento do servidor RESP local dos benchmarks.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    # --- Expiração ---
+
+    def _alive(self, key) -> bool:
+        deadline = self._expires.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+            return False
+        return key in self._data
+
+    def _get_typed(self, key, kind):
+        key = _as_bytes(key)
+        if not self._alive(key):
+            return None
+        value = self._data[key]
+        if not isinstance(value, kind):
+            raise TypeError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    # --- Chaves ---
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._get_typed(key, bytes)
+
+    def set(self, key, value, ex=None, nx=False):
+        key = _as_bytes(key)
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = _as_bytes(value)
+            self._expires.pop(key, None)
+            if ex:
+                self._expires[key] = time.monotonic() + float(ex)
+            return True
+
+    def delete(self, *keys):
+        removed = 0
+        with self._lock:
+            for key in map(_as_bytes, keys):
+                if self._alive(key):
+                    removed += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+        return removed
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in map(_as_bytes, keys) if self._alive(key))
+
+    def expire(self, key, seconds):
+        key = _as_bytes(key)
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.monotonic() + float(seconds)
+            return True
+
+    def ttl(self, key):
+        key = _as_bytes(key)
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            deadline = self._expires.get(key)
+            return -1 if deadline is None else int(deadline - time.monotonic())
+
+    def keys(self, pattern="*"):
+        pattern = _as_bytes(pattern).decode("utf-8")
+        with self._lock:
+            return [k for k in list(self._data) if self._alive(k) and fnmatch.fnmatchcase(k.decode("utf-8"), pattern)]
+
+    def scan_iter(self, match="*", count=None):
+        return iter(self.keys(match))
+
+    def dbsize(self):
+        with self._lock:
+            return sum(1 for k in list(self._data) if self._alive(k))
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expires.clear()
+        return True
+
+    # --- Hashes ---
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        with self._lock:
+            table = self._get_typed(key, dict)
+            if table is None:
+                table = self._data[_as_bytes(key)] = {}
+            added = 0
+            for f, v in items.items():
+                f = _as_bytes(f)
+                added += f not in table
+                table[f] = _as_bytes(v)
+            return added
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            table = self._get_typed(key, dict)
+            if table is None:
+                table = self._data[_as_bytes(key)] = {}
+            field = _as_bytes(field)
+            if field in table:
+                return False
+            table[field] = _as_bytes(value)
+            return True
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get_typed(key, dict) or {})
+
+    # --- Listas ---
+
+    def lpush(self, key, *values):
+        with self._lock:
+            items = self._get_typed(key, list)
+            if items is None:
+                items = self._data[_as_bytes(key)] = []
+            for value in values:
+                items.insert(0, _as_bytes(value))
+            return len(items)
+
+    @staticmethod
+    def _slice(items, start, end):
+        n = len(items)
+        start, end = int(start), int(end)
+        start = max(0, start + n if start < 0 else start)
+        end = end + n if end < 0 else end
+        return start, min(end, n - 1)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            items = self._get_typed(key, list) or []
+            start, end = self._slice(items, start, end)
+            return items[start:end + 1] if start <= end else []
+
+    def lindex(self, key, index):
+        with self._lock:
+            items = self._get_typed(key, list) or []
+            index = int(index)
+            return items[index] if -len(items) <= index < len(items) else None
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            items = self._get_typed(key, list)
+            if items is not None:
+                start, end = self._slice(items, start, end)
+                items[:] = items[start:end + 1] if start <= end else []
+            return True
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._get_typed(key, list) or [])
+
+    # --- Conjuntos ---
+
+    def sadd(self, key, *members):
+        with self._lock:
+            items = self._get_typed(key, set)
+            if items is None:
+                items = self._data[_as_bytes(key)] = set()
+            before = len(items)
+            items.update(map(_as_bytes, members))
+            return len(items) - before
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get_typed(key, set) or set())
+
+    def pipeline(self, transaction=True):
+        return _LocalPipeline(self)
+
+
+class _LocalPipeline:
+    """Acumula comandos e executa em sequência sob a trava do LocalKV (como um MULTI/EXEC)."""
+
+    def __init__(self, kv: LocalKV):
+        self._kv = kv
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._kv, name)
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._kv._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._calls = []
+
+
+def connect(url: str):
+    """Cria o cliente da camada compartilhada a partir da URL."""
+    if url.startswith("memory://"):
+        return LocalKV()
+    import redis  # dependência opcional: só é necessária com um servidor Redis
+    timeout = DEPENDENCY_TIMEOUTS_S["kv"]
+    # RESP2: suportado por qualquer servidor compatível (Redis, Valkey, KeyDB, o servidor local dos benchmarks)
+    return redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout,
+                                health_check_interval=30, protocol=2)
+
+
+class KVCache:
+    """Cache com a mesma interface do DiskCache, guardado na camada compartilhada.
+
+    Falhas do KV nunca quebram o fluxo: viram faltas (leitura) ou são ignoradas (escrita),
+    e o circuit breaker "kv" evita esperar pelo timeout a cada chamada.
+    """
+
+    def __init__(self, client, namespace: str, ttl_s: Optional[float] = None):
+        self.client = client
+        self.namespace = namespace
+        self.ttl_s = ttl_s
+        self.breaker = get_breaker("kv")
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{KV_PREFIX}{self.namespace}:{key}"
+
+    def _call(self, fn, *args, **kwargs):
+        try:
+            return self.breaker.call(fn, *args, **kwargs)
+        except CircuitOpenError:
+            self.errors += 1
+            return None
+        except Exception as e:
+            self.errors += 1
+            print(f"[WARNING] Falha no KV ({self.namespace}): {e}")
+            return None
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        data = self._call(self.client.get, self._key(key))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def set_bytes(self, key: str, data: bytes):
+        self._call(self.client.set, self._key(key), data, ex=int(self.ttl_s) if self.ttl_s else None)
+
+    def get(self, key: str) -> Optional[str]:
+        data = self.get_bytes(key)
+        return None if data is None else data.decode("utf-8")
+
+    def set(self, key: str, value: str):
+        self.set_bytes(key, value.encode("utf-8"))
+
+    def contains(self, key: str) -> bool:
+        return bool(self._call(self.client.exists, self._key(key)))
+
+    def touch(self, key: str) -> bool:
+        """Renova o TTL da entrada. Retorna False se ela não existir (ou o KV falhar)."""
+        if not self.ttl_s:
+            return self.contains(key)
+        return bool(self._call(self.client.expire, self._key(key), int(self.ttl_s)))
+
+    def delete(self, key: str):
+        self._call(self.client.delete, self._key(key))
+
+    def expire(self, max_age_s: float) -> int:
+        # O próprio KV expira as entradas (TTL definido na escrita)
+        return 0
+
+    def stats(self) -> dict:
+        return {"backend": "kv", "namespace": self.namespace, "ttl_s": self.ttl_s,
+                "acertos": self.hits, "faltas": self.misses, "erros": self.errors}
+
+
+# --- SINGLETON ---
+
+_kv_instance = None
+_kv_lock = threading.Lock()
+
+
+def get_kv():
+    """Retorna o cliente da camada compartilhada, ou None se KV_URL não estiver configurada."""
+    global _kv_instance
+    if not KV_URL:
+        return None
+    with _kv_lock:
+        if _kv_instance is None:
+            print(f"[SISTEMA] Usando camada compartilhada em {KV_URL.split('@')[-1]}")
+            _kv_instance = connect(KV_URL)
+    return _kv_instance
+
+
+def shared_cache(namespace: str, ttl_s: Optional[float], fallback):
+    """Cache na camada compartilhada (se configurada) ou o cache local criado por `fallback()`."""
+    client = get_kv()
+    if client is None:
+        return fallback()
+    return KVCache(client, namespace, ttl_s)
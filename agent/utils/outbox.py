@@ -0,0 +1,418 @@
+import os
+import time
+import random
+import smtplib
+import sqlite3
+import threading
+from datetime import datetime
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Optional
+
+from jinja2 import Environment, FileSystemLoader
+
+from agent.utils.blobs import resolve, BlobMissingError
+from agent.utils.resilience import get_breaker, DEPENDENCY_TIMEOUTS_S
+
+# --- Configurações Globais ---
+# Servidor SMTP (para testes locais, ex. aiosmtpd: SMTP_HOST=127.0.0.1 SMTP_PORT=8025 SMTP_STARTTLS=0)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+# Conexões SMTP autenticadas e reaproveitadas (uma por worker do outbox)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "1"))
+# Depois de N mensagens ou de ficar ociosa por esse tempo, a conexão é renovada
+SMTP_MAX_PER_CONNECTION = int(os.getenv("SMTP_MAX_PER_CONNECTION", "50"))
+SMTP_IDLE_S = float(os.getenv("SMTP_IDLE_S", "60"))
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", os.path.join(".cache", "outbox.sqlite"))
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_S = float(os.getenv("OUTBOX_BACKOFF_S", "5"))
+OUTBOX_BACKOFF_MAX_S = float(os.getenv("OUTBOX_BACKOFF_MAX_S", "900"))
+OUTBOX_POLL_S = float(os.getenv("OUTBOX_POLL_S", "1"))
+# Tempo que um lote reservado fica com o worker antes de poder ser retomado por outro (queda do processo)
+OUTBOX_LEASE_S = 300
+
+PENDING, SENDING, SENT, FAILED = "pendente", "enviando", "enviado", "falhou"
+EMAIL_SUBJECT = '🌸 Seu Guia Personalizado Para Consulta'
+GUIDE_EXPIRED_ERROR = "O guia salvo expirou; é preciso gerar o guia novamente"
+
+
+class PermanentDeliveryError(Exception):
+    """O servidor recusou a mensagem de forma definitiva (5xx): não adianta tentar de novo."""
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(OUTBOX_BACKOFF_MAX_S, OUTBOX_BACKOFF_S * 2 ** max(0, attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+class SmtpConnection:
+    """Conexão SMTP autenticada reaproveitada entre mensagens (reconecta se cair ou envelhecer)."""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, starttls: bool = SMTP_STARTTLS,
+                 user: Optional[str] = None, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.user = user
+        self.password = password
+        self._smtp = None
+        self._sent_on_connection = 0
+        self._last_used = 0.0
+        self.connections = 0
+
+    def _open(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=DEPENDENCY_TIMEOUTS_S["smtp"])
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.user and self.password:
+                smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        self._sent_on_connection = 0
+        self.connections += 1
+
+    def _usable(self) -> bool:
+        if self._smtp is None or self._sent_on_connection >= SMTP_MAX_PER_CONNECTION:
+            return False
+        if time.monotonic() - self._last_used > SMTP_IDLE_S:
+            try:
+                return self._smtp.noop()[0] == 250
+            except smtplib.SMTPException:
+                return False
+        return True
+
+    def send(self, msg):
+        if not self._usable():
+            self.close()
+            self._open()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Conexão derrubada pelo servidor entre mensagens: reconecta uma vez
+            self._open()
+            self._smtp.send_message(msg)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+            code = getattr(e, "smtp_code", None) or min(
+                (c for c, _ in getattr(e, "recipients", {}).values()), default=None)
+            if code is not None and 500 <= code < 600:
+                raise PermanentDeliveryError(str(e)) from e
+            raise
+        self._sent_on_connection += 1
+        self._last_used = time.monotonic()
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                pass
+            self._smtp = None
+
+
+_templates = Environment(loader=FileSystemLoader(["templates", os.path.join(os.path.dirname(__file__), "templates")]))
+
+
+def guide_email_body(nome: str) -> str:
+    """Corpo HTML do email do guia (Jinja2), com um texto simples se o template falhar."""
+    try:
+        return _templates.get_template('email_template.html').render(nome=nome)
+    except Exception as e:
+        print(f"[WARNING] Erro ao carregar template Jinja2: {e}. Usando fallback.")
+        return f"Olá {nome}, seu guia está em anexo."
+
+
+def compose_guide_email(sender: str, recipient: str, body_html: str, pdf_bytes: bytes):
+    msg = MIMEMultipart()
+    msg['Subject'] = EMAIL_SUBJECT
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg.attach(MIMEText(body_html, 'html', 'utf-8'))
+    pdf_attachment = MIMEApplication(pdf_bytes, _subtype='pdf')
+    pdf_attachment.add_header('Content-Disposition', 'attachment',
+                              filename=f'guia_consulta_{datetime.now().strftime("%Y%m%d")}.pdf')
+    msg.attach(pdf_attachment)
+    return msg
+
+
+class Outbox:
+    """Fila durável (SQLite) de emails do guia, enviada por workers em segundo plano.
+
+    O send_pdf só grava o pedido (destinatária, corpo e a referência do guia) e retorna; os
+    workers reservam lotes, montam a mensagem com o PDF (normalmente já pré-renderizado),
+    enviam por conexões SMTP reaproveitadas e reagendam falhas temporárias com backoff.
+    """
+
+    def __init__(self, path: str = OUTBOX_DB, workers: int = OUTBOX_WORKERS, batch: int = OUTBOX_BATCH,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, connection_factory=None, renderer=None):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                thread_id TEXT,
+                recipient TEXT NOT NULL,
+                body_html TEXT NOT NULL,
+                guide TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+            CREATE INDEX IF NOT EXISTS outbox_thread ON outbox (thread_id, id);
+        """)
+        self.conn.commit()
+        self.workers = workers
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.connection_factory = connection_factory or (lambda: SmtpConnection(
+            user=os.getenv("REMETENTE"), password=os.getenv("EMAIL_PASSWORD")))
+        self._renderer = renderer
+        self.breaker = get_breaker("smtp")
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._smtps = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    # --- Fila ---
+
+    def enqueue(self, recipient: str, body_html: str, guide: str, thread_id: Optional[str] = None) -> int:
+        """Grava o pedido de envio (o guia pode ser a referência do blob store) e acorda os workers."""
+        now = time.time()
+        with self._lock:
+            # O mesmo guia para a mesma destinatária ainda na fila não é duplicado
+            row = self.conn.execute(
+                "SELECT id FROM outbox WHERE recipient = ? AND guide = ? AND status IN (?, ?)",
+                (recipient, guide, PENDING, SENDING),
+            ).fetchone()
+            if row:
+                return row[0]
+            cur = self.conn.execute(
+                "INSERT INTO outbox (thread_id, recipient, body_html, guide, status, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, recipient, body_html, guide, PENDING, now, now),
+            )
+            self.conn.commit()
+        self._wake.set()
+        return cur.lastrowid
+
+    def _claim(self) -> list:
+        """Reserva um lote vencido (pendentes ou reservas expiradas de um worker que caiu).
+
+        Cada reserva já conta como tentativa: uma mensagem que derruba o worker (ex.: no PDF)
+        chega ao limite de tentativas em vez de ser retomada para sempre.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt_at = ? WHERE id IN ("
+                "  SELECT id FROM outbox WHERE status IN (?, ?) AND next_attempt_at <= ? ORDER BY id LIMIT ?"
+                ") RETURNING id, recipient, body_html, guide, attempts",
+                (SENDING, now + OUTBOX_LEASE_S, PENDING, SENDING, now, self.batch),
+            ).fetchall()
+            self.conn.commit()
+        return rows
+
+    def _finish(self, item_id: int, status: str, attempts: int, error: Optional[str] = None,
+                next_attempt_at: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, sent_at = ? "
+                "WHERE id = ?",
+                (status, attempts, error, next_attempt_at or now, now if status == SENT else None, item_id),
+            )
+            self.conn.commit()
+
+    # --- Envio ---
+
+    @property
+    def renderer(self):
+        if self._renderer is None:
+            from agent.utils.pdf import get_pdf_renderer
+            self._renderer = get_pdf_renderer()
+        return self._renderer
+
+    def _message(self, recipient: str, body_html: str, guide: str):
+        guide_text = str(resolve(guide, strict=True))
+        renderer = self.renderer
+        pdf_bytes = renderer.ready(guide_text) or renderer.render(guide_text, timeout=DEPENDENCY_TIMEOUTS_S["pdf"])
+        return compose_guide_email(os.getenv("REMETENTE"), recipient, body_html, pdf_bytes)
+
+    def _retry_or_fail(self, item_id: int, attempts: int, error: Exception):
+        if attempts >= self.max_attempts:
+            self.failed += 1
+            self._finish(item_id, FAILED, attempts, str(error))
+            print(f"[ERROR] Email {item_id} falhou após {attempts} tentativa(s): {error}")
+        else:
+            self.retried += 1
+            self._finish(item_id, PENDING, attempts, str(error), time.time() + _backoff(attempts))
+            print(f"[WARNING] Email {item_id} falhou ({error}); nova tentativa agendada.")
+
+    def _fail_permanently(self, item_id: int, attempts: int, error: Exception):
+        self.failed += 1
+        self._finish(item_id, FAILED, attempts, str(error))
+        print(f"[ERROR] Email {item_id} recusado pelo servidor: {error}")
+
+    def _deliver(self, smtp: SmtpConnection, rows: list):
+        for position, (item_id, recipient, body_html, guide, attempts) in enumerate(rows):
+            if not self.breaker.allow():
+                # Servidor fora: devolve o resto do lote sem gastar tentativas (desfaz a da reserva)
+                for rest in rows[position:]:
+                    self._finish(rest[0], PENDING, rest[4] - 1, "SMTP indisponível (circuit breaker aberto)",
+                                 time.time() + self.breaker.reset_timeout)
+                return
+            if attempts > self.max_attempts:
+                # Reserva expirada depois da última tentativa (o worker caiu no meio do envio)
+                self.failed += 1
+                self._finish(item_id, FAILED, attempts - 1, "Envio interrompido (reserva expirada) na última tentativa")
+                print(f"[ERROR] Email {item_id} falhou após {attempts - 1} tentativa(s): envio interrompido")
+                continue
+            try:
+                msg = self._message(recipient, body_html, guide)
+            except BlobMissingError:
+                # Sem o guia não há o que enviar: novas tentativas não adiantam
+                self.failed += 1
+                self._finish(item_id, FAILED, attempts, GUIDE_EXPIRED_ERROR)
+                print(f"[ERROR] Email {item_id} não enviado: o guia não está mais disponível")
+                continue
+            except Exception as e:
+                # Falha ao montar (ex.: PDF): não é problema do servidor SMTP
+                self._retry_or_fail(item_id, attempts, e)
+                continue
+            try:
+                smtp.send(msg)
+            except PermanentDeliveryError as e:
+                self.breaker.record_success()  # o servidor respondeu; o problema é a mensagem
+                self._fail_permanently(item_id, attempts, e)
+                continue
+            except (smtplib.SMTPAuthenticationError, smtplib.SMTPConnectError) as e:
+                # Credenciais erradas ou relay fora: problema do servidor, não da mensagem
+                self.breaker.record_failure()
+                smtp.close()
+                self._retry_or_fail(item_id, attempts, e)
+                continue
+            except smtplib.SMTPResponseException as e:
+                # O servidor respondeu: 5xx é definitivo, 4xx é recusa temporária (a conexão continua válida)
+                self.breaker.record_success()
+                if 500 <= e.smtp_code < 600:
+                    self._fail_permanently(item_id, attempts, e)
+                else:
+                    self._retry_or_fail(item_id, attempts, e)
+                continue
+            except smtplib.SMTPRecipientsRefused as e:
+                self.breaker.record_success()
+                self._retry_or_fail(item_id, attempts, e)
+                continue
+            except Exception as e:
+                self.breaker.record_failure()
+                smtp.close()
+                self._retry_or_fail(item_id, attempts, e)
+                continue
+            self.breaker.record_success()
+            self.sent += 1
+            self._finish(item_id, SENT, attempts)
+            print(f"[DEBUG] Email {item_id} enviado para {recipient}")
+
+    def _worker_loop(self):
+        smtp = self.connection_factory()
+        self._smtps.append(smtp)
+        try:
+            while not self._stop.is_set():
+                rows = self._claim()
+                if rows:
+                    self._deliver(smtp, rows)
+                    continue
+                self._wake.wait(OUTBOX_POLL_S)
+                self._wake.clear()
+        except Exception as e:
+            print(f"[ERROR] Worker do outbox parou: {e}")
+        finally:
+            smtp.close()
+
+    def start(self):
+        if not self._threads:
+            for i in range(max(1, self.workers)):
+                thread = threading.Thread(target=self._worker_loop, name=f"outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """Espera a fila esvaziar (pendentes e em envio). Usado em testes e benchmarks."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.counts().get(PENDING) and not self.counts().get(SENDING):
+                return True
+            self._wake.set()
+            time.sleep(0.05)
+        return False
+
+    # --- Consulta ---
+
+    def status(self, thread_id: str) -> Optional[dict]:
+        """Situação do último envio da conversa."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT id, recipient, status, attempts, last_error, created_at, sent_at, next_attempt_at "
+                "FROM outbox WHERE thread_id = ? ORDER BY id DESC LIMIT 1",
+                (thread_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "email", "status", "tentativas", "ultimo_erro", "criado_em", "enviado_em", "proxima_tentativa")
+        return dict(zip(keys, row))
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def stats(self) -> dict:
+        return {
+            "fila": self.counts(),
+            "enviados": self.sent,
+            "reagendados": self.retried,
+            "falhas": self.failed,
+            "conexoes_smtp": sum(s.connections for s in self._smtps),
+            "smtp_breaker": self.breaker.state,
+        }
+
+
+# --- SINGLETON ---
+
+_outbox_instance = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox() -> Outbox:
+    """Retorna o outbox único do processo, com os workers já rodando."""
+    global _outbox_instance
+    with _outbox_lock:
+        if _outbox_instance is None:
+            _outbox_instance = Outbox().start()
+            print(f"[SISTEMA] Outbox de emails em {OUTBOX_DB} ({SMTP_HOST}:{SMTP_PORT})")
+    return _outbox_instance
@@ -0,0 +1,310 @@
+import os
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from importlib.metadata import version, PackageNotFoundError
+from typing import Optional
+
+import markdown
+
+from agent.utils.cache import DiskCache, content_key
+from agent.utils.kv import shared_cache
+from agent.utils.resilience import submit
+
+# --- Configurações Globais ---
+# Processos do WeasyPrint mantidos aquecidos (0 = renderiza no próprio processo)
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(".cache", "pdfs"))
+PDF_CACHE_MAX_MB = float(os.getenv("PDF_CACHE_MAX_MB", "200"))
+PDF_CACHE_TTL_S = float(os.getenv("PDF_CACHE_TTL_H", "72")) * 3600
+# Subconjunto das fontes, sem hinting e imagens otimizadas: anexos bem menores
+PDF_OPTIMIZE = os.getenv("PDF_OPTIMIZE", "1") == "1"
+# Renderiza o PDF logo após gerar o guia, para o send_pdf só anexar os bytes prontos
+PDF_PRERENDER = os.getenv("PDF_PRERENDER", "1") == "1"
+GUIDE_CSS = """
+@page {
+    size: A4;
+    margin: 2cm;
+}
+body {
+    font-family: 'Arial', 'Helvetica', sans-serif;
+    line-height: 1.6;
+    color: #333;
+    max-width: 100%;
+}
+h1 {
+    color: #d946a6;
+    border-bottom: 3px solid #d946a6;
+    padding-bottom: 10px;
+    margin-top: 20px;
+}
+h2 {
+    color: #e879b9;
+    margin-top: 25px;
+    margin-bottom: 15px;
+}
+h3 {
+    color: #555;
+}
+ul, ol {
+    margin-left: 20px;
+}
+li {
+    margin-bottom: 8px;
+}
+p {
+    margin-bottom: 12px;
+}
+strong {
+    color: #222;
+}
+hr {
+    border: none;
+    border-top: 1px solid #ddd;
+    margin: 20px 0;
+}
+.footer {
+    margin-top: 30px;
+    padding-top: 10px;
+    border-top: 1px solid #ddd;
+    font-size: 0.9em;
+    color: #666;
+    text-align: center;
+}
+"""
+
+
+GUIDE_HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"></head>
+<body>
+    {guide_html}
+    <div class="footer">
+        <p>Documento gerado em {date}</p>
+    </div>
+</body>
+</html>
+"""
+
+
+def _weasyprint_version() -> str:
+    try:
+        return version("weasyprint")
+    except PackageNotFoundError:
+        return "?"
+
+
+# Versão do estilo dos PDFs em cache: muda sozinha com o CSS, o HTML ou as opções de escrita
+PDF_STYLE_VERSION = content_key(GUIDE_CSS, GUIDE_HTML_TEMPLATE, PDF_OPTIMIZE, _weasyprint_version())
+
+
+def today() -> str:
+    return datetime.now().strftime('%d/%m/%Y')
+
+
+def build_guide_html(guide: str, date: Optional[str] = None) -> str:
+    """HTML do guia (o estilo vai à parte, como folha de estilo já processada)."""
+    guide_html = markdown.markdown(guide, extensions=['extra', 'nl2br'])
+    return GUIDE_HTML_TEMPLATE.format(guide_html=guide_html, date=date or today())
+
+
+# --- Renderização (roda dentro dos processos do pool) ---
+
+_worker_state = None
+
+
+def _write_options(weasyprint) -> dict:
+    if not PDF_OPTIMIZE:
+        return {}
+    major = int(weasyprint.__version__.split(".")[0])
+    if major < 59:
+        return {"optimize_size": ("fonts", "images")}
+    return {"full_fonts": False, "hinting": False, "optimize_images": True, "uncompressed_pdf": False}
+
+
+def _init_worker():
+    """Importa o WeasyPrint e processa o CSS uma única vez por processo."""
+    global _worker_state
+    if _worker_state is not None:
+        return
+    import weasyprint
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    _worker_state = {
+        "HTML": weasyprint.HTML,
+        "css": weasyprint.CSS(string=GUIDE_CSS, font_config=font_config),
+        "font_config": font_config,
+        "options": _write_options(weasyprint),
+    }
+
+
+def render_html(html: str) -> bytes:
+    """Renderiza o HTML com a folha de estilo pré-processada do processo atual."""
+    _init_worker()
+    state = _worker_state
+    return state["HTML"](string=html).write_pdf(
+        stylesheets=[state["css"]], font_config=state["font_config"], **state["options"]
+    )
+
+
+def _warm_up() -> int:
+    render_html("<p>aquecimento</p>")
+    return os.getpid()
+
+
+class PdfRenderer:
+    """Renderização de PDFs do guia em um pool de processos aquecidos, com cache por conteúdo.
+
+    Pedidos iguais em andamento compartilham a mesma renderização; se o pool quebrar e não
+    puder ser recriado, a renderização é feita no próprio processo.
+    """
+
+    def __init__(self, workers: int = PDF_WORKERS, cache=None):
+        self.workers = workers
+        self.cache = cache
+        self._pool = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.hits = 0
+        self.failures = 0
+
+    @staticmethod
+    def key(guide: str, date: Optional[str] = None) -> str:
+        # A data do rodapé entra na chave: um PDF em cache nunca sai com a data de outro dia
+        return content_key("pdf", PDF_STYLE_VERSION, date or today(), guide)
+
+    def _get_pool(self):
+        if self._pool is None and self.workers > 0:
+            # spawn: os processos não herdam threads nem conexões do app
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=mp.get_context("spawn"),
+                                             initializer=_init_worker)
+        return self._pool
+
+    def warm(self):
+        """Sobe os processos e faz uma renderização mínima em cada um."""
+        pool = self._get_pool()
+        if pool is None:
+            _init_worker()
+            return self
+        for future in [pool.submit(_warm_up) for _ in range(self.workers)]:
+            future.result()
+        return self
+
+    def _store(self, key: str, future: Future):
+        with self._lock:
+            self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            self.failures += 1
+            return
+        self.renders += 1
+        if self.cache is not None:
+            self.cache.set_bytes(key, future.result())
+
+    def _submit_locked(self, html: str) -> Optional[Future]:
+        """Envia ao pool; None se a renderização tiver que ser feita no próprio processo."""
+        pool = self._get_pool()
+        if pool is None:
+            return None
+        try:
+            return pool.submit(render_html, html)
+        except BrokenProcessPool:
+            # Um processo morreu (ex.: falta de memória): recria o pool uma vez
+            print("[WARNING] Pool de PDF quebrado; recriando os processos.")
+            self._pool = None
+            try:
+                return self._get_pool().submit(render_html, html)
+            except BrokenProcessPool:
+                return None
+
+    def ready(self, guide: str, date: Optional[str] = None) -> Optional[bytes]:
+        """PDF já renderizado deste guia (com a data de hoje no rodapé), sem disparar nada."""
+        data = self.cache.get_bytes(self.key(guide, date)) if self.cache is not None else None
+        if data is not None:
+            self.hits += 1
+        return data
+
+    def submit(self, guide: str) -> Future:
+        """Agenda a renderização (ou devolve a que já está em andamento/pronta)."""
+        date = today()
+        key = self.key(guide, date)
+        data = self.ready(guide, date)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+            return future
+        html = build_guide_html(guide, date)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            pooled = self._submit_locked(html)
+            future = self._inflight[key] = pooled or Future()
+        future.add_done_callback(lambda f: self._store(key, f))
+        if pooled is None:
+            # Fora da trava: outros guias não esperam por esta renderização
+            try:
+                future.set_result(render_html(html))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def render(self, guide: str, timeout: Optional[float] = None) -> bytes:
+        return self.submit(guide).result(timeout=timeout)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "processos": self.workers,
+            "renderizacoes": self.renders,
+            "acertos_cache": self.hits,
+            "falhas": self.failures,
+            "em_andamento": len(self._inflight),
+        }
+
+
+# --- SINGLETON ---
+
+_pdf_renderer_instance = None
+_pdf_renderer_lock = threading.Lock()
+
+
+def get_pdf_cache():
+    return shared_cache("pdfs", PDF_CACHE_TTL_S,
+                        lambda: DiskCache(PDF_CACHE_DIR, int(PDF_CACHE_MAX_MB * 1024 * 1024)))
+
+
+def get_pdf_renderer() -> PdfRenderer:
+    """Retorna o renderizador único do processo (o pool sobe na primeira renderização)."""
+    global _pdf_renderer_instance
+    with _pdf_renderer_lock:
+        if _pdf_renderer_instance is None:
+            _pdf_renderer_instance = PdfRenderer(cache=get_pdf_cache())
+    return _pdf_renderer_instance
+
+
+def prerender(guide: str):
+    """Agenda em segundo plano a renderização do PDF do guia (erros só vão para o log)."""
+    if not PDF_PRERENDER or not guide:
+        return
+
+    def run():
+        try:
+            get_pdf_renderer().submit(guide).add_done_callback(_log_prerender)
+        except Exception as e:
+            print(f"[WARNING] Falha ao agendar o PDF do guia: {e}")
+
+    # O pool já é assíncrono; a thread só evita que o modo sem processos bloqueie o nó
+    submit(run)
+
+
+def _log_prerender(future: Future):
+    if future.exception() is not None:
+        print(f"[WARNING] Pré-renderização do PDF falhou: {future.exception()}")
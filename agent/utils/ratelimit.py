@@ -0,0 +1,54 @@
+import time
+import asyncio
+import threading
+from typing import Optional
+
+
+class TokenBucket:
+    """Limite de vazão (balde de fichas): `rate` fichas por segundo, acumulando até `capacity`.
+
+    Serve tanto para threads (`take`) quanto para corrotinas (`atake`); quem pede mais fichas
+    do que há disponível espera o tempo exato até o balde encher o suficiente.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate deve ser positivo")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_s = 0.0
+
+    @classmethod
+    def per_minute(cls, per_minute: float, burst: Optional[float] = None) -> "TokenBucket":
+        return cls(per_minute / 60.0, burst)
+
+    def _reserve(self, tokens: float) -> float:
+        """Reserva as fichas (o saldo pode ficar negativo) e retorna quanto esperar por elas."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.rate)
+            self.waited_s += wait
+            return wait
+
+    def take(self, tokens: float = 1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def atake(self, tokens: float = 1.0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self) -> dict:
+        return {
+            "fichas_por_s": self.rate,
+            "capacidade": self.capacity,
+            "espera_total_s": round(self.waited_s, 3),
+        }
@@ -0,0 +1,215 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Optional
+
+# --- Configurações Globais ---
+# Orçamento total de um turno do grafo (mensagem do usuário -> resposta)
+TURN_BUDGET_S = float(os.getenv("TURN_BUDGET_S", "90"))
+# Tetos por dependência; o timeout efetivo é o menor entre o teto e o que resta do prazo
+DEPENDENCY_TIMEOUTS_S = {
+    "llm": float(os.getenv("LLM_TIMEOUT_S", "60")),
+    "embedding": float(os.getenv("EMBEDDING_TIMEOUT_S", "10")),
+    "qdrant": float(os.getenv("QDRANT_TIMEOUT_S", "10")),
+    "smtp": float(os.getenv("SMTP_TIMEOUT_S", "20")),
+    "kv": float(os.getenv("KV_TIMEOUT_S", "2")),
+    "pdf": float(os.getenv("PDF_TIMEOUT_S", "30")),
+}
+# Margem reservada para o grafo terminar (formatar e devolver a resposta)
+DEADLINE_RESERVE_S = 0.5
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT_S = float(os.getenv("BREAKER_RESET_TIMEOUT_S", "30"))
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+# --- Prazo do turno (propagado por contextvars para os nós e ferramentas) ---
+
+_deadline = contextvars.ContextVar("tide_deadline", default=None)
+
+
+@contextmanager
+def turn_deadline(budget_s: float = TURN_BUDGET_S):
+    """Define o prazo absoluto do turno atual. Prazos aninhados nunca estendem o externo."""
+    new_deadline = time.monotonic() + budget_s
+    current = _deadline.get()
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield new_deadline
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Segundos restantes no prazo do turno, ou None se não houver prazo."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout_for(dependency: str, cap: Optional[float] = None) -> float:
+    """Timeout de uma chamada externa derivado do que resta do orçamento do turno."""
+    cap = DEPENDENCY_TIMEOUTS_S.get(dependency, 30.0) if cap is None else cap
+    left = remaining()
+    if left is None:
+        return cap
+    left -= DEADLINE_RESERVE_S
+    if left <= 0:
+        raise DeadlineExceeded(f"Prazo do turno esgotado antes de chamar '{dependency}'.")
+    return min(cap, left)
+
+
+# --- Execução com timeout ---
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="tide-io")
+
+
+def submit(fn, *args, **kwargs):
+    """Submete `fn` ao pool de I/O preservando o contexto (prazo, sessão)."""
+    ctx = contextvars.copy_context()
+    return _executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+def run_with_timeout(fn, timeout: float, *args, **kwargs):
+    """Executa uma chamada bloqueante, devolvendo o controle em no máximo `timeout` segundos.
+
+    A thread de trabalho não é interrompida, mas o turno não fica preso a ela.
+    """
+    future = submit(fn, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        future.cancel()
+        raise DeadlineExceeded(f"Chamada excedeu {timeout:.1f}s.")
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """Disjuntor simples: abre após N falhas seguidas e testa de novo após o reset."""
+
+    CLOSED, OPEN, HALF_OPEN = "fechado", "aberto", "meio_aberto"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT_S):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Meio aberto: deixa passar uma única chamada de teste
+            if self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"[SISTEMA] Circuit breaker '{self.name}' aberto após {self._failures} falha(s).")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"Dependência '{self.name}' indisponível (circuit breaker aberto).")
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, coro_fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError(f"Dependência '{self.name}' indisponível (circuit breaker aberto).")
+        try:
+            result = await coro_fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        return {"estado": self.state, "falhas": self._failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Retorna o circuit breaker único da dependência `name`."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def guarded_call(dependency: str, fn, *args, breaker: Optional[str] = None, cap: Optional[float] = None, **kwargs):
+    """Chama uma dependência externa com circuit breaker e timeout derivado do prazo do turno."""
+    cb = get_breaker(breaker or dependency)
+    timeout = timeout_for(dependency, cap)
+    return cb.call(run_with_timeout, fn, timeout, *args, **kwargs)
+
+
+async def aguarded_call(dependency: str, coro_fn, *args, breaker: Optional[str] = None,
+                        cap: Optional[float] = None, **kwargs):
+    """Versão assíncrona do guarded_call: a corrotina é cancelada ao estourar o timeout."""
+    cb = get_breaker(breaker or dependency)
+    timeout = timeout_for(dependency, cap)
+
+    async def bounded():
+        try:
+            return await asyncio.wait_for(coro_fn(*args, **kwargs), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"Chamada excedeu {timeout:.1f}s.")
+    return await cb.acall(bounded)
+
+
+def breakers_snapshot() -> dict:
+    with _breakers_lock:
+        return {name: cb.snapshot() for name, cb in _breakers.items()}
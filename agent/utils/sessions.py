@@ -0,0 +1,278 @@
+import os
+import sys
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from langgraph.checkpoint.memory import InMemorySaver
+
+from agent.utils.checkpointer import get_checkpointer
+
+# --- Configurações Globais ---
+# Sessões sem interação há mais tempo que isso são descarregadas da memória
+SESSION_IDLE_S = float(os.getenv("SESSION_IDLE_MIN", "30")) * 60
+# Orçamento de memória (estimada) de todas as sessões; acima dele as menos recentes saem primeiro
+SESSION_MEMORY_BUDGET_BYTES = int(float(os.getenv("SESSION_MEMORY_MB", "256")) * 1024 * 1024)
+SESSION_SWEEP_S = float(os.getenv("SESSION_SWEEP_S", "60"))
+# "persistente": todas as sessões gravam no checkpointer do processo (SQLite ou camada compartilhada);
+# "memoria": cada sessão tem um InMemorySaver próprio, copiado para o persistente ao ser descarregada
+SESSION_CHECKPOINTER = os.getenv("SESSION_CHECKPOINTER", "persistente")
+SESSION_PERSIST_ON_EVICT = os.getenv("SESSION_PERSIST_ON_EVICT", "1") == "1"
+
+
+def resident_memory_bytes() -> int:
+    """Memória residente atual do processo (RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss é o pico (em KB no Linux, em bytes no macOS): melhor aproximação disponível
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def copy_thread(source, target, thread_id: str) -> int:
+    """Copia os checkpoints (e writes pendentes) de uma conversa entre checkpointers. Retorna quantos copiou."""
+    config = {"configurable": {"thread_id": thread_id}}
+    copied = 0
+    for item in reversed(list(source.list(config))):
+        if target.get_tuple(item.config) is not None:
+            continue  # já copiado em um descarte anterior
+        parent = item.parent_config or {"configurable": {
+            "thread_id": thread_id, "checkpoint_ns": item.config["configurable"].get("checkpoint_ns", ""),
+        }}
+        saved = target.put(parent, item.checkpoint, item.metadata, item.checkpoint.get("channel_versions", {}))
+        by_task = {}
+        for task_id, channel, value in item.pending_writes or []:
+            by_task.setdefault(task_id, []).append((channel, value))
+        for task_id, writes in by_task.items():
+            target.put_writes(saved, writes, task_id)
+        copied += 1
+    return copied
+
+
+def _in_memory_bytes(saver: InMemorySaver, thread_id: str) -> int:
+    """Bytes serializados de uma conversa em um InMemorySaver."""
+    total = 0
+    for checkpoints in saver.storage.get(thread_id, {}).values():
+        for checkpoint, metadata, _ in checkpoints.values():
+            total += len(checkpoint[1]) + len(metadata[1])
+    for (tid, *_), (_, data) in list(saver.blobs.items()):
+        if tid == thread_id:
+            total += len(data)
+    return total
+
+
+class Session:
+    """Estado de uma conversa no processo: o grafo, seu checkpointer e o histórico visual."""
+
+    __slots__ = ("thread_id", "graph", "checkpointer", "messages", "created_at", "last_active", "users")
+
+    def __init__(self, thread_id: str, graph, checkpointer):
+        self.thread_id = thread_id
+        self.graph = graph
+        self.checkpointer = checkpointer
+        self.messages = None  # preenchido pelo app a partir do checkpoint
+        self.created_at = self.last_active = time.monotonic()
+        self.users = 0  # turnos em execução: a sessão não é descartada enquanto houver algum
+
+    @property
+    def in_memory(self) -> bool:
+        return isinstance(self.checkpointer, InMemorySaver)
+
+    def size_bytes(self) -> int:
+        """Estimativa do que a sessão ocupa: histórico visual e, se em memória, os checkpoints."""
+        size = sum(len(str(m.get("content", ""))) for m in self.messages or [])
+        if self.in_memory:
+            size += _in_memory_bytes(self.checkpointer, self.thread_id)
+        return size
+
+
+class SessionManager:
+    """Sessões por thread_id com descarte por inatividade e orçamento global de memória (LRU).
+
+    Uma sessão descarregada volta sozinha na próxima interação: o grafo é recriado e o
+    histórico é reconstruído a partir do checkpoint persistido. Sessões em uso (`use`) nunca
+    são descartadas, e o orçamento é aplicado pela limpeza em segundo plano, fora do caminho
+    de cada interação.
+    """
+
+    def __init__(self, graph_factory: Callable, mode: str = SESSION_CHECKPOINTER, idle_s: float = SESSION_IDLE_S,
+                 budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES, persist_on_evict: bool = SESSION_PERSIST_ON_EVICT,
+                 persistent=None):
+        self.graph_factory = graph_factory
+        self.mode = mode
+        self.idle_s = idle_s
+        self.budget_bytes = budget_bytes
+        self.persist_on_evict = persist_on_evict
+        self._persistent = persistent
+        self._sessions = OrderedDict()  # thread_id -> Session, da menos para a mais recente
+        self._evicting = {}  # thread_id -> Event, enquanto a cópia para o persistente não termina
+        self._shared_graph = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._sweeper = None
+        self.created = 0
+        self.evicted_idle = 0
+        self.evicted_budget = 0
+        self.persisted = 0
+
+    @property
+    def persistent(self):
+        if self._persistent is None:
+            self._persistent = get_checkpointer()
+        return self._persistent
+
+    def _new_session(self, thread_id: str) -> Session:
+        if self.mode == "memoria":
+            saver = InMemorySaver()
+            # Retoma a conversa que foi descarregada (ou começou em outra réplica)
+            copy_thread(self.persistent, saver, thread_id)
+            return Session(thread_id, self.graph_factory(saver), saver)
+        # Checkpointer persistente: um único grafo compilado atende todas as sessões
+        if self._shared_graph is None:
+            self._shared_graph = self.graph_factory(self.persistent)
+        return Session(thread_id, self._shared_graph, self.persistent)
+
+    def get(self, thread_id: str, hold: bool = False) -> Session:
+        """Sessão da conversa (criada ou recarregada se preciso), marcada como ativa agora.
+
+        Com `hold`, a sessão fica em uso até `release` (veja `use`).
+        """
+        while True:
+            with self._lock:
+                evicting = self._evicting.get(thread_id)
+                if evicting is None:
+                    session = self._sessions.get(thread_id)
+                    if session is None:
+                        session = self._sessions[thread_id] = self._new_session(thread_id)
+                        self.created += 1
+                        self._wake.set()  # sessão nova: a limpeza confere o orçamento agora
+                    self._sessions.move_to_end(thread_id)
+                    session.last_active = time.monotonic()
+                    if hold:
+                        session.users += 1
+                    return session
+            # Sendo descarregada agora: espera a cópia para o persistente e recarrega a partir dela
+            evicting.wait()
+
+    def release(self, session: Session):
+        with self._lock:
+            session.users -= 1
+            session.last_active = time.monotonic()
+
+    @contextmanager
+    def use(self, thread_id: str):
+        """Sessão em uso durante um turno: não é descartada até o fim do bloco."""
+        session = self.get(thread_id, hold=True)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def evict(self, thread_id: str, idle_before: Optional[float] = None) -> bool:
+        """Descarrega a sessão se não estiver em uso (e, com `idle_before`, se seguir inativa desde então)."""
+        with self._lock:
+            session = self._sessions.get(thread_id)
+            if session is None or session.users:
+                return False
+            if idle_before is not None and session.last_active > idle_before:
+                return False
+            del self._sessions[thread_id]
+            done = self._evicting[thread_id] = threading.Event()
+        try:
+            if session.in_memory:
+                if self.persist_on_evict and copy_thread(session.checkpointer, self.persistent, thread_id):
+                    self.persisted += 1
+                session.checkpointer.delete_thread(thread_id)
+        finally:
+            with self._lock:
+                self._evicting.pop(thread_id, None)
+            done.set()
+        return True
+
+    def _enforce_budget(self):
+        # Tamanhos e candidatas (menos recentes primeiro) sob o lock; os descartes (I/O) fora dele
+        with self._lock:
+            sizes = [(tid, s.size_bytes(), s.users) for tid, s in self._sessions.items()]
+        total = sum(size for _, size, _ in sizes)
+        for thread_id, size, users in sizes:
+            if total <= self.budget_bytes:
+                break
+            if not users and self.evict(thread_id):
+                total -= size
+                self.evicted_budget += 1
+
+    def sweep(self) -> dict:
+        """Descarrega as sessões inativas e aplica o orçamento de memória."""
+        cutoff = time.monotonic() - self.idle_s
+        with self._lock:
+            idle = [tid for tid, s in self._sessions.items() if s.last_active <= cutoff and not s.users]
+        for thread_id in idle:
+            if self.evict(thread_id, idle_before=cutoff):
+                self.evicted_idle += 1
+        self._enforce_budget()
+        return self.metrics()
+
+    def _sweep_loop(self, interval_s: float):
+        while not self._stop.is_set():
+            self._wake.wait(interval_s)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                m = self.sweep()
+                print(f"[SISTEMA] Sessões: {m['sessoes_ativas']} ativas, "
+                      f"{m['memoria_sessoes_bytes'] / 1e6:.1f} MB estimados, RSS {m['rss_bytes'] / 1e6:.0f} MB")
+            except Exception as e:
+                print(f"[WARNING] Falha na limpeza de sessões: {e}")
+
+    def start_sweeper(self, interval_s: float = SESSION_SWEEP_S):
+        if self._sweeper is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(interval_s,), daemon=True)
+            self._sweeper.start()
+        return self
+
+    def stop_sweeper(self):
+        self._stop.set()
+        self._wake.set()
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(s.size_bytes() for s in self._sessions.values())
+
+    def metrics(self) -> dict:
+        with self._lock:
+            active = len(self._sessions)
+        return {
+            "sessoes_ativas": active,
+            "memoria_sessoes_bytes": self.memory_bytes(),
+            "orcamento_bytes": self.budget_bytes,
+            "rss_bytes": resident_memory_bytes(),
+            "criadas": self.created,
+            "descartadas_inatividade": self.evicted_idle,
+            "descartadas_orcamento": self.evicted_budget,
+            "persistidas": self.persisted,
+        }
+
+
+# --- SINGLETON ---
+
+_session_manager_instance = None
+_session_manager_lock = threading.Lock()
+
+
+def get_session_manager() -> SessionManager:
+    """Gerenciador de sessões único do processo (com a limpeza periódica já iniciada)."""
+    global _session_manager_instance
+    with _session_manager_lock:
+        if _session_manager_instance is None:
+            from agent.agent import create_agent_graph
+            _session_manager_instance = SessionManager(
+                lambda checkpointer: create_agent_graph(checkpointer=checkpointer)
+            ).start_sweeper()
+    return _session_manager_instance
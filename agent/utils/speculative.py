@@ -0,0 +1,127 @@
+import os
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Optional
+
+from agent.utils.resilience import turn_deadline
+
+# --- Configurações Globais ---
+GUIDE_SPECULATION = os.getenv("GUIDE_SPECULATION", "1") == "1"
+# Prazo próprio da geração especulativa (não herda o prazo do turno que a disparou)
+SPECULATION_BUDGET_S = float(os.getenv("SPECULATION_BUDGET_S", "120"))
+SPECULATION_TTL_S = 15 * 60
+SPECULATION_MAX_ENTRIES = 64
+
+
+class SpeculativeGuides:
+    """Gerações de guia disparadas antes da confirmação, indexadas pelo hash do user_data.
+
+    - start(): inicia em segundo plano (idempotente por chave);
+    - take(): entrega o resultado pronto ou aguarda o que está em andamento;
+    - cancel(): descarta a geração (a usuária clicou em "Corrigir").
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="guide-spec")
+        self._entries = OrderedDict()  # chave -> (future, criado_em)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    def _run(self, fn, args):
+        # Threads do pool não herdam o contexto de quem disparou: o prazo é o da especulação
+        with turn_deadline(SPECULATION_BUDGET_S):
+            return fn(*args)
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        for key in [k for k, (_, created) in self._entries.items() if now - created > SPECULATION_TTL_S]:
+            self._entries.pop(key)[0].cancel()
+        while len(self._entries) > SPECULATION_MAX_ENTRIES:
+            _, (future, _) = self._entries.popitem(last=False)
+            future.cancel()
+
+    def start(self, key: str, fn, *args):
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key][0]
+            future = self._executor.submit(self._run, fn, args)
+            self._entries[key] = (future, time.monotonic())
+            self._evict_locked()
+            print(f"[SISTEMA] Geração especulativa do guia iniciada ({key[:10]}...)")
+            return future
+
+    def take(self, key: str, timeout: Optional[float] = None):
+        """Retorna o resultado especulado (aguardando até `timeout`) ou None se não houver/falhar."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        future = entry[0]
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeout:
+            print("[WARNING] Geração especulativa não terminou a tempo; gerando novamente.")
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"[WARNING] Geração especulativa falhou ({e}); gerando novamente.")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    async def atake(self, key: str, timeout: Optional[float] = None):
+        """Como take(), mas aguarda no event loop."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            # shield: um timeout aqui não cancela a geração (ela pode alimentar o cache)
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(entry[0])), timeout)
+        except asyncio.TimeoutError:
+            print("[WARNING] Geração especulativa não terminou a tempo; gerando novamente.")
+            self.misses += 1
+            return None
+        except Exception as e:
+            print(f"[WARNING] Geração especulativa falhou ({e}); gerando novamente.")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def cancel(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            # Se já estiver rodando, o resultado é apenas descartado
+            entry[0].cancel()
+            self.cancelled += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = sum(1 for future, _ in self._entries.values() if not future.done())
+            return {"em_andamento": in_flight, "prontas": len(self._entries) - in_flight,
+                    "acertos": self.hits, "faltas": self.misses, "canceladas": self.cancelled}
+
+
+# --- SINGLETON ---
+
+_speculative_instance = None
+_speculative_lock = threading.Lock()
+
+
+def get_speculative_guides() -> SpeculativeGuides:
+    """Retorna o registro único de guias especulativos."""
+    global _speculative_instance
+    with _speculative_lock:
+        if _speculative_instance is None:
+            _speculative_instance = SpeculativeGuides()
+    return _speculative_instance
@@ -14,6 +14,9 @@ class StateSchema(TypedDict):
     debug: Optional[Any]
     confirmation: Optional[bool]
     exit_guide: Optional[bool]
+    # Modo de formulário único: erros de validação e campos alterados na última resposta
+    form_errors: Optional[Dict[str, str]]
+    changed_fields: Optional[list]
     
     # Campos para avaliação e reformulação de respostas
     pass_evaluation: Optional[bool]
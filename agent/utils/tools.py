@@ -1,38 +1,50 @@
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+import asyncio
+import weakref
 from datetime import datetime
-from io import BytesIO
-from langchain_cerebras import ChatCerebras
-import markdown
-from weasyprint import HTML
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain.tools import tool, ToolRuntime
-from qdrant_client import QdrantClient
+from langchain_core.tools import StructuredTool
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from sentence_transformers import SentenceTransformer
 from google import genai
 import numpy as np
-from jinja2 import Environment, FileSystemLoader
 from dotenv import load_dotenv
 
+from agent.utils.blobs import offload, resolve, BlobMissingError
+from agent.utils.cache import MemoryCache, content_key
+from agent.utils.gateway import get_gateway
+from agent.utils.kv import shared_cache
+from agent.utils.outbox import get_outbox, guide_email_body, SENT, FAILED
+from agent.utils.resilience import guarded_call, aguarded_call, CircuitOpenError, DeadlineExceeded, DEPENDENCY_TIMEOUTS_S
+
 load_dotenv()
 
 # --- Configurações Globais ---
 GEMINI_EMBEDD = True
 COLLECTION_NAME = "Tide"
 EMBED_DIM = 768
-MODEL_NAME = "gemini-2.5-flash-lite"
+# Caches de embeddings e de resultados da busca (na camada compartilhada, se KV_URL estiver definida)
+EMBEDDING_CACHE_TTL_S = float(os.getenv("EMBEDDING_CACHE_TTL_H", "720")) * 3600
+RETRIEVAL_CACHE_TTL_S = float(os.getenv("RETRIEVAL_CACHE_TTL_S", "3600"))
+RETRIEVAL_LIMIT = 4
+
+# Resposta degradada: o chat segue sem recuperação, usando a regra de "Nota" do prompt
+RETRIEVAL_UNAVAILABLE_MSG = (
+    "⚠️ A base de documentos está temporariamente indisponível. Responda sem documentos de referência, "
+    "usando seu conhecimento geral e a frase de transição \"Nota: ...\" prevista nas regras, sem citar fontes 【X】."
+)
 
-env = Environment(loader=FileSystemLoader('templates'))
 
 # --- SINGLETONS (Gerenciadores de Conexão) ---
 
 # Variáveis globais privadas para armazenar as instâncias
 _qdrant_instance = None
+_async_qdrant_instances = weakref.WeakKeyDictionary()  # um cliente por event loop
 _embedding_instance = None
-_llm_instance = None
+_gemini_embeddings_instance = None
+_embedding_cache_instance = None
+_retrieval_cache_instance = None
 
 def get_qdrant_client():
     """Retorna a instância única do Qdrant Client."""
@@ -41,10 +53,24 @@ def get_qdrant_client():
         print("[SISTEMA] Iniciando conexão com Qdrant...")
         _qdrant_instance = QdrantClient(
             url=os.getenv("QDRANT_URL"),
-            api_key=os.getenv("QDRANT_API_KEY")
+            api_key=os.getenv("QDRANT_API_KEY"),
+            timeout=int(DEPENDENCY_TIMEOUTS_S["qdrant"])
         )
     return _qdrant_instance
 
+def get_async_qdrant_client():
+    """Retorna o AsyncQdrantClient do event loop atual (conexões assíncronas não atravessam loops)."""
+    loop = asyncio.get_running_loop()
+    client = _async_qdrant_instances.get(loop)
+    if client is None:
+        client = AsyncQdrantClient(
+            url=os.getenv("QDRANT_URL"),
+            api_key=os.getenv("QDRANT_API_KEY"),
+            timeout=int(DEPENDENCY_TIMEOUTS_S["qdrant"])
+        )
+        _async_qdrant_instances[loop] = client
+    return client
+
 def get_embedding_model():
     """Retorna a instância única do modelo de Embedding (Gemini ou Local)."""
     global _embedding_instance
@@ -59,28 +85,33 @@ def get_embedding_model():
             _embedding_instance = SentenceTransformer(EMBEDDING_MODEL_NAME)
     return _embedding_instance
 
-def get_llm():
-    """Retorna a instância única do LLM."""
-    global _llm_instance
-    if _llm_instance is None:
-        # print("[SISTEMA] Iniciando LLM Gemini...")
-        # _llm_instance = ChatGoogleGenerativeAI(
-        #     api_key=os.getenv("GOOGLE_API_KEY"),
-        #     model=MODEL_NAME,
-        #     temperature=0,
-        #     max_tokens=2048,
-        #     timeout=None,
-        #     max_retries=1,           
-        # )
-        _llm_instance = ChatCerebras(
-        temperature=0,
-        model_name="gpt-oss-120b",
-        api_key= os.getenv("CEREBRAS_API_KEY"),
-        max_retries=3,
-        timeout=None
-    )
+def get_gemini_embeddings():
+    """Retorna o gerador de embeddings do Gemini (com as variantes síncrona e assíncrona)."""
+    global _gemini_embeddings_instance
+    if _gemini_embeddings_instance is None:
+        _gemini_embeddings_instance = GoogleGenerativeAIEmbeddings(
+            model="gemini-embedding-001",
+            task_type="retrieval_query"
+        )
+    return _gemini_embeddings_instance
+
+def get_embedding_cache():
+    """Cache de vetores por (modelo, texto)."""
+    global _embedding_cache_instance
+    if _embedding_cache_instance is None:
+        _embedding_cache_instance = shared_cache("emb", EMBEDDING_CACHE_TTL_S, lambda: MemoryCache(2048))
+    return _embedding_cache_instance
 
-    return _llm_instance
+def get_retrieval_cache():
+    """Cache dos documentos formatados por (coleção, modelo, consulta)."""
+    global _retrieval_cache_instance
+    if _retrieval_cache_instance is None:
+        _retrieval_cache_instance = shared_cache("retr", RETRIEVAL_CACHE_TTL_S, lambda: MemoryCache(512))
+    return _retrieval_cache_instance
+
+def get_llm():
+    """Retorna o gateway de LLMs compartilhado com o grafo."""
+    return get_gateway()
 
 
 # --- Funções Auxiliares ---
@@ -97,24 +128,78 @@ def get_embedding(text: str):
     model = get_embedding_model()
     
     if GEMINI_EMBEDD:
-        # 1. Inicializa o gerador de embeddings nativo
-        embeddings_model = GoogleGenerativeAIEmbeddings(
-            model="gemini-embedding-001",
-            task_type="retrieval_query"
-        )
+        # 1. Gera o vetor da pergunta com o gerador de embeddings nativo
+        vetor = get_gemini_embeddings().embed_query(text)
         
-        # 2. Gera o vetor da pergunta de forma segura
-        vetor = embeddings_model.embed_query(text)
-        
-        # 3. Retorna o vetor normalizado, conforme sua lógica original
+        # 2. Retorna o vetor normalizado, conforme sua lógica original
         return normalize(vetor)
         
     else:
         return model.encode(text).tolist()
+
+async def aget_embedding(text: str):
+    """Versão assíncrona do get_embedding (o modelo local roda fora do event loop)."""
+    if GEMINI_EMBEDD:
+        vetor = await get_gemini_embeddings().aembed_query(text)
+        return normalize(vetor)
+    model = get_embedding_model()
+    return (await asyncio.to_thread(model.encode, text)).tolist()
+
+def embedding_model_name() -> str:
+    return "gemini-embedding-001" if GEMINI_EMBEDD else "all-MiniLM-L6-v2"
+
+def get_cached_embedding(text: str):
+    """Embedding com cache (float32); na falta, chama o modelo com timeout e circuit breaker."""
+    cache = get_embedding_cache()
+    key = content_key(embedding_model_name(), text)
+    data = cache.get_bytes(key)
+    if data is not None:
+        return np.frombuffer(data, dtype=np.float32).tolist()
+    embedding = guarded_call("embedding", get_embedding, text)
+    cache.set_bytes(key, np.asarray(embedding, dtype=np.float32).tobytes())
+    return embedding
+
+async def aget_cached_embedding(text: str):
+    # Leituras/escritas de cache podem ir à rede (KV): ficam fora do event loop
+    cache = get_embedding_cache()
+    key = content_key(embedding_model_name(), text)
+    data = await asyncio.to_thread(cache.get_bytes, key)
+    if data is not None:
+        return np.frombuffer(data, dtype=np.float32).tolist()
+    embedding = await aguarded_call("embedding", aget_embedding, text)
+    await asyncio.to_thread(cache.set_bytes, key, np.asarray(embedding, dtype=np.float32).tobytes())
+    return embedding
+
+def retrieval_cache_key(query: str) -> str:
+    return content_key(COLLECTION_NAME, embedding_model_name(), RETRIEVAL_LIMIT, " ".join(query.split()))
+
+def format_documents(query: str, points) -> str:
+    """Formata os pontos retornados pelo Qdrant no texto entregue ao modelo."""
+    formatted_docs = []
+    for idx, point in enumerate(points, 1):
+        texto = point.payload.get('texto', '[Texto não disponível]')
+        fonte = point.payload.get('fonte', '[Fonte não disponível]')
+        
+        doc_str = (
+            f"📄 DOCUMENTO {idx}:\n"
+            f"{texto}\n\n"
+            f"🔗 FONTE: {fonte}\n"
+            f"{'-'*80}"
+        )
+        formatted_docs.append(doc_str)
+
+    docs_text = "\n".join(formatted_docs)
+    return (
+        f"\n{'='*80}\n"
+        f"📚 DOCUMENTOS RECUPERADOS PARA: '{query}'\n"
+        f"{'='*80}\n"
+        f"{docs_text}\n"
+        f"{'='*80}\n"
+        f"⚠️ IMPORTANTE: Sempre cite a fonte (link) das informações utilizadas.\n"
+    )
 # --- Ferramentas (Tools) ---
 
-@tool
-def retrieve_information(query: str) -> str:
+def _retrieve_information(query: str) -> str:
     """Retorna documentos com informacoes confiaveis e relevantes sobre aspectos da menopausa.
     Esta ferramenta é útil para obter informações detalhadas sobre sintomas, tratamentos,
     impacto na saúde mental, dicas de estilo de vida e outros tópicos relacionados à saúde da mulher durante a menopausa.
@@ -127,49 +212,86 @@ def retrieve_information(query: str) -> str:
     
     print(f"[DEBUG] Iniciando busca direta para: {query}")
 
+    retrieval_cache = get_retrieval_cache()
+    retrieval_key = retrieval_cache_key(query)
+    cached = retrieval_cache.get(retrieval_key)
+    if cached is not None:
+        print("[DEBUG] Documentos servidos do cache de busca")
+        return offload(cached)
+
     try:
-        embedding = get_embedding(query)
+        # Cada dependência tem timeout derivado do prazo do turno e seu próprio circuit breaker
+        embedding = get_cached_embedding(query)
         client = get_qdrant_client()
 
         # Busca no Qdrant
-        results = client.query_points(
+        results = guarded_call(
+            "qdrant",
+            client.query_points,
             collection_name=COLLECTION_NAME,
             query=embedding,
-            limit=4 
+            limit=RETRIEVAL_LIMIT
         )
         
         if not results.points:
             return "⚠️ Nenhum documento relevante encontrado na base de dados."
 
-        # Formatação dos resultados
-        formatted_docs = []
-        for idx, point in enumerate(results.points, 1):
-            texto = point.payload.get('texto', '[Texto não disponível]')
-            fonte = point.payload.get('fonte', '[Fonte não disponível]')
-            
-            doc_str = (
-                f"📄 DOCUMENTO {idx}:\n"
-                f"{texto}\n\n"
-                f"🔗 FONTE: {fonte}\n"
-                f"{'-'*80}"
-            )
-            formatted_docs.append(doc_str)
-
-        final_response = (
-            f"\n{'='*80}\n"
-            f"📚 DOCUMENTOS RECUPERADOS PARA: '{query}'\n"
-            f"{'='*80}\n"
-            f"{'\n'.join(formatted_docs)}\n"
-            f"{'='*80}\n"
-            f"⚠️ IMPORTANTE: Sempre cite a fonte (link) das informações utilizadas.\n"
-        )
-        
-        return final_response
+        final_response = format_documents(query, results.points)
+        retrieval_cache.set(retrieval_key, final_response)
+        # Os documentos ficam fora do checkpoint; o estado guarda só a referência
+        return offload(final_response)
+
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        print(f"[WARNING] Busca vetorial em modo degradado: {e}")
+        return RETRIEVAL_UNAVAILABLE_MSG
 
     except Exception as e:
         error_msg = f"[ERROR] Falha na busca vetorial: {str(e)}"
         print(error_msg)
-        return "Desculpe, ocorreu um erro técnico ao buscar os documentos."
+        return RETRIEVAL_UNAVAILABLE_MSG
+
+async def _aretrieve_information(query: str) -> str:
+    """Mesma busca do _retrieve_information, com embedding e Qdrant assíncronos."""
+    print(f"[DEBUG] Iniciando busca direta (async) para: {query}")
+
+    retrieval_cache = get_retrieval_cache()
+    retrieval_key = retrieval_cache_key(query)
+    cached = await asyncio.to_thread(retrieval_cache.get, retrieval_key)
+    if cached is not None:
+        print("[DEBUG] Documentos servidos do cache de busca")
+        return await asyncio.to_thread(offload, cached)
+
+    try:
+        embedding = await aget_cached_embedding(query)
+        results = await aguarded_call(
+            "qdrant",
+            get_async_qdrant_client().query_points,
+            collection_name=COLLECTION_NAME,
+            query=embedding,
+            limit=RETRIEVAL_LIMIT
+        )
+
+        if not results.points:
+            return "⚠️ Nenhum documento relevante encontrado na base de dados."
+
+        final_response = format_documents(query, results.points)
+        await asyncio.to_thread(retrieval_cache.set, retrieval_key, final_response)
+        return await asyncio.to_thread(offload, final_response)
+
+    except (CircuitOpenError, DeadlineExceeded) as e:
+        print(f"[WARNING] Busca vetorial em modo degradado: {e}")
+        return RETRIEVAL_UNAVAILABLE_MSG
+
+    except Exception as e:
+        print(f"[ERROR] Falha na busca vetorial: {str(e)}")
+        return RETRIEVAL_UNAVAILABLE_MSG
+
+# Uma única ferramenta com as duas execuções: invoke() usa a síncrona e ainvoke() a assíncrona
+retrieve_information = StructuredTool.from_function(
+    func=_retrieve_information,
+    coroutine=_aretrieve_information,
+    name="retrieve_information",
+)
 
 @tool
 def send_pdf(runtime: ToolRuntime) -> str:
@@ -184,7 +306,10 @@ def send_pdf(runtime: ToolRuntime) -> str:
     """
 
     user_data = runtime.state.get("user_data", {})
-    guide = user_data.get("guide", None)
+    try:
+        guide = resolve(user_data.get("guide", None), strict=True)
+    except BlobMissingError:
+        return "O guia salvo desta conversa expirou e não pode ser enviado. Explique isso ao usuário e pergunte se ele quer gerar o guia novamente."
     email = user_data.get("email", None)
     nome = user_data.get("nome", "Usuária")
 
@@ -194,136 +319,48 @@ def send_pdf(runtime: ToolRuntime) -> str:
     if not email or email == "Não informado":
         return "Não encontrei o email do usuário. Solicite o email antes de enviar."
 
+    # Se o guia estiver salvo como lista (vários pedaços), junta tudo em um texto só
+    guide_ref = user_data.get("guide")
+    if isinstance(guide, list):
+        guide_ref = "\n".join(guide)
+
+    corpo_email = guide_email_body(nome)
+
     try:
-       
-       # Se o guia estiver salvo como lista (vários pedaços), junta tudo em um texto só
-        if isinstance(guide, list):
-            guide = "\n".join(guide)
-        
-        # Garante que é string antes de continuar
-        guide = str(guide)
+        # Só grava o pedido: o PDF e o SMTP ficam com os workers do outbox (com novas tentativas)
+        thread_id = (runtime.config or {}).get("configurable", {}).get("thread_id")
+        item_id = get_outbox().enqueue(email, corpo_email, str(guide_ref), thread_id=thread_id)
+        print(f"[DEBUG] Email {item_id} para {email} colocado na fila de envio")
+        return f"✅ O guia foi colocado na fila de envio para o email {email} e deve chegar em poucos minutos. Verifique sua caixa de entrada (e também a pasta de spam, só por precaução). 📧✨"
 
-        remetente = os.getenv("REMETENTE")
-        senha = os.getenv("EMAIL_PASSWORD")
-        
-        print(f"[DEBUG] Iniciando envio de email para: {email}")
-        
-        # Converter Markdown para HTML
-        guide_html = markdown.markdown(guide, extensions=['extra', 'nl2br'])
-        
-        # Estilização CSS
-        styled_guide_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <style>
-                @page {{
-                    size: A4;
-                    margin: 2cm;
-                }}
-                body {{
-                    font-family: 'Arial', 'Helvetica', sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 100%;
-                }}
-                h1 {{
-                    color: #d946a6;
-                    border-bottom: 3px solid #d946a6;
-                    padding-bottom: 10px;
-                    margin-top: 20px;
-                }}
-                h2 {{
-                    color: #e879b9;
-                    margin-top: 25px;
-                    margin-bottom: 15px;
-                }}
-                h3 {{
-                    color: #555;
-                }}
-                ul, ol {{
-                    margin-left: 20px;
-                }}
-                li {{
-                    margin-bottom: 8px;
-                }}
-                p {{
-                    margin-bottom: 12px;
-                }}
-                strong {{
-                    color: #222;
-                }}
-                hr {{
-                    border: none;
-                    border-top: 1px solid #ddd;
-                    margin: 20px 0;
-                }}
-                .footer {{
-                    margin-top: 30px;
-                    padding-top: 10px;
-                    border-top: 1px solid #ddd;
-                    font-size: 0.9em;
-                    color: #666;
-                    text-align: center;
-                }}
-            </style>
-        </head>
-        <body>
-            {guide_html}
-            <div class="footer">
-                <p>Documento gerado em {datetime.now().strftime('%d/%m/%Y às %H:%M')}</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        # transformar HTML em PDF
-        pdf_buffer = BytesIO()
-        HTML(string=styled_guide_html).write_pdf(pdf_buffer)
-        pdf_buffer.seek(0)
-        
-        # Gerar Corpo do Email com Jinja2
-        try:
-            template = env.get_template('email_template.html')
-            corpo_email = template.render(nome=nome)
-        except Exception as e:
-            print(f"[WARNING] Erro ao carregar template Jinja2: {e}. Usando fallback.")
-            corpo_email = f"Olá {nome}, seu guia está em anexo."
-
-        print(f"[DEBUG] PDF gerado com sucesso ({len(pdf_buffer.getvalue())} bytes)")
-        
-        # metadados do email montar e-mail
-        msg = MIMEMultipart()
-        msg['Subject'] = '🌸 Seu Guia Personalizado Para Consulta'
-        msg['From'] = remetente
-        msg['To'] = email
-        
-        
-        msg.attach(MIMEText(corpo_email, 'html', 'utf-8'))
-        
-        # Anexar PDF
-        pdf_attachment = MIMEApplication(pdf_buffer.getvalue(), _subtype='pdf')
-        pdf_attachment.add_header('Content-Disposition', 'attachment', filename=f'guia_consulta_{datetime.now().strftime("%Y%m%d")}.pdf')
-        msg.attach(pdf_attachment)
-        
-        # enviar email
-        print(f"[DEBUG] Conectando ao servidor SMTP...")
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(remetente, senha)
-            server.send_message(msg)
-        
-        print(f"[DEBUG] Email enviado com sucesso!")
-        
-        return f"✅ Guia enviado com sucesso para o email {email}! Verifique sua caixa de entrada (e também a pasta de spam, só por precaução). 📧✨"
-    
     except Exception as e:
         error_msg = str(e)
-        print(f"[ERROR] Erro ao enviar email: {error_msg}")
+        print(f"[ERROR] Erro ao enfileirar email: {error_msg}")
         return f"❌ Desculpe, houve um erro ao enviar o email: {error_msg}. Por favor, tente novamente mais tarde ou verifique se o email fornecido está correto."
 
+@tool
+def email_status(runtime: ToolRuntime) -> str:
+    """Consulta a situação do envio do guia por email (na fila, enviado ou com falha).
+
+    Esta ferramenta NÃO requer nenhum parâmetro. Use quando o usuário perguntar se o guia já foi enviado ou se o email chegou.
+    """
+    thread_id = (runtime.config or {}).get("configurable", {}).get("thread_id")
+    status = get_outbox().status(thread_id) if thread_id else None
+    if status is None:
+        return "Nenhum envio de guia foi solicitado nesta conversa."
+    if status["status"] == SENT:
+        enviado = datetime.fromtimestamp(status["enviado_em"]).strftime("%d/%m/%Y às %H:%M")
+        return f"✅ O guia foi enviado para {status['email']} em {enviado}."
+    if status["status"] == FAILED:
+        return (f"❌ Não foi possível enviar o guia para {status['email']} ({status['ultimo_erro']}). "
+                "Sugira conferir o email e pedir o envio novamente.")
+    if status["tentativas"]:
+        return (f"⏳ O envio para {status['email']} teve uma falha temporária e será tentado de novo "
+                f"automaticamente ({status['tentativas']} tentativa(s) até agora).")
+    return f"⏳ O guia para {status['email']} está na fila de envio e deve chegar em poucos minutos."
+
 TOOLS_CHAT = [
     retrieve_information,
-    send_pdf
+    send_pdf,
+    email_status
 ]
\ No newline at end of file
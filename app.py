@@ -4,12 +4,17 @@ import dotenv
 from uuid import uuid4
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 from langgraph.types import Command
-from langgraph.checkpoint.memory import InMemorySaver 
-from agent.agent import create_agent_graph 
+from agent.utils.blobs import resolve
+from agent.utils.guide import validate_answers
+from agent.utils.outbox import get_outbox
+from agent.utils.resilience import turn_deadline
+from agent.utils.sessions import get_session_manager
 
 # 1. CARREGAMENTO DE AMBIENTE
 dotenv.load_dotenv()
 REQUIRED_KEYS = ["GOOGLE_API_KEY", "QDRANT_URL", "QDRANT_API_KEY"]
+# Métricas das sessões do processo na barra lateral (?metricas); desligado por padrão
+APP_METRICS = os.getenv("APP_METRICS", "0") == "1"
 
 try:
     for key in REQUIRED_KEYS:
@@ -29,21 +34,44 @@ if missing_keys:
 st.title("🌸 Tide: Seu Guia Digital da Menopausa")
 
 # --- GERENCIAMENTO DE SESSÃO ---
+def historico_do_checkpoint(graph, thread_id):
+    """Reconstrói o histórico visual a partir do estado salvo (conversa retomada em outra réplica)."""
+    snapshot = graph.get_state({"configurable": {"thread_id": thread_id}})
+    historico = []
+    for message in (snapshot.values or {}).get("messages", []):
+        if isinstance(message, HumanMessage):
+            historico.append({"role": "user", "content": str(message.content)})
+        elif isinstance(message, AIMessage) and message.content and not message.tool_calls:
+            content = str(resolve(message.content))
+            content = content.replace("[INICIO_GUIA]", "").replace("[FIM_GUIA]", "").strip()
+            historico.append({"role": "assistant", "content": content})
+    return historico
+
 def iniciar_sessao_usuario():
     if "thread_id" not in st.session_state:
+        # O thread_id nunca vai para a URL (daria acesso à conversa a quem tivesse o link). Ele só
+        # existe na sessão do Streamlit desta réplica: com várias réplicas, o balanceador precisa
+        # de afinidade de sessão (sticky sessions), senão uma reconexão começa uma conversa nova
         st.session_state.thread_id = str(uuid4())
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    if "graph" not in st.session_state:
-        memory = InMemorySaver()
-        st.session_state.graph = create_agent_graph(checkpointer=memory)
+    # Grafo e histórico ficam no gerenciador de sessões: descartados após inatividade ou
+    # acima do orçamento de memória, e reconstruídos do checkpoint na próxima interação
+    sessao = get_session_manager().get(st.session_state.thread_id)
+    if sessao.messages is None:
+        sessao.messages = historico_do_checkpoint(sessao.graph, st.session_state.thread_id)
+    return sessao
+
+sessao = iniciar_sessao_usuario()
+# Workers de envio de email (retomam também os pendentes de execuções anteriores)
+get_outbox()
 
-iniciar_sessao_usuario()
+if APP_METRICS and "metricas" in st.query_params:
+    with st.sidebar:
+        st.json(get_session_manager().metrics())
 
 config = {"configurable": {"thread_id": st.session_state.thread_id}}
 
 # --- HISTÓRICO VISUAL ---
-for message in st.session_state.messages:
+for message in sessao.messages:
     if message.get("role") == "tool_log":
         with st.status(message["content"], state="complete"):
             st.write("Consulta realizada.")
@@ -52,14 +80,24 @@ for message in st.session_state.messages:
             st.markdown(message["content"])
 
 # --- EXECUÇÃO DO GRAFO (RETORNA SUCESSO/ERRO) ---
+def stream_with_deadline(graph, input_data):
+    """Itera o grafo com um prazo por turno, que limita todas as chamadas externas."""
+    with turn_deadline():
+        yield from graph.stream(input_data, config, stream_mode="values")
+
 def run_graph(input_data):
     """Executa o grafo e retorna True se funcionou, False se deu erro."""
+    # A sessão fica em uso durante o turno: a limpeza de sessões não a descarta no meio da execução
+    with get_session_manager().use(st.session_state.thread_id) as sessao_turno:
+        return executar_turno(sessao_turno, input_data)
+
+def executar_turno(sessao, input_data):
     with st.chat_message("assistant"):
         status_container = st.status("Processando...", expanded=True)
         response_text = ""
         
         try:
-            for event in st.session_state.graph.stream(input_data, config, stream_mode="values"):
+            for event in stream_with_deadline(sessao.graph, input_data):
                 if "messages" in event and event["messages"]:
                     last_message = event["messages"][-1]
                     
@@ -69,14 +107,16 @@ def run_graph(input_data):
                                 query = tool_call['args'].get('query', 'consulta')
                                 status_container.write(f"🔍 Pesquisando: *{query}*")
                             elif tool_call["name"] == "send_pdf":
-                                status_container.write("📧 Preparando e enviando e-mail...")
+                                status_container.write("📧 Colocando o e-mail na fila de envio...")
+                            elif tool_call["name"] == "email_status":
+                                status_container.write("📬 Consultando o envio do e-mail...")
 
                     if isinstance(last_message, ToolMessage):
                         status_container.write("✅ Dados recebidos.")
 
                     if isinstance(last_message, AIMessage) and last_message.content:
                         if not last_message.tool_calls:
-                            raw_content = last_message.content
+                            raw_content = resolve(last_message.content)
                             if isinstance(raw_content, list):
                                 # Extrai o texto se for dicionário, ou pega o próprio item se for string
                                 text_parts = [item.get('text', '') if isinstance(item, dict) else item for item in raw_content if isinstance(item, (dict, str))]
@@ -91,8 +131,8 @@ def run_graph(input_data):
             
             if response_text:
                 st.markdown(response_text)
-                if not st.session_state.messages or st.session_state.messages[-1].get("content") != response_text:
-                    st.session_state.messages.append({"role": "assistant", "content": response_text})
+                if not sessao.messages or sessao.messages[-1].get("content") != response_text:
+                    sessao.messages.append({"role": "assistant", "content": response_text})
             
             return True
 
@@ -103,7 +143,7 @@ def run_graph(input_data):
 
 # --- INTERFACE DINÂMICA ---
 try:
-    state_snapshot = st.session_state.graph.get_state(config)
+    state_snapshot = sessao.graph.get_state(config)
     
     if state_snapshot.next:
         current_node = state_snapshot.next[0] if isinstance(state_snapshot.next, tuple) else state_snapshot.next
@@ -169,6 +209,49 @@ try:
                             })):
                                 st.rerun()
 
+        # === FORMULÁRIO ÚNICO (GUIDE_FORM_MODE=unico) ===
+        elif current_node == "questionnaire":
+            pedido = state_snapshot.interrupts[0].value if state_snapshot.interrupts else {}
+            valores = pedido.get("valores", {})
+            for campo, erro in (pedido.get("erros") or {}).items():
+                st.warning(f"⚠️ {campo.replace('_', ' ').capitalize()}: {erro}")
+            with st.chat_message("assistant"):
+                st.write("📝 **Preencha os dados para o seu guia:**")
+                with st.form("form_unico"):
+                    nome = st.text_input("Qual é seu nome?", value=valores.get("nome", ""), key="unico_nome")
+                    idade = st.text_input("Qual é sua idade?", value=str(valores.get("idade", "")), key="unico_idade")
+                    email = st.text_input("Qual é o seu email?", value=valores.get("email", ""), key="unico_email")
+                    c1 = st.text_area("Ciclo Menstrual", value=valores.get("ciclo_menstrual", ""), placeholder="Frequência, fluxo...", key="unico_c1")
+                    c2 = st.text_area("Sintomas Físicos", value=valores.get("sintomas_fisicos", ""), placeholder="Calorões, insônia...", key="unico_c2")
+                    c3 = st.text_area("Saúde Emocional", value=valores.get("saude_emocional", ""), placeholder="Ansiedade, humor...", key="unico_c3")
+                    c4 = st.text_area("Histórico e Hábitos", value=valores.get("habitos_historico", ""), placeholder="Medicamentos, histórico familiar...", key="unico_c4")
+                    c5 = st.text_area("Exames e Tratamentos", value=valores.get("exames_tratamentos", ""), placeholder="Últimos exames...", key="unico_c5")
+                    st.caption("Revise suas respostas antes de enviar: o guia é gerado logo em seguida.")
+
+                    col_env, col_sair = st.columns([1, 1])
+                    with col_env:
+                        submit = st.form_submit_button("Gerar Guia", use_container_width=True)
+                    with col_sair:
+                        cancel = st.form_submit_button("Sair do Guia", type="secondary", use_container_width=True)
+
+                    if cancel:
+                        if run_graph(Command(resume={"exit": True})):
+                            st.rerun()
+
+                    elif submit:
+                        respostas = {
+                            "nome": nome, "idade": str(idade), "email": email,
+                            "ciclo_menstrual": c1, "sintomas_fisicos": c2,
+                            "saude_emocional": c3, "habitos_historico": c4,
+                            "exames_tratamentos": c5
+                        }
+                        # Validação local: respostas inválidas não geram uma nova retomada do grafo
+                        erros = validate_answers(respostas)
+                        if erros:
+                            st.warning("⚠️ Corrija os campos: " + ", ".join(c.replace("_", " ") for c in erros))
+                        elif run_graph(Command(resume=respostas)):
+                            st.rerun()
+
         # === CONFIRMAÇÃO ===
         elif current_node == "ask_confirmation":
              with st.chat_message("assistant"):
@@ -183,7 +266,7 @@ try:
     else:
         # Chat normal
         if prompt := st.chat_input("Tire suas dúvidas sobre menopausa..."):
-            st.session_state.messages.append({"role": "user", "content": prompt})
+            sessao.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"):
                 st.markdown(prompt)
             run_graph({"messages": [HumanMessage(content=prompt)]})
@@ -191,7 +274,7 @@ try:
 except Exception:
     # Primeira execução
     if prompt := st.chat_input("Diga 'Olá' para começar"):
-        st.session_state.messages.append({"role": "user", "content": prompt})
+        sessao.messages.append({"role": "user", "content": prompt})
         with st.chat_message("user"):
             st.markdown(prompt)
         run_graph({"messages": [HumanMessage(content=prompt)]})
\ No newline at end of file
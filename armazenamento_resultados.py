@@ -0,0 +1,144 @@
+"""Armazenamento só de acréscimos dos resultados da avaliação (avaliacao2.py).
+
+Cada execução fica em `<diretório>/<execução>/`:
+    linhas-00000.jsonl   uma linha JSON por pergunta avaliada (classificações, justificativas...)
+    textos-00000.jsonl   as colunas grandes (respostas e contexto), lidas só quando pedidas
+
+Gravar uma pergunta é um acréscimo no fim dos dois arquivos (nada é reescrito). As linhas
+guardam, no lugar de cada texto grande, a referência [arquivo, posição, tamanho] para leitura
+direta. Os shards giram a cada `linhas_por_shard` perguntas. Se uma pergunta for gravada de
+novo, vale o último registro.
+"""
+import os
+import json
+import threading
+from typing import Iterable, Iterator, Optional
+
+# --- Configurações Globais ---
+RESULTADOS_DIR = os.getenv("AVAL_RESULTADOS_DIR", "resultados")
+LINHAS_POR_SHARD = 500
+# Colunas guardadas à parte (as únicas que crescem com o tamanho das respostas)
+COLUNAS_GRANDES = ("resposta_baseline", "resposta_tide", "contexto_usado_pelo_tide")
+CHAVE = "id_pergunta"
+
+
+def _shards(diretorio: str, prefixo: str) -> list:
+    if not os.path.isdir(diretorio):
+        return []
+    return sorted(n for n in os.listdir(diretorio) if n.startswith(prefixo) and n.endswith(".jsonl"))
+
+
+def _ler_jsonl(caminho: str) -> Iterator[dict]:
+    with open(caminho, encoding="utf-8") as f:
+        for linha in f:
+            try:
+                yield json.loads(linha)
+            except json.JSONDecodeError:
+                continue  # linha cortada por uma queda no meio da escrita
+
+
+def _ultimas_linhas(diretorio: str) -> Iterator[dict]:
+    """Linhas de uma execução na ordem de gravação, sem repetir perguntas regravadas."""
+    ultimas = {}
+    for nome in _shards(diretorio, "linhas-"):
+        for linha in _ler_jsonl(os.path.join(diretorio, nome)):
+            ultimas[linha.get(CHAVE)] = linha
+    return iter(ultimas.values())
+
+
+class ResultStore:
+    """Resultados de uma execução da avaliação, gravados incrementalmente."""
+
+    def __init__(self, execucao: str, diretorio: str = RESULTADOS_DIR, linhas_por_shard: int = LINHAS_POR_SHARD):
+        self.execucao = execucao
+        self.diretorio = os.path.join(diretorio, execucao)
+        self.linhas_por_shard = linhas_por_shard
+        os.makedirs(self.diretorio, exist_ok=True)
+        self._lock = threading.Lock()
+        shards = _shards(self.diretorio, "linhas-")
+        self._shard = len(shards) - 1 if shards else 0
+        for tipo in ("linhas", "textos"):
+            self._fechar_linha_cortada(self._caminho(tipo))
+        self._linhas_no_shard = sum(1 for _ in _ler_jsonl(self._caminho("linhas"))) if shards else 0
+
+    @staticmethod
+    def _fechar_linha_cortada(caminho: str):
+        """Uma escrita interrompida deixa o fim sem quebra de linha: o próximo registro começa em linha nova."""
+        try:
+            with open(caminho, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+        except (FileNotFoundError, OSError):
+            pass
+
+    def _caminho(self, tipo: str, shard: Optional[int] = None) -> str:
+        return os.path.join(self.diretorio, f"{tipo}-{self._shard if shard is None else shard:05d}.jsonl")
+
+    @staticmethod
+    def _acrescentar(caminho: str, texto: str) -> int:
+        """Acrescenta no fim do arquivo (com fsync) e retorna a posição em bytes onde o texto começou."""
+        with open(caminho, "ab") as f:
+            posicao = f.tell()
+            f.write(texto.encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        return posicao
+
+    def append(self, resultado: dict):
+        """Grava o resultado de uma pergunta: textos grandes primeiro, depois a linha que aponta para eles."""
+        with self._lock:
+            if self._linhas_no_shard >= self.linhas_por_shard:
+                self._shard += 1
+                self._linhas_no_shard = 0
+            linha = {}
+            caminho_textos = self._caminho("textos")
+            for coluna, valor in resultado.items():
+                if coluna in COLUNAS_GRANDES and valor is not None:
+                    dados = json.dumps(str(valor), ensure_ascii=False) + "\n"
+                    posicao = self._acrescentar(caminho_textos, dados)
+                    linha[coluna] = [os.path.basename(caminho_textos), posicao, len(dados.encode("utf-8"))]
+                else:
+                    linha[coluna] = valor
+            self._acrescentar(self._caminho("linhas"), json.dumps(linha, ensure_ascii=False, default=str) + "\n")
+            self._linhas_no_shard += 1
+
+    def linhas(self, textos: bool = False) -> Iterator[dict]:
+        """Resultados na ordem de gravação (sem repetir perguntas regravadas); textos só se pedidos."""
+        for linha in _ultimas_linhas(self.diretorio):
+            yield self.com_textos(linha) if textos else linha
+
+    def texto(self, referencia) -> Optional[str]:
+        if not referencia:
+            return None
+        nome, posicao, tamanho = referencia
+        with open(os.path.join(self.diretorio, nome), "rb") as f:
+            f.seek(posicao)
+            return json.loads(f.read(tamanho).decode("utf-8"))
+
+    def com_textos(self, linha: dict) -> dict:
+        """Cópia da linha com as referências trocadas pelos textos."""
+        return {c: self.texto(v) if c in COLUNAS_GRANDES else v for c, v in linha.items()}
+
+    def dataframe(self, textos: bool = False):
+        import pandas as pd
+
+        linhas = sorted(self.linhas(textos), key=lambda l: l.get(CHAVE) or 0)
+        return pd.DataFrame.from_records(linhas)
+
+
+def listar_execucoes(diretorio: str = RESULTADOS_DIR) -> list:
+    if not os.path.isdir(diretorio):
+        return []
+    return sorted(n for n in os.listdir(diretorio) if _shards(os.path.join(diretorio, n), "linhas-"))
+
+
+def ler_colunas(colunas: Iterable[str], execucoes: Optional[Iterable[str]] = None,
+                diretorio: str = RESULTADOS_DIR) -> Iterator[dict]:
+    """Só as colunas pedidas (mais a execução) de várias execuções, sem abrir os arquivos de texto."""
+    colunas = list(colunas)
+    for execucao in execucoes or listar_execucoes(diretorio):
+        for linha in _ultimas_linhas(os.path.join(diretorio, execucao)):
+            registro = {c: linha.get(c) for c in colunas}
+            registro["execucao"] = execucao
+            yield registro
@@ -4,28 +4,39 @@ import json
 import time
 import re
 import uuid
+import asyncio
+import argparse
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-from openai import OpenAI, RateLimitError
+from openai import AsyncOpenAI, RateLimitError
 from langchain_cerebras import ChatCerebras
 
 # Imports do projeto Tide (LangGraph)
 from langchain_core.messages import HumanMessage
-from langgraph.checkpoint.memory import InMemorySaver
-from agent.agent import create_agent_graph
+from agent.agent import create_agent_graph, DEGRADED_CHAT_MESSAGE
+from agent.utils.blobs import resolve
+from agent.utils.cache import DiskCache, content_key
+from agent.utils.checkpointer import get_checkpointer
+from agent.utils.gateway import get_gateway
+from agent.utils.guide import model_signature
+from agent.utils.prompt import CHAT_SYSTEM_PROMPT, ROUTER_PROMPT
+from agent.utils.ratelimit import TokenBucket
+from agent.utils.resilience import turn_deadline
+from agent.utils.tools import COLLECTION_NAME, RETRIEVAL_LIMIT, RETRIEVAL_UNAVAILABLE_MSG
+from armazenamento_resultados import ResultStore, RESULTADOS_DIR
 
 # ==========================================
 # 1. CONFIGURAÇÃO DOS CLIENTES DE API
 # ==========================================
 # Cliente Cerebras (Gerador do Baseline)
-client_cerebras = OpenAI(
+client_cerebras = AsyncOpenAI(
     api_key=os.getenv("CEREBRAS_API_KEY"), 
     base_url="https://api.cerebras.ai/v1"
 )
 
 # Cliente Groq (Juiz Avaliador Independente)
-client_groq = OpenAI(
+client_groq = AsyncOpenAI(
     api_key=os.getenv("GROQ_API_KEY"),
     base_url="https://api.groq.com/openai/v1"
 )
@@ -39,19 +50,33 @@ MODELO_JUIZ = "qwen/qwen3-32b"
 # 2. INICIALIZAÇÃO DO AGENTE TIDE
 # ==========================================
 print("A inicializar o Agente Tide...")
-memory = InMemorySaver()
+memory = get_checkpointer()
 agente_tide = create_agent_graph(checkpointer=memory)
 print("Agente Tide pronto e carregado!")
 
 # ==========================================
-# 3. CONTROLO DE RATE LIMITS UNIFICADO
+# 3. CONTROLO DE RATE LIMITS POR PROVEDOR
 # ==========================================
-def chamada_api_segura(cliente, mensagens, modelo, response_format=None, temperature=0):
+# Um balde de fichas por cota: baseline e juiz são modelos diferentes na Groq (cotas separadas)
+# e o Tide usa o gateway do projeto. Valores em chamadas de LLM por minuto.
+AVAL_RPM_BASELINE = float(os.getenv("AVAL_RPM_BASELINE", "30"))
+AVAL_RPM_TIDE = float(os.getenv("AVAL_RPM_TIDE", "30"))
+AVAL_RPM_JUIZ = float(os.getenv("AVAL_RPM_JUIZ", "30"))
+# Perguntas avaliadas ao mesmo tempo (os baldes é que limitam a vazão)
+AVAL_CONCORRENCIA = int(os.getenv("AVAL_CONCORRENCIA", "8"))
+# Chamadas de LLM de um turno do Tide (roteador, chat com a ferramenta e resposta final)
+CHAMADAS_POR_TURNO_TIDE = 3
+
+limite_baseline = TokenBucket.per_minute(AVAL_RPM_BASELINE)
+limite_tide = TokenBucket.per_minute(AVAL_RPM_TIDE, burst=CHAMADAS_POR_TURNO_TIDE)
+limite_juiz = TokenBucket.per_minute(AVAL_RPM_JUIZ)
+
+async def chamada_api_segura(cliente, mensagens, modelo, limitador, response_format=None, temperature=0):
     max_tentativas = 5
     tempo_base = 5 
-    time.sleep(3.0) # Pausa para proteger as cotas da API
     
     for tentativa in range(max_tentativas):
+        await limitador.atake() # Espera a vez dentro da cota do provedor
         try:
             kwargs = {
                 "model": modelo,
@@ -61,37 +86,99 @@ def chamada_api_segura(cliente, mensagens, modelo, response_format=None, tempera
             if response_format:
                 kwargs["response_format"] = response_format
 
-            response = cliente.chat.completions.create(**kwargs)
+            response = await cliente.chat.completions.create(**kwargs)
             return response.choices[0].message.content
             
         except RateLimitError:
             tempo_espera = tempo_base * (2 ** tentativa)
             print(f"\n[⚠️ 429] Rate Limit atingido no modelo '{modelo}'. A aguardar {tempo_espera}s (Tentativa {tentativa+1}/{max_tentativas})...")
-            time.sleep(tempo_espera)
+            await asyncio.sleep(tempo_espera)
         except Exception as e:
             print(f"\n[❌ Erro] Falha na API ('{modelo}'): {e}")
             return None
             
     return None
 
+# ==========================================
+# 3.1 CACHE DE RESULTADOS POR ETAPA
+# ==========================================
+# Cada etapa (baseline, tide, juiz) guarda suas saídas em disco, com chave (etapa, modelo, hash do
+# prompt, entrada): mudar só o prompt do juiz reexecuta só o juiz, e uma resposta nova do baseline
+# ou do Tide invalida sozinha a avaliação dela.
+AVAL_CACHE = os.getenv("AVAL_CACHE", "1") == "1"
+AVAL_CACHE_DIR = os.getenv("AVAL_CACHE_DIR", os.path.join(".cache", "avaliacao"))
+AVAL_CACHE_MAX_MB = float(os.getenv("AVAL_CACHE_MAX_MB", "500"))
+ETAPAS = ("baseline", "tide", "juiz")
+
+caches_etapas = {
+    etapa: DiskCache(os.path.join(AVAL_CACHE_DIR, etapa), int(AVAL_CACHE_MAX_MB * 1024 * 1024))
+    for etapa in ETAPAS
+}
+
+async def memoizado(etapa, modelo, hash_prompt, entrada, gerar, valido=lambda valor: True):
+    """Devolve a saída da etapa guardada em disco ou gera, guardando só resultados válidos."""
+    if not AVAL_CACHE:
+        return await gerar()
+    chave = content_key(etapa, modelo, hash_prompt, entrada)
+    cache = caches_etapas[etapa]
+    guardado = await asyncio.to_thread(cache.get, chave)
+    if guardado is not None:
+        return json.loads(guardado)
+    valor = await gerar()
+    if valido(valor):
+        await asyncio.to_thread(cache.set, chave, json.dumps(valor, ensure_ascii=False))
+    return valor
+
+def estatisticas_cache():
+    return {etapa: cache.stats() for etapa, cache in caches_etapas.items()}
+
+def limpar_cache(etapas=ETAPAS):
+    """Invalida as etapas indicadas (todas por padrão). Retorna quantas entradas apagou por etapa."""
+    return {etapa: caches_etapas[etapa].clear() for etapa in etapas}
+
+# O baseline recebe só a pergunta, sem prompt de sistema
+HASH_PROMPT_BASELINE = content_key("pergunta_pura", "temperature=0")
+# O Tide muda com os prompts do chat e do roteador e com a configuração da busca
+HASH_PROMPT_TIDE = content_key(CHAT_SYSTEM_PROMPT, ROUTER_PROMPT, COLLECTION_NAME, RETRIEVAL_LIMIT)
+
 # ==========================================
 # 4. FUNÇÕES DE GERAÇÃO E EXTRAÇÃO DE CONTEXTO
 # ==========================================
-def obter_resposta_baseline(pergunta):
-    mensagens = [{"role": "user", "content": pergunta}]
-    return chamada_api_segura(client_groq, mensagens, modelo=MODELO_BASELINE, temperature=0)
+async def obter_resposta_baseline(pergunta):
+    async def gerar():
+        mensagens = [{"role": "user", "content": pergunta}]
+        return await chamada_api_segura(client_groq, mensagens, modelo=MODELO_BASELINE, limitador=limite_baseline, temperature=0)
+
+    return await memoizado("baseline", MODELO_BASELINE, HASH_PROMPT_BASELINE, pergunta, gerar,
+                           valido=lambda resposta: resposta is not None)
+
+def resultado_tide_valido(resultado):
+    """Erros e respostas em modo degradado (LLM ou Qdrant fora) não são memoizados: avaliariam a queda, não o agente."""
+    resposta, contexto = resultado
+    return (resposta not in ("Erro interno do agente.", DEGRADED_CHAT_MESSAGE)
+            and RETRIEVAL_UNAVAILABLE_MSG not in (contexto or ""))
+
+async def obter_resposta_agente_tide(pergunta):
+    resposta, contexto = await memoizado(
+        "tide", model_signature(get_gateway()), HASH_PROMPT_TIDE, pergunta,
+        lambda: executar_agente_tide(pergunta),
+        valido=resultado_tide_valido,
+    )
+    return resposta, contexto
 
-def obter_resposta_agente_tide(pergunta):
+async def executar_agente_tide(pergunta):
     thread_id = str(uuid.uuid4()) 
     config = {"configurable": {"thread_id": thread_id}}
     input_data = {"messages": [HumanMessage(content=pergunta)]}
     
     try:
-        resultado = agente_tide.invoke(input_data, config=config)
+        await limite_tide.atake(CHAMADAS_POR_TURNO_TIDE)
+        with turn_deadline():
+            resultado = await agente_tide.ainvoke(input_data, config=config)
         
         # 4.1 Extração da Resposta Final
         ultima_mensagem = resultado["messages"][-1]
-        conteudo = ultima_mensagem.content
+        conteudo = resolve(ultima_mensagem.content)
         
         if isinstance(conteudo, list):
             text_parts = [item['text'] for item in conteudo if isinstance(item, dict) and 'text' in item]
@@ -103,7 +190,7 @@ def obter_resposta_agente_tide(pergunta):
         for msg in resultado["messages"]:
             # Verifica se é a resposta de uma tool (ferramenta)
             if getattr(msg, 'type', '') == 'tool': 
-                documentos.append(str(msg.content))
+                documentos.append(str(resolve(msg.content)))
                 
         contexto_extraido = "\n\n---\n\n".join(documentos)
         
@@ -119,11 +206,8 @@ def obter_resposta_agente_tide(pergunta):
 # ==========================================
 # 5. FUNÇÃO DO JUIZ (Puro LLM-as-a-Judge Adaptativo)
 # ==========================================
-def avaliar_resposta_com_juiz(pergunta, resposta, contexto_recuperado=None, is_baseline=False):
-    
-    if is_baseline:
-        # PROMPT PARA O BASELINE (SEM RAG)
-        prompt_juiz = f"""
+# PROMPT PARA O BASELINE (SEM RAG)
+PROMPT_JUIZ_BASELINE = """
         Você é um auditor médico rigoroso (LLM-as-a-Judge) testando um assistente virtual focado em climatério e menopausa. 
 
         Sua tarefa é auditar a [Resposta Gerada] com base na [Pergunta da Usuária]. Como este é um modelo BASELINE (sem acesso a documentos), NÃO avalie fidelidade a fontes. Avalie APENAS a veracidade factual, escopo e alinhamento médico.
@@ -155,9 +239,9 @@ def avaliar_resposta_com_juiz(pergunta, resposta, contexto_recuperado=None, is_b
             "classificacao": "correta, parcialmente_correta, fora_de_escopo, insegura ou alucinacao"
         }}
         """
-    else:
-        # PROMPT PARA O TIDE (COM RAG)
-        prompt_juiz = f"""
+
+# PROMPT PARA O TIDE (COM RAG)
+PROMPT_JUIZ_TIDE = """
         Você é um auditor médico rigoroso (LLM-as-a-Judge) testando um assistente virtual focado em climatério e menopausa. 
 
         Sua tarefa é auditar a [Resposta Gerada] fazendo o cruzamento estrito com o [Contexto Recuperado] e a [Pergunta da Usuária].
@@ -193,17 +277,13 @@ def avaliar_resposta_com_juiz(pergunta, resposta, contexto_recuperado=None, is_b
             "classificacao": "correta, parcialmente_correta, fora_de_escopo, insegura ou alucinacao"
         }}
         """
-        
-    mensagens = [{"role": "user", "content": prompt_juiz}]
-    
-    resultado_texto = chamada_api_segura(
-        client_groq, 
-        mensagens, 
-        modelo=MODELO_JUIZ, 
-        response_format={"type": "json_object"}, 
-        temperature=0.0 # Zero para garantir objetividade total
-    )
-    
+
+CATEGORIAS_JUIZ = ("correta", "parcialmente_correta", "fora_de_escopo", "insegura", "alucinacao")
+
+# Requisições e tamanho dos prompts enviados ao juiz (para comparar o modo individual com o em lote)
+estatisticas_juiz = {"requisicoes": 0, "caracteres_prompt": 0, "itens_em_lote": 0, "reavaliados_individualmente": 0}
+
+def extrair_json(resultado_texto):
     if resultado_texto:
         try:
             return json.loads(resultado_texto)
@@ -214,86 +294,326 @@ def avaliar_resposta_com_juiz(pergunta, resposta, contexto_recuperado=None, is_b
                     return json.loads(match.group(0))
                 except json.JSONDecodeError:
                     pass
-            
+    return None
+
+async def chamar_modelo_juiz(prompt_juiz):
+    estatisticas_juiz["requisicoes"] += 1
+    estatisticas_juiz["caracteres_prompt"] += len(prompt_juiz)
+    mensagens = [{"role": "user", "content": prompt_juiz}]
+    
+    resultado_texto = await chamada_api_segura(
+        client_groq, 
+        mensagens, 
+        modelo=MODELO_JUIZ, 
+        limitador=limite_juiz,
+        response_format={"type": "json_object"}, 
+        temperature=0.0 # Zero para garantir objetividade total
+    )
+    return extrair_json(resultado_texto)
+
+async def chamar_juiz(prompt_juiz):
+    avaliacao = await chamar_modelo_juiz(prompt_juiz)
+    if isinstance(avaliacao, dict):
+        return avaliacao
     return {"classificacao": "erro", "analise_passo_a_passo": "Falha na extração do JSON."}
 
+async def avaliar_individual(pergunta, resposta, contexto_recuperado=None, is_baseline=False):
+    """Uma requisição ao juiz por resposta (o modo original)."""
+    if is_baseline:
+        prompt_juiz = PROMPT_JUIZ_BASELINE.format(pergunta=pergunta, resposta=resposta)
+    else:
+        prompt_juiz = PROMPT_JUIZ_TIDE.format(pergunta=pergunta, resposta=resposta, contexto_recuperado=contexto_recuperado)
+    template = PROMPT_JUIZ_BASELINE if is_baseline else PROMPT_JUIZ_TIDE
+    
+    # O prompt preenchido já contém a pergunta, a resposta e o contexto avaliados
+    return await memoizado("juiz", MODELO_JUIZ, content_key(template), prompt_juiz,
+                           lambda: chamar_juiz(prompt_juiz),
+                           valido=lambda avaliacao: avaliacao.get("classificacao") != "erro")
+
+# ==========================================
+# 5.1 JUIZ EM LOTE
+# ==========================================
+# Respostas avaliadas por requisição (1 = modo individual). Os critérios vão uma vez por lote.
+AVAL_JUIZ_LOTE = int(os.getenv("AVAL_JUIZ_LOTE", "5"))
+# Quanto um lote incompleto espera por mais respostas antes de ser enviado
+AVAL_JUIZ_ESPERA_S = float(os.getenv("AVAL_JUIZ_ESPERA_S", "2"))
+
+def _prompt_de_lote(template, inicio_do_item):
+    """Monta o prompt em lote com os mesmos critérios e categorias do prompt individual."""
+    criterios = template[:template.index(inicio_do_item)]
+    categorias = template[template.index("Classifique a resposta"):template.index("ATENÇÃO:")]
+    return (
+        criterios
+        + "Você receberá VÁRIOS itens numerados. Avalie CADA item de forma independente, com os critérios acima.\n\n"
+        + "        {itens}\n\n        "
+        + categorias.replace("Classifique a resposta", "Classifique CADA resposta", 1)
+        + """ATENÇÃO: Retorne APENAS um objeto JSON válido, sem markdown, com UMA avaliação por item (use o número do item em "id").
+        Formato EXATO esperado:
+        {{
+            "avaliacoes": [
+                {{
+                    "id": 1,
+                    "analise_passo_a_passo": "Explique o raciocínio deste item.",
+                    "classificacao": "correta, parcialmente_correta, fora_de_escopo, insegura ou alucinacao"
+                }}
+            ]
+        }}
+        """
+    )
+
+PROMPT_JUIZ_LOTE_BASELINE = _prompt_de_lote(PROMPT_JUIZ_BASELINE, "[Pergunta da Usuária]")
+PROMPT_JUIZ_LOTE_TIDE = _prompt_de_lote(PROMPT_JUIZ_TIDE, "[Contexto Recuperado da Base de Dados]")
+
+def _texto_do_item(numero, item, is_baseline):
+    partes = [f"### ITEM {numero}"]
+    if not is_baseline:
+        partes.append(f"[Contexto Recuperado da Base de Dados]:\n{item['contexto_recuperado']}")
+    partes.append(f"[Pergunta da Usuária]:\n{item['pergunta']}")
+    partes.append(f"[Resposta Gerada pelo Sistema]:\n{item['resposta']}")
+    return "\n\n".join(partes)
+
+def validar_lote(resposta, quantidade):
+    """Avaliações válidas do lote por número do item (itens ausentes ou inválidos ficam de fora)."""
+    if not isinstance(resposta, dict) or not isinstance(resposta.get("avaliacoes"), list):
+        return {}
+    validas = {}
+    for avaliacao in resposta["avaliacoes"]:
+        if not isinstance(avaliacao, dict):
+            continue
+        try:
+            numero = int(avaliacao.get("id"))
+        except (TypeError, ValueError):
+            continue
+        classificacao = str(avaliacao.get("classificacao", "")).strip().lower()
+        if 1 <= numero <= quantidade and numero not in validas and classificacao in CATEGORIAS_JUIZ:
+            validas[numero] = {
+                "classificacao": classificacao,
+                "analise_passo_a_passo": str(avaliacao.get("analise_passo_a_passo", "")),
+            }
+    return validas
+
+async def avaliar_lote_com_juiz(itens, is_baseline):
+    """Avalia vários itens em uma requisição; os que vierem inválidos são reavaliados um a um."""
+    template = PROMPT_JUIZ_LOTE_BASELINE if is_baseline else PROMPT_JUIZ_LOTE_TIDE
+    blocos = "\n\n".join(_texto_do_item(n, item, is_baseline) for n, item in enumerate(itens, 1))
+    estatisticas_juiz["itens_em_lote"] += len(itens)
+    validas = validar_lote(await chamar_modelo_juiz(template.format(itens=blocos)), len(itens))
+    
+    faltando = [n for n in range(1, len(itens) + 1) if n not in validas]
+    if faltando:
+        print(f"   [⚠️ Juiz em lote] {len(faltando)}/{len(itens)} item(ns) sem avaliação válida; reavaliando individualmente.")
+        estatisticas_juiz["reavaliados_individualmente"] += len(faltando)
+        individuais = await asyncio.gather(*(avaliar_individual(is_baseline=is_baseline, **itens[n - 1]) for n in faltando))
+        validas.update(zip(faltando, individuais))
+    return [validas[n] for n in range(1, len(itens) + 1)]
+
+class JuizEmLote:
+    """Junta as avaliações pedidas por perguntas concorrentes e envia ao juiz em lotes.
+
+    Um lote sai quando atinge `tamanho` itens ou quando o primeiro item espera `espera_s`.
+    Baseline e Tide usam critérios diferentes, então cada um tem sua própria fila.
+    """
+
+    def __init__(self, tamanho=AVAL_JUIZ_LOTE, espera_s=AVAL_JUIZ_ESPERA_S):
+        self.tamanho = tamanho
+        self.espera_s = espera_s
+        self.loop = asyncio.get_running_loop()
+        self._filas = {True: [], False: []}
+        self._timers = {}
+        self._tarefas = set()
+
+    async def avaliar(self, is_baseline, **item):
+        futuro = self.loop.create_future()
+        fila = self._filas[is_baseline]
+        fila.append((item, futuro))
+        if len(fila) >= self.tamanho:
+            self._disparar(is_baseline)
+        elif is_baseline not in self._timers:
+            self._timers[is_baseline] = self.loop.call_later(self.espera_s, self._disparar, is_baseline)
+        return await futuro
+
+    def _disparar(self, is_baseline):
+        timer = self._timers.pop(is_baseline, None)
+        if timer is not None:
+            timer.cancel()
+        lote, self._filas[is_baseline] = self._filas[is_baseline], []
+        if lote:
+            tarefa = self.loop.create_task(self._enviar(lote, is_baseline))
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+
+    async def _enviar(self, lote, is_baseline):
+        try:
+            avaliacoes = await avaliar_lote_com_juiz([item for item, _ in lote], is_baseline)
+        except Exception as e:
+            avaliacoes = [{"classificacao": "erro", "analise_passo_a_passo": f"Falha no juiz em lote: {e}"}] * len(lote)
+        for (_, futuro), avaliacao in zip(lote, avaliacoes):
+            if not futuro.done():
+                futuro.set_result(avaliacao)
+
+_juiz_em_lote = None
+
+def obter_juiz_em_lote():
+    """Juiz em lote do event loop atual (cada asyncio.run tem o seu)."""
+    global _juiz_em_lote
+    if _juiz_em_lote is None or _juiz_em_lote.loop is not asyncio.get_running_loop():
+        _juiz_em_lote = JuizEmLote()
+    return _juiz_em_lote
+
+async def avaliar_resposta_com_juiz(pergunta, resposta, contexto_recuperado=None, is_baseline=False):
+    if AVAL_JUIZ_LOTE <= 1:
+        return await avaliar_individual(pergunta, resposta, contexto_recuperado, is_baseline)
+    
+    template = PROMPT_JUIZ_LOTE_BASELINE if is_baseline else PROMPT_JUIZ_LOTE_TIDE
+    item = {"pergunta": pergunta, "resposta": resposta, "contexto_recuperado": contexto_recuperado}
+    return await memoizado("juiz", MODELO_JUIZ, content_key(template), json.dumps(item, ensure_ascii=False),
+                           lambda: obter_juiz_em_lote().avaliar(is_baseline, **item),
+                           valido=lambda avaliacao: avaliacao.get("classificacao") != "erro")
+
+async def verificar_concordancia(linhas):
+    """Avalia as mesmas respostas no modo em lote e no individual e compara as classificações."""
+    itens = []
+    for linha in linhas:
+        itens.append((True, {"pergunta": linha["pergunta"], "resposta": linha["resposta_baseline"], "contexto_recuperado": None}))
+        itens.append((False, {"pergunta": linha["pergunta"], "resposta": linha["resposta_tide"],
+                              "contexto_recuperado": linha["contexto_usado_pelo_tide"]}))
+    
+    estatisticas_juiz.update(requisicoes=0, caracteres_prompt=0)
+    individuais = await asyncio.gather(*(avaliar_individual(is_baseline=b, **item) for b, item in itens))
+    custo_individual = dict(estatisticas_juiz)
+    
+    estatisticas_juiz.update(requisicoes=0, caracteres_prompt=0)
+    em_lote = await asyncio.gather(*(obter_juiz_em_lote().avaliar(b, **item) for b, item in itens))
+    custo_lote = dict(estatisticas_juiz)
+    
+    divergencias = [
+        {"pergunta": item["pergunta"], "tipo": "baseline" if b else "tide",
+         "individual": ind["classificacao"], "lote": lot["classificacao"]}
+        for (b, item), ind, lot in zip(itens, individuais, em_lote)
+        if ind.get("classificacao") != lot.get("classificacao")
+    ]
+    return {
+        "itens": len(itens),
+        "concordancia": 1 - len(divergencias) / len(itens) if itens else 1.0,
+        "requisicoes": {"individual": custo_individual["requisicoes"], "lote": custo_lote["requisicoes"]},
+        "caracteres_prompt": {"individual": custo_individual["caracteres_prompt"], "lote": custo_lote["caracteres_prompt"]},
+        "divergencias": divergencias,
+    }
+
 
 # ==========================================
 # 8. EXECUÇÃO DO EXPERIMENTO
 # ==========================================
-def executar_experimento(perguntas_lista):
-    resultados = []
-    total = len(perguntas_lista)
-    nome_ficheiro = "resultados_avaliacao.csv"
+# Nome da execução: rodar de novo com o mesmo nome retoma; um nome novo começa outra execução
+AVAL_EXECUCAO = os.getenv("AVAL_EXECUCAO", "principal")
+
+def carregar_concluidas(store):
+    """Resultados já guardados (de uma execução interrompida), por id da pergunta, sem os textos grandes."""
+    return {int(linha["id_pergunta"]): linha for linha in store.linhas()}
+
+async def avaliar_pergunta(id_pergunta, pergunta, total):
+    print(f"\n[{id_pergunta}/{total}] A processar Pergunta: {pergunta}")
     
-    print(f"\nA iniciar avaliação LLM-as-a-Judge para {total} perguntas...\n")
+    # 1. Obter Respostas (Baseline e Tide em paralelo)
+    resp_baseline, (resp_tide, contexto_tide) = await asyncio.gather(
+        obter_resposta_baseline(pergunta),
+        obter_resposta_agente_tide(pergunta),
+    )
     
-    for i, pergunta in enumerate(perguntas_lista):
-        print(f"\n[{i+1}/{total}] A processar Pergunta: {pergunta}")
-        print("-" * 50)
-        
-        # 1. Obter Respostas
-        print("   🤖 A gerar resposta do Baseline (Puro)...")
-        resp_baseline = obter_resposta_baseline(pergunta)
-        
-        print("   🌸 A gerar resposta do Tide (RAG)...")
-        resp_tide, contexto_tide = obter_resposta_agente_tide(pergunta)
-        
-        # 2. Avaliação Direta com o Juiz (Groq)
-        print("   ⚖️ A avaliar respostas com o Juiz Especialista...")
-        
-        # O baseline não possui contexto, então usamos is_baseline=True
-        aval_baseline = avaliar_resposta_com_juiz(
-            pergunta=pergunta, 
-            resposta=resp_baseline, 
-            contexto_recuperado=None,
-            is_baseline=True
-        )
+    # 2. Avaliação Direta com o Juiz (Groq), as duas ao mesmo tempo
+    # O baseline não possui contexto, então usamos is_baseline=True
+    aval_baseline, aval_tide = await asyncio.gather(
+        avaliar_resposta_com_juiz(pergunta=pergunta, resposta=resp_baseline, contexto_recuperado=None, is_baseline=True),
+        avaliar_resposta_com_juiz(pergunta=pergunta, resposta=resp_tide, contexto_recuperado=contexto_tide, is_baseline=False),
+    )
+    
+    # Feedback visual no terminal
+    print(f"   [{id_pergunta}] => Baseline: {aval_baseline.get('classificacao', 'erro').upper()} | "
+          f"Tide: {aval_tide.get('classificacao', 'erro').upper()}")
+
+    return {
+        "id_pergunta": id_pergunta,
+        "pergunta": pergunta,
         
-        # O Tide é avaliado com o contexto e com RAG ativo (is_baseline=False por padrão)
-        aval_tide = avaliar_resposta_com_juiz(
-            pergunta=pergunta, 
-            resposta=resp_tide, 
-            contexto_recuperado=contexto_tide,
-            is_baseline=False
-        )
+        "resposta_baseline": resp_baseline,
+        "baseline_classificacao": aval_baseline.get("classificacao", "erro").lower(),
+        "baseline_justificativa": aval_baseline.get("analise_passo_a_passo", ""),
         
-        # Feedback visual no terminal
-        print(f"   => Avaliação Baseline: {aval_baseline.get('classificacao', 'erro').upper()}")
-        print(f"   => Motivo: {aval_baseline.get('analise_passo_a_passo', 'Sem motivo')[:120]}...\n")
+        "resposta_tide": resp_tide,
+        "contexto_usado_pelo_tide": contexto_tide,
+        "tide_classificacao": aval_tide.get("classificacao", "erro").lower(),
+        "tide_justificativa": aval_tide.get("analise_passo_a_passo", "")
+    }
+
+async def executar_experimento(perguntas_lista, execucao=AVAL_EXECUCAO, concorrencia=AVAL_CONCORRENCIA,
+                               diretorio=RESULTADOS_DIR):
+    total = len(perguntas_lista)
+    store = ResultStore(execucao, diretorio)
+    
+    # Retoma uma execução interrompida: perguntas já avaliadas (mesmo id e mesmo texto) não são refeitas
+    concluidas = carregar_concluidas(store)
+    resultados = {i for i, r in concluidas.items() if i <= total and r["pergunta"] == perguntas_lista[i - 1]}
+    pendentes = [(i + 1, p) for i, p in enumerate(perguntas_lista) if i + 1 not in resultados]
+    
+    print(f"\nA iniciar avaliação LLM-as-a-Judge para {total} perguntas "
+          f"({len(resultados)} já concluídas, {len(pendentes)} pendentes, {concorrencia} em paralelo)...\n")
+    
+    vagas = asyncio.Semaphore(concorrencia)
+    inicio = time.perf_counter()
+
+    async def processar(id_pergunta, pergunta):
+        async with vagas:
+            resultado = await avaliar_pergunta(id_pergunta, pergunta, total)
         
-        print(f"   => Avaliação Tide: {aval_tide.get('classificacao', 'erro').upper()}")
-        print(f"   => Motivo: {aval_tide.get('analise_passo_a_passo', 'Sem motivo')[:120]}...\n")
+        # 3. SALVAR INCREMENTALMENTE (só acrescenta esta pergunta; nada é reescrito)
+        await asyncio.to_thread(store.append, resultado)
+        resultados.add(id_pergunta)
+        print(f"   💾 [{id_pergunta}] Progresso guardado ({len(resultados)}/{total}) em '{store.diretorio}'")
 
-        # 3. Guardar os Resultados
-        resultados.append({
-            "id_pergunta": i + 1,
-            "pergunta": pergunta,
-            
-            "resposta_baseline": resp_baseline,
-            "baseline_classificacao": aval_baseline.get("classificacao", "erro").lower(),
-            "baseline_justificativa": aval_baseline.get("analise_passo_a_passo", ""),
-            
-            "resposta_tide": resp_tide,
-            "contexto_usado_pelo_tide": contexto_tide,
-            "tide_classificacao": aval_tide.get("classificacao", "erro").lower(),
-            "tide_justificativa": aval_tide.get("analise_passo_a_passo", "")
-        })
-
-        # 4. SALVAR INCREMENTALMENTE NO CSV
-        df_parcial = pd.DataFrame(resultados)
-        df_parcial.to_csv(nome_ficheiro, index=False, encoding='utf-8')
-        print(f"   💾 Progresso guardado com sucesso em '{nome_ficheiro}'!")
-
-        if i + 1 < total: # Se não for a última pergunta
-            print("   ⏳ A aguardar 10 segundos para renovar a cota de Tokens da Groq...")
-            time.sleep(10)
-
-    print(f"\n✅ Experimento 100% concluído! Base de dados final guardada em '{nome_ficheiro}'.")
+    await asyncio.gather(*(processar(i, p) for i, p in pendentes))
+
+    duracao = time.perf_counter() - inicio
+    print(f"\n✅ Experimento 100% concluído em {duracao:.0f}s! Resultados guardados em '{store.diretorio}'.")
+    print(f"   Espera nas cotas: baseline {limite_baseline.stats()['espera_total_s']}s, "
+          f"Tide {limite_tide.stats()['espera_total_s']}s, juiz {limite_juiz.stats()['espera_total_s']}s")
+    print(f"   Juiz: {estatisticas_juiz['requisicoes']} requisições, ~{estatisticas_juiz['caracteres_prompt'] // 4} tokens de prompt "
+          f"(lote de {AVAL_JUIZ_LOTE}; {estatisticas_juiz['reavaliados_individualmente']} item(ns) reavaliados individualmente)")
+    if AVAL_CACHE:
+        print("   Cache por etapa: " + ", ".join(
+            f"{etapa} {s['acertos']} acertos/{s['faltas']} faltas" for etapa, s in estatisticas_cache().items()))
     
-    return df_parcial
+    return store.dataframe(textos=True)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Avaliação LLM-as-a-Judge: baseline x Tide")
+    parser.add_argument("--cache-stats", action="store_true", help="Mostra o cache de cada etapa e sai")
+    parser.add_argument("--limpar-cache", nargs="*", choices=ETAPAS, metavar="ETAPA",
+                        help="Invalida o cache das etapas indicadas (baseline, tide, juiz; nenhuma = todas) e sai")
+    parser.add_argument("--concordancia", type=int, metavar="N",
+                        help="Reavalia as N primeiras perguntas já respondidas nos modos individual e em lote e compara")
+    parser.add_argument("--execucao", default=AVAL_EXECUCAO, help="Nome da execução (o mesmo nome retoma)")
+    args = parser.parse_args()
+
+    if args.concordancia:
+        AVAL_CACHE = False  # as duas avaliações precisam ir de fato ao juiz
+        store = ResultStore(args.execucao)
+        concluidas = carregar_concluidas(store)
+        linhas = [store.com_textos(concluidas[i]) for i in sorted(concluidas)[:args.concordancia]]
+        relatorio = asyncio.run(verificar_concordancia(linhas))
+        print(f"\n⚖️ Concordância lote x individual: {relatorio['concordancia']:.1%} em {relatorio['itens']} avaliações")
+        print(f"   Requisições: {relatorio['requisicoes']} | caracteres de prompt: {relatorio['caracteres_prompt']}")
+        for d in relatorio["divergencias"]:
+            print(f"   ≠ [{d['tipo']}] {d['pergunta'][:60]}: individual={d['individual']} lote={d['lote']}")
+        raise SystemExit(0)
+
+    if args.limpar_cache is not None:
+        print(f"🗑️ Entradas apagadas: {limpar_cache(args.limpar_cache or ETAPAS)}")
+        raise SystemExit(0)
+    if args.cache_stats:
+        for etapa, stats in estatisticas_cache().items():
+            print(f"   {etapa:<9} {stats['entradas']} entradas, {stats['bytes'] / 1e6:.1f} MB")
+        raise SystemExit(0)
+
     perguntas_teste = [
 "A reposição hormonal realmente protege contra osteoporose?",
 "A reposição hormonal pode ajudar com insônia?",
@@ -301,4 +621,4 @@ if __name__ == "__main__":
 "A menopausa pode causar palpitações?"
 
 ]
-    df = executar_experimento(perguntas_teste)
\ No newline at end of file
+    df = asyncio.run(executar_experimento(perguntas_teste, execucao=args.execucao))
\ No newline at end of file
@@ -0,0 +1,125 @@
+"""Vazão de turnos de chat concorrentes: grafo síncrono em threads x grafo assíncrono no event loop.
+
+Cada conversa faz um turno (roteador + chat) contra o servidor fake de LLM com latência fixa.
+No modo síncrono cada conversa ocupa uma thread (como o invoke() em um pool); no assíncrono
+todas são corrotinas do mesmo event loop (como o servidor do langgraph.json com astream()).
+O limite de admissão é elevado para medir o modelo de execução, não a fila, e o servidor fake
+roda em outro processo para não disputar CPU nem entrar na contagem de threads.
+
+Uso:
+    python -m benchmarks.bench_async_throughput --sessions 50 100 200 --latency 0.5
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# A admissão lê os limites na importação: precisa vir antes dos módulos do agente
+os.environ.setdefault("ADMISSION_INITIAL_LIMIT", "1000")
+os.environ.setdefault("ADMISSION_MAX_LIMIT", "1000")
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+
+from benchmarks.common import summarize
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from agent.agent import create_agent_graph
+from agent.utils.gateway import LLMGateway, openai_compatible_provider
+
+
+class ThreadSampler:
+    """Amostra o número de threads vivas do processo durante a execução."""
+
+    def __init__(self, interval_s=0.02):
+        self.interval_s = interval_s
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def serve_llm(latency, conn):
+    """Servidor fake em outro processo: as threads e a CPU dele não entram na medição."""
+    with FakeOpenAIServer(latency=latency) as server:
+        conn.send(server.base_url)
+        conn.recv()
+
+
+def open_sessions(graph, sessions):
+    """Primeira mensagem de cada conversa (boas-vindas, sem LLM) para o turno medido ir ao roteador."""
+    configs = []
+    for _ in range(sessions):
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        graph.invoke({"messages": [HumanMessage(content="Olá")]}, config)
+        configs.append(config)
+    return configs
+
+
+def turn_input(i):
+    return {"messages": [HumanMessage(content=f"Pergunta {i} sobre ondas de calor?")]}
+
+
+def run_sync(graph, configs):
+    def turn(i, config):
+        start = time.perf_counter()
+        graph.invoke(turn_input(i), config)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=len(configs)) as pool:
+        return list(pool.map(turn, range(len(configs)), configs))
+
+
+def run_async(graph, configs):
+    async def turn(i, config):
+        start = time.perf_counter()
+        await graph.ainvoke(turn_input(i), config)
+        return time.perf_counter() - start
+
+    async def main():
+        return await asyncio.gather(*(turn(i, c) for i, c in enumerate(configs)))
+
+    return asyncio.run(main())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vazão de turnos concorrentes: síncrono x assíncrono")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--latency", type=float, default=0.5, help="latência de cada chamada ao LLM fake (s)")
+    args = parser.parse_args()
+
+    parent, child = mp.get_context("spawn").Pipe()
+    server = mp.get_context("spawn").Process(target=serve_llm, args=(args.latency, child), daemon=True)
+    server.start()
+    llm = LLMGateway([openai_compatible_provider("fake", parent.recv(), "fake-model")])
+    graph = create_agent_graph(checkpointer=InMemorySaver(), llm=llm)
+
+    print(f"🔹 Turnos de chat (2 chamadas ao LLM de {args.latency:.2f}s cada)\n")
+    print(f"{'modo':<7} {'sessões':>8} {'parede (s)':>11} {'turnos/s':>9} {'p50 (s)':>8} "
+          f"{'p95 (s)':>8} {'threads (pico)':>15}")
+    for sessions in args.sessions:
+        for name, runner in (("sync", run_sync), ("async", run_async)):
+            configs = open_sessions(graph, sessions)
+            with ThreadSampler() as sampler:
+                start = time.perf_counter()
+                timings = runner(graph, configs)
+                wall = time.perf_counter() - start
+            t = summarize(timings)
+            print(f"{name:<7} {sessions:>8} {wall:>11.2f} {sessions / wall:>9.1f} {t['p50']:>8.2f} "
+                  f"{t['p95']:>8.2f} {sampler.peak:>15}")
+    parent.send(None)
+    server.join(timeout=10)
@@ -0,0 +1,115 @@
+"""Tamanho do checkpoint e latência de escrita por turno, com e sem o blob store.
+
+Simula uma conversa longa com o mesmo formato de mensagens do chat (pergunta, chamada da
+ferramenta, documentos recuperados de ~5 KB, resposta) e um guia gerado no início, gravando
+no checkpointer SQLite. Sem o blob store o checkpoint cresce com todo o texto acumulado;
+com ele, cresce só com as referências.
+
+Uso:
+    python -m benchmarks.bench_checkpoint_growth --turns 40 --every 10
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.graph import StateGraph, START, END
+
+from benchmarks.bench_guide_modes import FULL_GUIDE_CHARS
+from benchmarks.common import summarize
+from agent.utils.blobs import BlobStore
+from agent.utils.checkpointer import PrunedSqliteSaver
+from agent.utils.state import StateSchema
+
+DOCS_CHARS = 5000
+_WORDS = ("menopausa climatério estrogênio sono calor suor humor ansiedade osso cálcio exercício "
+          "terapia hormonal médico consulta sintoma ciclo fluxo mamografia densitometria libido").split()
+
+
+def sample_text(chars: int) -> str:
+    """Texto pseudoaleatório (não se comprime como uma frase repetida)."""
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(random.choice(_WORDS) + str(random.randint(0, 999)))
+    return " ".join(words)[:chars]
+
+
+class TimedSaver(PrunedSqliteSaver):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_times = []
+
+    def put(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().put(*args, **kwargs)
+        finally:
+            self.put_times.append(time.perf_counter() - start)
+
+
+def build_graph(saver, store):
+    keep = (lambda text: text) if store is None else store.offload
+
+    def turn(state: StateSchema) -> StateSchema:
+        n = len(state["messages"])
+        call_id = f"call_{uuid.uuid4().hex[:8]}"
+        docs = f"📄 DOCUMENTO (turno {n}):\n{sample_text(DOCS_CHARS)}"
+        return {"messages": [
+            AIMessage(content="", tool_calls=[{"name": "retrieve_information", "args": {"query": f"q{n}"}, "id": call_id}]),
+            ToolMessage(content=keep(docs), tool_call_id=call_id),
+            AIMessage(content=f"Resposta do turno {n} com citações 【1】."),
+        ]}
+
+    graph = StateGraph(state_schema=StateSchema)
+    graph.add_node("turn", turn)
+    graph.add_edge(START, "turn")
+    graph.add_edge("turn", END)
+    return graph.compile(checkpointer=saver)
+
+
+def latest_checkpoint_bytes(saver, thread_id):
+    with saver.cursor(transaction=False) as cur:
+        row = cur.execute(
+            "SELECT length(checkpoint) FROM checkpoints WHERE thread_id = ? ORDER BY checkpoint_id DESC LIMIT 1",
+            (thread_id,),
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def run(name, saver, store, turns, every):
+    graph = build_graph(saver, store)
+    thread_id = str(uuid.uuid4())
+    config = {"configurable": {"thread_id": thread_id}}
+    guide = sample_text(FULL_GUIDE_CHARS)
+    keep = (lambda text: text) if store is None else store.offload
+    graph.update_state(config, {
+        "messages": [AIMessage(content=keep(f"[INICIO_GUIA]\n{guide}\n[FIM_GUIA]"))],
+        "user_data": {"nome": "Maria", "guide": keep(guide)},
+    })
+
+    print(f"\n== {name}")
+    print(f"{'turno':>6} {'checkpoint (bytes)':>19} {'put p50 (ms)':>13} {'put p95 (ms)':>13}")
+    for i in range(1, turns + 1):
+        saver.put_times.clear()
+        graph.invoke({"messages": [HumanMessage(content=f"Pergunta {i} sobre ondas de calor?")]}, config)
+        if i % every == 0 or i == 1:
+            t = summarize(saver.put_times)
+            print(f"{i:>6} {latest_checkpoint_bytes(saver, thread_id):>19} {t['p50'] * 1000:>13.2f} {t['p95'] * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crescimento do checkpoint por turno (com/sem blob store)")
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--every", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, store in (("Sem blob store", None), ("Com blob store", BlobStore(os.path.join(tmp, "blobs")))):
+            saver = TimedSaver.from_path(os.path.join(tmp, f"{uuid.uuid4().hex}.sqlite"))
+            run(name, saver, store, args.turns, args.every)
+            if store is not None:
+                print(f"   blobs: {store.stats()}")
+            saver.conn.close()
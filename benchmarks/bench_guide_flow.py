@@ -0,0 +1,119 @@
+"""Mede o fluxo completo do guia nos modos de formulário "etapas" (3 interrupções) e "unico".
+
+Conta as retomadas do grafo, as escritas de checkpoint e as leituras de estado que o app faz
+(um `get_state` por rerun do Streamlit), além do tempo de ponta a ponta sem o tempo da usuária.
+
+Uso:
+    python -m benchmarks.bench_guide_flow --runs 5 --ttft 0.3 --tokens-per-s 250
+"""
+import argparse
+import time
+import uuid
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+
+from benchmarks.common import load_caso, summarize
+from benchmarks.bench_guide_modes import fake_reply
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from agent.agent import create_agent_graph
+from agent.utils import guide
+from agent.utils.gateway import LLMGateway, openai_compatible_provider
+from agent.utils.guide import PERSONAL_FIELDS, HEALTH_FIELDS
+
+
+class CountingSaver(InMemorySaver):
+    """InMemorySaver que conta as escritas de checkpoint e de writes pendentes."""
+
+    def __init__(self):
+        super().__init__()
+        self.puts = 0
+        self.put_writes_calls = 0
+
+    def put(self, *args, **kwargs):
+        self.puts += 1
+        return super().put(*args, **kwargs)
+
+    def put_writes(self, *args, **kwargs):
+        self.put_writes_calls += 1
+        return super().put_writes(*args, **kwargs)
+
+
+class FlowDriver:
+    """Reproduz o que o app faz: cada retomada é seguida de um rerun com `get_state`."""
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+        self.resumes = 0
+        self.state_reads = 0
+
+    def step(self, payload):
+        self.graph.invoke(payload, self.config)
+        self.resumes += 1
+        self.state_reads += 1
+        return self.graph.get_state(self.config).next
+
+
+def flow_etapas(driver, caso, corrections):
+    driver.step({"messages": [HumanMessage(content="Quero gerar um guia para a minha consulta")]})
+    for attempt in range(corrections + 1):
+        driver.step(Command(resume={k: caso[k] for k in PERSONAL_FIELDS}))
+        driver.step(Command(resume={k: caso[k] for k in HEALTH_FIELDS}))
+        driver.step(Command(resume={"confirmation": attempt == corrections}))
+
+
+def flow_unico(driver, caso, corrections):
+    # Correções acontecem no próprio formulário, sem ida ao grafo
+    driver.step({"messages": [HumanMessage(content="Quero gerar um guia para a minha consulta")]})
+    driver.step(Command(resume={k: str(caso[k]) for k in PERSONAL_FIELDS + HEALTH_FIELDS}))
+
+
+def run(mode, llm, caso, runs, corrections):
+    durations, resumes, puts, writes, reads = [], [], [], [], []
+    for _ in range(runs):
+        saver = CountingSaver()
+        graph = create_agent_graph(checkpointer=saver, llm=llm, form_mode=mode)
+        driver = FlowDriver(graph)
+        driver.graph.invoke({"messages": [HumanMessage(content="Olá")]}, driver.config)  # boas-vindas
+        saver.puts = saver.put_writes_calls = 0
+
+        start = time.perf_counter()
+        (flow_unico if mode == "unico" else flow_etapas)(driver, caso, corrections)
+        durations.append(time.perf_counter() - start)
+        resumes.append(driver.resumes)
+        puts.append(saver.puts)
+        writes.append(saver.put_writes_calls)
+        reads.append(driver.state_reads)
+    return {
+        "tempo": summarize(durations),
+        "retomadas": sum(resumes) / runs,
+        "checkpoints": sum(puts) / runs,
+        "put_writes": sum(writes) / runs,
+        "get_state": sum(reads) / runs,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do fluxo do guia (etapas x formulário único)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--corrections", type=int, default=0, help="quantas vezes a usuária clica em Corrigir")
+    parser.add_argument("--ttft", type=float, default=0.3)
+    parser.add_argument("--tokens-per-s", type=float, default=250.0)
+    args = parser.parse_args()
+
+    # Mede a geração de verdade, sem reaproveitar guias do cache
+    guide.GUIDE_CACHE = False
+    server = FakeOpenAIServer(latency=args.ttft, tokens_per_s=args.tokens_per_s,
+                              reply=fake_reply, default_string="guide_node").start()
+    llm = LLMGateway([openai_compatible_provider("fake", server.base_url, "fake-model")])
+    caso = load_caso()
+
+    print(f"🔹 {args.runs} fluxo(s) por modo, {args.corrections} correção(ões)\n")
+    print(f"{'modo':<7} {'p50 (s)':>8} {'p95 (s)':>8} {'retomadas':>10} {'checkpoints':>12} {'put_writes':>11} {'get_state':>10}")
+    for mode in ("etapas", "unico"):
+        r = run(mode, llm, caso, args.runs, args.corrections)
+        print(f"{mode:<7} {r['tempo']['p50']:>8.2f} {r['tempo']['p95']:>8.2f} {r['retomadas']:>10.1f} "
+              f"{r['checkpoints']:>12.1f} {r['put_writes']:>11.1f} {r['get_state']:>10.1f}")
+    server.stop()
@@ -0,0 +1,67 @@
+"""Compara o tempo de parede do generate_guide no modo único x modo paralelo por seções.
+
+Uso (servidor fake local, simulando TTFT e taxa de saída de um modelo real):
+    python -m benchmarks.bench_guide_modes --runs 5 --ttft 0.4 --tokens-per-s 250
+
+Uso com os provedores reais configurados no .env:
+    python -m benchmarks.bench_guide_modes --real --runs 3
+"""
+import argparse
+import time
+
+from benchmarks.common import load_caso, summarize
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from agent.utils.gateway import LLMGateway, get_gateway, openai_compatible_provider
+from agent.utils.guide import generate_guide_content, GUIDE_SECTIONS
+
+# Tamanhos típicos observados: guia completo ~6k caracteres, cada seção ~1.2k
+SECTION_CHARS = 1200
+FULL_GUIDE_CHARS = SECTION_CHARS * len(GUIDE_SECTIONS) + 600
+
+
+def fake_reply(body: dict) -> str:
+    system = body["messages"][0]["content"]
+    size = SECTION_CHARS if "APENAS UMA SEÇÃO" in system else FULL_GUIDE_CHARS
+    text = ("- Texto simulado do guia para a consulta. " * (size // 42 + 1))[:size]
+    if size == FULL_GUIDE_CHARS:
+        return f"[INICIO_GUIA]\n# Guia\n{text}\n[FIM_GUIA]\n\nPronto!"
+    return f"## Seção\n\n{text}"
+
+
+def run(llm, user_data, mode, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        generate_guide_content(llm, user_data, mode=mode)
+        timings.append(time.perf_counter() - start)
+    return summarize(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dos modos de geração do guia")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--real", action="store_true", help="usa os provedores reais do .env")
+    parser.add_argument("--ttft", type=float, default=0.4, help="latência até o primeiro token (fake)")
+    parser.add_argument("--tokens-per-s", type=float, default=250.0, help="taxa de saída simulada (fake)")
+    args = parser.parse_args()
+
+    user_data = load_caso()
+    server = None
+    if args.real:
+        llm = get_gateway()
+    else:
+        server = FakeOpenAIServer(latency=args.ttft, tokens_per_s=args.tokens_per_s, reply=fake_reply).start()
+        llm = LLMGateway([openai_compatible_provider("fake", server.base_url, "fake-model")])
+
+    print(f"🔹 {args.runs} execução(ões) por modo ({'provedores reais' if args.real else 'servidor fake'})\n")
+    print(f"{'modo':<8} {'média (s)':>10} {'p50 (s)':>10} {'p95 (s)':>10}")
+    results = {}
+    for mode in ("unico", "secoes"):
+        results[mode] = run(llm, user_data, mode, args.runs)
+        r = results[mode]
+        print(f"{mode:<8} {r['media']:>10.2f} {r['p50']:>10.2f} {r['p95']:>10.2f}")
+
+    speedup = results["unico"]["p50"] / results["secoes"]["p50"] if results["secoes"]["p50"] else 0
+    print(f"\n⚡ Aceleração (p50): {speedup:.2f}x")
+    if server:
+        server.stop()
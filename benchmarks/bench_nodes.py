@@ -0,0 +1,265 @@
+"""Custo de cada nó do grafo (p50/p95 e alocações) com LLM e busca fake em processo.
+
+Mede o que o próprio grafo acrescenta: despacho dos nós, merge do estado, checkpoint,
+`normalize_content`, formatação dos documentos e blobs. O modelo e a busca são os de
+benchmarks/fake_backends.py (roteirizados, latência configurável; com latência 0 sobra só o overhead).
+
+Cenários (cada repetição é uma conversa nova: boas-vindas + o turno):
+    chat         roteador + chat
+    ferramentas  roteador + chat + retrieve_information + chat
+    guia         fluxo completo do guia em etapas, com as três interrupções e a geração
+
+Os tempos vêm de uma rodada sem tracemalloc; as alocações (pico e memória retida por nó) de uma
+segunda rodada com tracemalloc, que deixaria os tempos mais lentos. Cada execução é acrescentada
+ao histórico (benchmarks/resultados/bench_nodes.jsonl) e comparada com a anterior de mesmos parâmetros.
+
+Uso:
+    python -m benchmarks.bench_nodes --turnos 30
+    python -m benchmarks.bench_nodes --cenarios guia --latencia 0.05 --async
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import statistics
+import tracemalloc
+from datetime import datetime
+
+# Lidos na importação dos módulos do agente: sem especulação, PDF nem cache de guias, blobs em um diretório temporário
+os.environ.setdefault("GUIDE_SPECULATION", "0")
+os.environ.setdefault("PDF_PRERENDER", "0")
+os.environ.setdefault("GUIDE_CACHE", "0")
+os.environ.setdefault("BLOB_DIR", tempfile.mkdtemp(prefix="bench_nodes_blobs_"))
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+
+from benchmarks.common import load_caso, summarize
+from benchmarks.fake_backends import fake_gateway, install_fake_retriever
+from agent.agent import create_agent_graph
+from agent.utils.guide import PERSONAL_FIELDS, HEALTH_FIELDS
+
+HISTORY_PATH = os.path.join("benchmarks", "resultados", "bench_nodes.jsonl")
+CHECKPOINT = "(checkpoint)"
+TURN = "(turno)"
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Tempo (e, com tracemalloc ligado, alocações) de cada execução de nó do grafo."""
+
+    def __init__(self):
+        self.samples = {}  # nó -> lista de {"s", "pico", "retido"}
+        self._roots = set()
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def record(self, node: str, seconds: float, peak: int = None, retained: int = None):
+        with self._lock:
+            self.samples.setdefault(node, []).append({"s": seconds, "pico": peak, "retido": retained})
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        if parent_run_id is None:
+            self._roots.add(run_id)
+            return
+        node = (metadata or {}).get("langgraph_node")
+        # Só o nó em si (filho direto do grafo), não os runnables dentro dele
+        if parent_run_id not in self._roots or not node or node == "__start__" or kwargs.get("name") != node:
+            return
+        memory = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        self._open[run_id] = (node, time.perf_counter(), memory)
+
+    def _close(self, run_id):
+        self._roots.discard(run_id)
+        opened = self._open.pop(run_id, None)
+        if opened is None:
+            return
+        node, start, memory = opened
+        elapsed = time.perf_counter() - start
+        if memory is None:
+            self.record(node, elapsed)
+        else:
+            current, peak = tracemalloc.get_traced_memory()
+            self.record(node, elapsed, peak - memory, current - memory)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._close(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        # As interrupções do questionário chegam aqui (GraphInterrupt): o nó rodou até o interrupt
+        self._close(run_id)
+
+
+class TimedSaver(InMemorySaver):
+    """InMemorySaver que soma o tempo das escritas de checkpoint no timer."""
+
+    def __init__(self, timer: NodeTimer):
+        super().__init__()
+        self.timer = timer
+
+    def put(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().put(*args, **kwargs)
+        finally:
+            self.timer.record(CHECKPOINT, time.perf_counter() - start)
+
+    def put_writes(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().put_writes(*args, **kwargs)
+        finally:
+            self.timer.record(CHECKPOINT, time.perf_counter() - start)
+
+
+# ==== Cenários ====
+
+def scenario_steps(name: str, i: int, caso: dict) -> list:
+    """Entradas do grafo de uma conversa do cenário (a primeira abre a sessão)."""
+    steps = [{"messages": [HumanMessage(content="Olá")]}]
+    if name == "chat":
+        steps.append({"messages": [HumanMessage(content=f"Quais os sintomas mais comuns da menopausa? ({i})")]})
+    elif name == "ferramentas":
+        steps.append({"messages": [HumanMessage(content=f"Segundo os documentos, o que alivia as ondas de calor? ({i})")]})
+    elif name == "guia":
+        steps += [
+            {"messages": [HumanMessage(content="Quero gerar um guia para a minha consulta")]},
+            Command(resume={k: caso[k] for k in PERSONAL_FIELDS}),
+            Command(resume={k: f"{caso[k]} ({i})" for k in HEALTH_FIELDS}),
+            Command(resume={"confirmation": True}),
+        ]
+    return steps
+
+
+def run_scenario(graph, timer, name, runs, caso, use_async):
+    async def arun(steps, config):
+        for step in steps:
+            await graph.ainvoke(step, config)
+
+    for i in range(runs):
+        config = {"configurable": {"thread_id": str(uuid.uuid4())}, "callbacks": [timer]}
+        steps = scenario_steps(name, i, caso)
+        start = time.perf_counter()
+        if use_async:
+            asyncio.run(arun(steps, config))
+        else:
+            for step in steps:
+                graph.invoke(step, config)
+        timer.record(TURN, time.perf_counter() - start)
+
+
+def measure(name, runs, caso, llm, use_async, allocations):
+    timer = NodeTimer()
+    graph = create_agent_graph(checkpointer=TimedSaver(timer), llm=llm, form_mode="etapas")
+    run_scenario(graph, timer, name, 2, caso, use_async)  # aquecimento (imports, pools, caches de classe)
+    timer.samples.clear()
+    if allocations:
+        tracemalloc.start()
+    try:
+        run_scenario(graph, timer, name, runs, caso, use_async)
+    finally:
+        if allocations:
+            tracemalloc.stop()
+    return timer.samples
+
+
+def node_stats(timing_samples, alloc_samples) -> dict:
+    stats = {}
+    for node, samples in timing_samples.items():
+        t = summarize([s["s"] for s in samples])
+        row = {"n": t["n"], "p50_ms": t["p50"] * 1000, "p95_ms": t["p95"] * 1000}
+        allocs = [s for s in alloc_samples.get(node, []) if s["pico"] is not None]
+        if allocs:
+            row["pico_kb"] = statistics.median(s["pico"] for s in allocs) / 1024
+            row["retido_kb"] = statistics.median(s["retido"] for s in allocs) / 1024
+        stats[node] = row
+    return stats
+
+
+# ==== Histórico ====
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or "?"
+    except Exception:
+        return "?"
+
+
+def previous_entry(path: str, params: dict):
+    if not os.path.exists(path):
+        return None
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("parametros") == params:
+                    last = entry
+    return last
+
+
+def append_history(path: str, entry: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def print_table(name: str, stats: dict, before: dict, alert: float):
+    print(f"\n🔹 {name}")
+    print(f"{'nó':<22} {'n':>5} {'p50 (ms)':>9} {'p95 (ms)':>9} {'pico (KB)':>10} {'retido (KB)':>12} {'p50 x anterior':>15}")
+    order = sorted(stats, key=lambda n: (n.startswith("("), -stats[n]["p50_ms"]))
+    for node in order:
+        row = stats[node]
+        delta = ""
+        old = (before or {}).get(node)
+        if old and old["p50_ms"] > 0:
+            change = row["p50_ms"] / old["p50_ms"] - 1
+            delta = f"{change:+.0%}" + (" ⚠️" if change > alert else "")
+        pico = f"{row['pico_kb']:.1f}" if "pico_kb" in row else "-"
+        retido = f"{row['retido_kb']:.1f}" if "retido_kb" in row else "-"
+        print(f"{node:<22} {row['n']:>5} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} {pico:>10} {retido:>12} {delta:>15}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latência e alocações por nó do grafo (LLM e busca fake)")
+    parser.add_argument("--cenarios", nargs="+", default=["chat", "ferramentas", "guia"],
+                        choices=["chat", "ferramentas", "guia"])
+    parser.add_argument("--turnos", type=int, default=30, help="Conversas medidas por cenário")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latência de cada chamada ao LLM fake (s)")
+    parser.add_argument("--latencia-busca", type=float, default=0.0, help="Latência do embedding e do Qdrant fake (s)")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Usa ainvoke (nós assíncronos)")
+    parser.add_argument("--sem-alocacoes", action="store_true", help="Pula a rodada com tracemalloc")
+    parser.add_argument("--historico", default=HISTORY_PATH)
+    parser.add_argument("--alerta", type=float, default=0.2, help="Marca nós cujo p50 subiu mais que isso")
+    args = parser.parse_args()
+
+    install_fake_retriever(args.latencia_busca, args.latencia_busca)
+    llm = fake_gateway(args.latencia)
+    caso = load_caso()
+    params = {"turnos": args.turnos, "latencia": args.latencia, "latencia_busca": args.latencia_busca,
+              "async": args.use_async}
+    before = previous_entry(args.historico, params)
+    if before:
+        print(f"[SISTEMA] Comparando com {before['data']} (commit {before['commit']})")
+
+    results = {}
+    for name in args.cenarios:
+        timing = measure(name, args.turnos, caso, llm, args.use_async, allocations=False)
+        allocs = {} if args.sem_alocacoes else measure(name, max(5, args.turnos // 3), caso, llm,
+                                                        args.use_async, allocations=True)
+        results[name] = node_stats(timing, allocs)
+        print_table(name, results[name], (before or {}).get("cenarios", {}).get(name), args.alerta)
+
+    append_history(args.historico, {"data": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                                    "parametros": params, "cenarios": results})
+    print(f"\n[SISTEMA] Resultados acrescentados a {args.historico}")
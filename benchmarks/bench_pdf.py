@@ -0,0 +1,87 @@
+"""Renderizações por segundo, p95 e tamanho do PDF do guia: caminho antigo x pool de processos x cache.
+
+- inline: como o send_pdf fazia (CSS embutido no HTML, processado a cada chamada, no próprio processo);
+- pool: processos aquecidos com a folha de estilo já processada e fontes em subconjunto;
+- cache: o mesmo guia pedido de novo (o PDF sai do cache por hash do conteúdo).
+
+Uso:
+    python -m benchmarks.bench_pdf --renders 20 --workers 1 2 4
+"""
+import argparse
+import threading
+import time
+
+from benchmarks.bench_checkpoint_growth import sample_text
+from benchmarks.common import summarize
+from agent.utils.cache import MemoryCache
+from agent.utils.guide import GUIDE_SECTIONS
+from agent.utils.pdf import PdfRenderer, build_guide_html, GUIDE_CSS
+
+
+def sample_guide() -> str:
+    parts = ["# Guia para a Consulta"]
+    for _, title in GUIDE_SECTIONS:
+        parts.append(f"## {title}\n\n" + "\n".join(f"- **{sample_text(12)}**: {sample_text(160)}" for _ in range(6)))
+    return "\n\n".join(parts)
+
+
+def run_inline(guides):
+    from weasyprint import HTML
+
+    timings, sizes = [], []
+    start = time.perf_counter()
+    for guide in guides:
+        t0 = time.perf_counter()
+        html = build_guide_html(guide).replace("<head>", f"<head><style>{GUIDE_CSS}</style>", 1)
+        sizes.append(len(HTML(string=html).write_pdf()))
+        timings.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, timings, sizes
+
+
+def run_pool(renderer, guides):
+    """Dispara todos os pedidos de uma vez e mede do envio até a conclusão de cada um."""
+    timings, sizes = [], []
+    lock = threading.Lock()
+
+    def record(t0):
+        def done(future):
+            with lock:
+                timings.append(time.perf_counter() - t0)
+                sizes.append(len(future.result()))
+        return done
+
+    start = time.perf_counter()
+    futures = []
+    for guide in guides:
+        future = renderer.submit(guide)
+        future.add_done_callback(record(time.perf_counter()))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    return time.perf_counter() - start, timings, sizes
+
+
+def report(name, wall, timings, sizes):
+    t = summarize(timings)
+    print(f"{name:<16} {len(timings) / wall:>10.2f} {t['p50']:>9.2f} {t['p95']:>9.2f} "
+          f"{sum(sizes) / len(sizes) / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark da renderização do PDF do guia")
+    parser.add_argument("--renders", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    guides = [sample_guide() for _ in range(args.renders)]
+    print(f"🔹 {args.renders} guias distintos (~{len(guides[0]) / 1000:.0f}k caracteres cada)\n")
+    print(f"{'modo':<16} {'PDFs/s':>10} {'p50 (s)':>9} {'p95 (s)':>9} {'tamanho (KB)':>12}")
+
+    report("inline", *run_inline(guides))
+    for workers in args.workers:
+        renderer = PdfRenderer(workers=workers, cache=MemoryCache(args.renders * 2)).warm()
+        report(f"pool x{workers}", *run_pool(renderer, guides))
+        if workers == args.workers[-1]:
+            report("cache", *run_pool(renderer, guides))
+            print(f"\n   {renderer.stats()}")
+        renderer.shutdown()
@@ -0,0 +1,392 @@
+"""Qualidade da busca sem LLM: recall@k, MRR, nDCG e latência contra rótulos versionados.
+
+Os rótulos (`benchmarks/retrieval_labels_v1.jsonl`) ligam cada pergunta aos documentos relevantes
+pelo `id_original` do chunk (`"line_18"`: qualquer bloco do documento) ou a um bloco específico
+(`"line_18#2"`: `id_original#indice_de_blocos`). Mudou a base ou os critérios? Crie um `_v2` em vez
+de editar o arquivo, para os números continuarem comparáveis.
+
+Backends:
+    lexico   BM25 sobre o doc_chunks.jsonl (não precisa de embeddings nem de rede)
+    denso    similaridade de cosseno sobre os embeddings salvos em disco (embeddings_backup.jsonl)
+    hibrido  fusão por posição (RRF) de denso + lexico
+    qdrant   a coleção configurada no .env, como o retrieve_information consulta
+
+Os embeddings das perguntas ficam em cache em disco: depois da primeira rodada, lexico, denso e
+hibrido rodam em segundos e sem rede.
+
+Uso:
+    python -m benchmarks.bench_retrieval --backend lexico denso hibrido --quantizacao nenhuma int8
+    python -m benchmarks.bench_retrieval --backend qdrant --k 4 --rerank cross-encoder/ms-marco-MiniLM-L-6-v2
+    python -m benchmarks.bench_retrieval --saida base.json                      # guarda a referência
+    python -m benchmarks.bench_retrieval --comparar base.json --min-recall 0.6  # sai com 1 se piorar
+    python -m benchmarks.bench_retrieval --exportar-embeddings                  # baixa os vetores do Qdrant
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import hashlib
+import argparse
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from benchmarks.common import summarize
+from agent.utils.cache import DiskCache, content_key
+
+LABELS_PATH = "benchmarks/retrieval_labels_v1.jsonl"
+CHUNKS_PATH = "index/files/doc_chunks.jsonl"
+# Mesmo arquivo de backup gerado pelo index/qdrant/criar_base_qdrant_gemini_001.py
+EMBEDDINGS_PATH = "index/files/embeddings_backup.jsonl"
+QUERY_CACHE_DIR = ".cache/bench_retrieval"
+# Candidatos buscados a mais para a fusão híbrida, o rescore do int8 e o rerank
+OVERSAMPLING = 4
+RRF_K = 60
+
+
+# ==== Rótulos e métricas ====
+
+def load_labels(path: str = LABELS_PATH) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+def _matches(hit: dict, label: str) -> bool:
+    return label == hit["id"] or label == f"{hit['id']}#{hit['bloco']}"
+
+
+def metrics(hits: list, relevant: list, ks) -> dict:
+    """recall@k, MRR e nDCG@k (relevância binária; cada rótulo conta uma vez só)."""
+    found_at = []  # posição (0-based) em que cada rótulo apareceu pela primeira vez
+    gains = []
+    seen = set()
+    for pos, hit in enumerate(hits):
+        new = [r for r in relevant if r not in seen and _matches(hit, r)]
+        seen.update(new)
+        found_at.extend([pos] * len(new))
+        gains.append(1.0 if new else 0.0)
+    first = next((pos for pos, hit in enumerate(hits) if any(_matches(hit, r) for r in relevant)), None)
+
+    out = {"mrr": 1.0 / (first + 1) if first is not None else 0.0}
+    for k in ks:
+        out[f"recall@{k}"] = sum(1 for pos in found_at if pos < k) / len(relevant)
+        dcg = sum(g / math.log2(i + 2) for i, g in enumerate(gains[:k]))
+        idcg = sum(1.0 / math.log2(i + 2) for i in range(min(len(relevant), k)))
+        out[f"ndcg@{k}"] = dcg / idcg
+    return out
+
+
+# ==== Base local ====
+
+def load_chunks(path: str = CHUNKS_PATH) -> list:
+    chunks = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                c = json.loads(line)
+                chunks.append({"id": c["original_id"], "bloco": c["chunk_index"], "texto": c["chunk_text"]})
+    return chunks
+
+
+def tokenize(text: str) -> list:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in re.findall(r"\w+", text) if len(t) > 2]
+
+
+class LexicalIndex:
+    """BM25 em memória sobre os chunks."""
+
+    def __init__(self, chunks: list, k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1, self.b = k1, b
+        self.postings = defaultdict(list)
+        self.lengths = np.zeros(len(chunks), dtype=np.float32)
+        for i, chunk in enumerate(chunks):
+            terms = tokenize(chunk["texto"])
+            self.lengths[i] = len(terms)
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((i, tf))
+        self.avg_length = float(self.lengths.mean()) if len(chunks) else 0.0
+
+    def search(self, query: str, limit: int) -> list:
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        n = len(self.chunks)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.avg_length)
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+        top = np.argsort(-scores)[:limit]
+        return [self.chunks[i] for i in top if scores[i] > 0]
+
+
+def load_embeddings(path: str = EMBEDDINGS_PATH):
+    """(chunks, matriz float32 normalizada) a partir do backup de embeddings."""
+    chunks, vectors = [], []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            c = record["chunk"]
+            chunks.append({"id": c.get("original_id"), "bloco": c.get("chunk_index"), "texto": c.get("chunk_text")})
+            vectors.append(record["vector"])
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return chunks, matrix
+
+
+class DenseIndex:
+    """Busca exata por cosseno; com `int8`, quantização escalar por dimensão (como a do Qdrant)."""
+
+    def __init__(self, chunks: list, matrix: np.ndarray, quantization: str = "nenhuma"):
+        self.chunks = chunks
+        self.matrix = matrix
+        self.quantization = quantization
+        if quantization.startswith("int8"):
+            self.scales = np.maximum(np.abs(matrix).max(axis=0), 1e-12) / 127.0
+            self.codes = np.round(matrix / self.scales).astype(np.int8)
+
+    def search_vector(self, vector, limit: int) -> list:
+        query = np.asarray(vector, dtype=np.float32)
+        if query.shape[0] != self.matrix.shape[1]:
+            raise ValueError(f"embedding da pergunta tem {query.shape[0]} dimensões e a base {self.matrix.shape[1]}")
+        if self.quantization.startswith("int8"):
+            scores = self.codes.astype(np.float32) @ (query * self.scales)
+            if self.quantization == "int8+rescore":
+                # Como o rescore do Qdrant: candidatos pelo int8, ordem final pelos vetores originais
+                candidates = np.argsort(-scores)[:limit * OVERSAMPLING]
+                exact = self.matrix[candidates] @ query
+                return [self.chunks[i] for i in candidates[np.argsort(-exact)][:limit]]
+        else:
+            scores = self.matrix @ query
+        return [self.chunks[i] for i in np.argsort(-scores)[:limit]]
+
+
+def reciprocal_rank_fusion(*rankings, limit: int) -> list:
+    scores, by_key = defaultdict(float), {}
+    for ranking in rankings:
+        for pos, hit in enumerate(ranking):
+            key = (hit["id"], hit["bloco"])
+            scores[key] += 1.0 / (RRF_K + pos + 1)
+            by_key[key] = hit
+    return [by_key[key] for key in sorted(scores, key=scores.get, reverse=True)[:limit]]
+
+
+# ==== Embeddings das perguntas ====
+
+class QueryEmbeddings:
+    """Embeddings das perguntas com o mesmo modelo do retrieve_information, guardados em disco."""
+
+    def __init__(self, directory: str = QUERY_CACHE_DIR):
+        self.cache = DiskCache(directory, 64 * 1024 * 1024)
+
+    def get(self, text: str):
+        from agent.utils.tools import embedding_model_name, get_embedding
+
+        key = content_key(embedding_model_name(), text)
+        data = self.cache.get_bytes(key)
+        if data is not None:
+            return np.frombuffer(data, dtype=np.float32)
+        vector = np.asarray(get_embedding(text), dtype=np.float32)
+        self.cache.set_bytes(key, vector.tobytes())
+        return vector
+
+
+# ==== Backends ====
+
+class Backend:
+    def __init__(self, name: str, search, needs_embedding: bool):
+        self.name = name
+        self.search = search  # (pergunta, vetor ou None, limite) -> hits
+        self.needs_embedding = needs_embedding
+
+
+def qdrant_search(quantization: str):
+    from qdrant_client.http import models
+    from agent.utils.tools import COLLECTION_NAME, get_qdrant_client
+
+    client = get_qdrant_client()
+    if quantization == "nenhuma":
+        params = models.SearchParams(quantization=models.QuantizationSearchParams(ignore=True))
+    else:
+        # Só faz diferença se a coleção tiver quantização configurada
+        params = models.SearchParams(quantization=models.QuantizationSearchParams(
+            ignore=False, rescore=quantization == "int8+rescore", oversampling=float(OVERSAMPLING)))
+
+    def search(query, vector, limit):
+        result = client.query_points(collection_name=COLLECTION_NAME, query=vector.tolist(),
+                                     limit=limit, search_params=params, with_payload=True)
+        return [{"id": p.payload.get("id_original"), "bloco": p.payload.get("indice_de_blocos"),
+                 "texto": p.payload.get("texto", "")} for p in result.points]
+
+    return search
+
+
+def build_backends(names, quantizations, embeddings_path: str) -> list:
+    backends = []
+    lexical = dense = None
+    if "lexico" in names or "hibrido" in names:
+        lexical = LexicalIndex(load_chunks())
+    if "lexico" in names:
+        backends.append(Backend("lexico", lambda q, v, limit: lexical.search(q, limit), False))
+    if "denso" in names or "hibrido" in names:
+        if not os.path.exists(embeddings_path):
+            sys.exit(f"[ERROR] {embeddings_path} não existe: rode com --exportar-embeddings ou "
+                     "gere pelo index/qdrant/criar_base_qdrant_gemini_001.py")
+        chunks, matrix = load_embeddings(embeddings_path)
+        print(f"[SISTEMA] {len(chunks)} vetores de {matrix.shape[1]} dimensões carregados de {embeddings_path}")
+        for quant in quantizations:
+            dense = DenseIndex(chunks, matrix, quant)
+            suffix = "" if quant == "nenhuma" else f"/{quant}"
+            if "denso" in names:
+                backends.append(Backend(f"denso{suffix}", lambda q, v, limit, d=dense: d.search_vector(v, limit), True))
+            if "hibrido" in names:
+                def hybrid(q, v, limit, d=dense):
+                    pool = limit * OVERSAMPLING
+                    return reciprocal_rank_fusion(d.search_vector(v, pool), lexical.search(q, pool), limit=limit)
+                backends.append(Backend(f"hibrido{suffix}", hybrid, True))
+    if "qdrant" in names:
+        for quant in quantizations:
+            suffix = "" if quant == "nenhuma" else f"/{quant}"
+            backends.append(Backend(f"qdrant{suffix}", qdrant_search(quant), True))
+    return backends
+
+
+def with_rerank(backend: Backend, model_name: str) -> Backend:
+    """Reordena os candidatos do backend com um cross-encoder."""
+    from sentence_transformers import CrossEncoder
+
+    model = CrossEncoder(model_name)
+
+    def search(query, vector, limit):
+        candidates = backend.search(query, vector, limit * OVERSAMPLING)
+        if not candidates:
+            return []
+        scores = model.predict([(query, c["texto"]) for c in candidates])
+        return [candidates[i] for i in np.argsort(-np.asarray(scores))[:limit]]
+
+    return Backend(f"{backend.name}+rerank", search, backend.needs_embedding)
+
+
+# ==== Execução ====
+
+def run(backend: Backend, labels: list, vectors: dict, ks) -> dict:
+    limit = max(ks)
+    per_query, latencies = [], []
+    for label in labels:
+        start = time.perf_counter()
+        hits = backend.search(label["pergunta"], vectors.get(label["id"]), limit)
+        latencies.append(time.perf_counter() - start)
+        per_query.append(metrics(hits, label["relevantes"], ks))
+    result = {name: sum(m[name] for m in per_query) / len(per_query) for name in per_query[0]}
+    lat = summarize(latencies)
+    result.update(p50_ms=lat["p50"] * 1000, p95_ms=lat["p95"] * 1000)
+    return result
+
+
+def export_embeddings(path: str):
+    """Baixa vetores e payloads da coleção para o formato do backup local."""
+    from agent.utils.tools import COLLECTION_NAME, get_qdrant_client
+
+    client = get_qdrant_client()
+    total, offset = 0, None
+    with open(path, "w", encoding="utf-8") as f:
+        while True:
+            points, offset = client.scroll(collection_name=COLLECTION_NAME, limit=256, offset=offset,
+                                           with_payload=True, with_vectors=True)
+            for p in points:
+                chunk = {"original_id": p.payload.get("id_original"), "chunk_index": p.payload.get("indice_de_blocos"),
+                         "chunk_text": p.payload.get("texto")}
+                f.write(json.dumps({"chunk": chunk, "vector": p.vector}, ensure_ascii=False) + "\n")
+            total += len(points)
+            if offset is None:
+                break
+    print(f"[SISTEMA] {total} pontos exportados para {path}")
+
+
+def compare(results: dict, reference: dict, tolerance: float) -> list:
+    """Métricas de qualidade que caíram mais que a tolerância em relação à referência."""
+    regressions = []
+    for name, values in results.items():
+        for metric, before in reference.get(name, {}).items():
+            if metric.endswith("_ms") or metric not in values:
+                continue
+            if values[metric] < before - tolerance:
+                regressions.append(f"{name} {metric}: {before:.3f} -> {values[metric]:.3f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de qualidade da busca (sem LLM)")
+    parser.add_argument("--backend", nargs="+", default=["lexico", "denso", "hibrido"],
+                        choices=["lexico", "denso", "hibrido", "qdrant"])
+    parser.add_argument("--quantizacao", nargs="+", default=["nenhuma"], choices=["nenhuma", "int8", "int8+rescore"])
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 4, 10], help="Cortes do recall e do nDCG")
+    parser.add_argument("--rerank", help="Modelo cross-encoder para também medir cada backend com rerank")
+    parser.add_argument("--rotulos", default=LABELS_PATH)
+    parser.add_argument("--embeddings", default=EMBEDDINGS_PATH)
+    parser.add_argument("--exportar-embeddings", action="store_true", help="Baixa os vetores do Qdrant e sai")
+    parser.add_argument("--saida", help="Grava as métricas em JSON (referência para --comparar)")
+    parser.add_argument("--comparar", help="JSON de uma rodada anterior; sai com 1 se alguma métrica piorar")
+    parser.add_argument("--tolerancia", type=float, default=0.02)
+    parser.add_argument("--min-recall", type=float, help="Recall mínimo no maior k; sai com 1 se não atingir")
+    args = parser.parse_args()
+
+    if args.exportar_embeddings:
+        export_embeddings(args.embeddings)
+        sys.exit(0)
+
+    ks = sorted(set(args.k))
+    labels = load_labels(args.rotulos)
+    backends = build_backends(args.backend, args.quantizacao, args.embeddings)
+    if args.rerank:
+        backends += [with_rerank(b, args.rerank) for b in backends]
+
+    # Embeddings das perguntas antes de medir: a latência é só a da busca
+    vectors = {}
+    if any(b.needs_embedding for b in backends):
+        embedder = QueryEmbeddings()
+        vectors = {label["id"]: embedder.get(label["pergunta"]) for label in labels}
+        print(f"[SISTEMA] Embeddings das perguntas: {embedder.cache.hits} do cache, {embedder.cache.misses} gerados")
+
+    print(f"\n🔹 {len(labels)} perguntas de {args.rotulos} (sha {file_digest(args.rotulos)})\n")
+    columns = [f"recall@{k}" for k in ks] + ["mrr", f"ndcg@{ks[-1]}", "p50_ms", "p95_ms"]
+    print(f"{'configuração':<24}" + "".join(f"{c:>11}" for c in columns))
+    results = {}
+    for backend in backends:
+        results[backend.name] = run(backend, labels, vectors, ks)
+        print(f"{backend.name:<24}" + "".join(f"{results[backend.name][c]:>11.3f}" for c in columns))
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"rotulos": args.rotulos, "sha_rotulos": file_digest(args.rotulos), "k": ks,
+                       "resultados": results}, f, ensure_ascii=False, indent=2)
+
+    failures = []
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            reference = json.load(f)
+        if reference.get("sha_rotulos") != file_digest(args.rotulos):
+            print("[WARNING] A referência foi medida com outros rótulos: a comparação não é direta")
+        failures += compare(results, reference["resultados"], args.tolerancia)
+    if args.min_recall is not None:
+        failures += [f"{name} recall@{ks[-1]}: {values[f'recall@{ks[-1]}']:.3f} < {args.min_recall}"
+                     for name, values in results.items() if values[f"recall@{ks[-1]}"] < args.min_recall]
+    if failures:
+        print("\n[ERROR] Regressões na busca:")
+        for failure in failures:
+            print(f"   {failure}")
+        sys.exit(1)
@@ -0,0 +1,39 @@
+"""Utilitários compartilhados pelos benchmarks."""
+import json
+import statistics
+
+CASO_PATH = "caso.txt"
+
+
+def load_caso(path: str = CASO_PATH) -> dict:
+    """Lê o caso.txt (objetos JSON em sequência: dados pessoais, saúde, confirmação) e junta em um dict."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    merged, idx = {}, 0
+    while idx < len(text):
+        while idx < len(text) and text[idx].isspace():
+            idx += 1
+        if idx >= len(text):
+            break
+        obj, idx = decoder.raw_decode(text, idx)
+        merged.update(obj)
+    return merged
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[idx]
+
+
+def summarize(values) -> dict:
+    return {
+        "n": len(values),
+        "media": statistics.mean(values) if values else 0.0,
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "max": max(values) if values else 0.0,
+    }
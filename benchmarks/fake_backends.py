@@ -0,0 +1,221 @@
+"""Backends fake em processo para exercitar o grafo sem rede: modelo de chat roteirizado e busca.
+
+Diferente do fake_openai_server, nada passa por HTTP: o tempo medido é o do grafo (despacho dos
+nós, merge do estado, checkpoint, formatação das ferramentas) mais a latência configurada.
+
+Roteiro do modelo (determinístico):
+    roteador             "guide_node" se a última mensagem da usuária pedir para gerar um guia, senão "chat_node"
+    chat com ferramentas pede o retrieve_information se a pergunta citar "documentos" (e responde
+                         depois da ToolMessage); pede o send_pdf se citar "email"
+    sem ferramentas      um guia completo ou uma seção, conforme o prompt de sistema
+
+O outbox fake (install_fake_outbox) usa a fila SQLite real com SMTP e PDF fake.
+"""
+import time
+import asyncio
+import itertools
+import json
+from types import SimpleNamespace
+from typing import List
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+from agent.utils.cache import content_key
+from agent.utils.gateway import LLMGateway, Provider
+from agent.utils.guide import GUIDE_START, GUIDE_END
+
+CHUNKS_PATH = "index/files/doc_chunks.jsonl"
+ANSWER = ("Na menopausa, as ondas de calor costumam melhorar com roupas leves, ambientes ventilados, "
+          "atividade física regular e redução de álcool e cafeína. Converse com seu médico sobre as opções "
+          "de tratamento, inclusive a terapia hormonal, se os sintomas atrapalharem o seu dia a dia. 【1】") * 2
+SECTION_CHARS = 1200
+
+_call_ids = itertools.count()
+
+
+def _last_human(messages) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            return str(message.content)
+    return ""
+
+
+def _guide_text(messages) -> str:
+    system = str(messages[0].content) if messages else ""
+    text = ("- Texto simulado do guia para a consulta. " * (SECTION_CHARS // 42 + 1))[:SECTION_CHARS]
+    if "APENAS UMA SEÇÃO" in system:
+        return f"## Seção\n\n{text}"
+    return f"{GUIDE_START}\n# Guia\n{text * 5}\n{GUIDE_END}\n\nPronto!"
+
+
+class FakeChatModel(BaseChatModel):
+    """Modelo de chat roteirizado com latência fixa por chamada."""
+
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tide"
+
+    def _reply(self, messages: List[BaseMessage], tools_bound: bool) -> AIMessage:
+        self.calls += 1
+        if not tools_bound:
+            return AIMessage(content=_guide_text(messages))
+        last = messages[-1]
+        question = _last_human(messages)
+        if isinstance(last, HumanMessage):
+            lowered = question.lower()
+            if "documentos" in lowered:
+                return AIMessage(content="", tool_calls=[{
+                    "name": "retrieve_information", "args": {"query": question},
+                    "id": f"call_{next(_call_ids)}", "type": "tool_call"}])
+            if "email" in lowered:
+                return AIMessage(content="", tool_calls=[{
+                    "name": "send_pdf", "args": {}, "id": f"call_{next(_call_ids)}", "type": "tool_call"}])
+        if isinstance(last, ToolMessage):
+            return AIMessage(content=f"{ANSWER}\n\nFonte: documentos recuperados.")
+        return AIMessage(content=ANSWER)
+
+    def _generate(self, messages, stop=None, run_manager=None, tools_bound: bool = False, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, tools_bound))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools_bound: bool = False, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, tools_bound))])
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools_bound=True)
+
+    def with_structured_output(self, schema, **kwargs):
+        def route(messages):
+            self.calls += 1
+            text = _last_human(messages).lower()
+            return schema(route="guide_node" if "gerar" in text and "guia" in text else "chat_node")
+
+        def sync_route(messages):
+            if self.latency:
+                time.sleep(self.latency)
+            return route(messages)
+
+        async def async_route(messages):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return route(messages)
+
+        return RunnableLambda(sync_route, afunc=async_route)
+
+
+def fake_gateway(latency: float = 0.0) -> LLMGateway:
+    """Gateway real (admissão, breaker, estatísticas) com um único provedor fake em processo."""
+    model = FakeChatModel(latency=latency)
+    return LLMGateway([Provider("fake", "fake-tide", lambda: model)])
+
+
+class FakeQdrant:
+    """Responde ao query_points com chunks reais do doc_chunks.jsonl, escolhidos pelo vetor da pergunta."""
+
+    def __init__(self, latency: float = 0.0, path: str = CHUNKS_PATH):
+        self.latency = latency
+        self.calls = 0
+        with open(path, encoding="utf-8") as f:
+            self.chunks = [json.loads(line) for line in itertools.islice(f, 400)]
+
+    def _points(self, query, limit):
+        self.calls += 1
+        start = int(content_key(*query[:4])[:8], 16)
+        points = []
+        for i in range(limit):
+            chunk = self.chunks[(start + i * 37) % len(self.chunks)]
+            payload = {"texto": chunk["chunk_text"], "fonte": chunk["original_id"],
+                       "id_original": chunk["original_id"], "indice_de_blocos": chunk["chunk_index"]}
+            points.append(SimpleNamespace(payload=payload, score=1.0 - i * 0.01))
+        return SimpleNamespace(points=points)
+
+    def query_points(self, collection_name: str, query, limit: int = 4, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._points(query, limit)
+
+
+class AsyncFakeQdrant:
+    def __init__(self, sync: FakeQdrant):
+        self.sync = sync
+
+    async def query_points(self, collection_name: str, query, limit: int = 4, **kwargs):
+        if self.sync.latency:
+            await asyncio.sleep(self.sync.latency)
+        return self.sync._points(query, limit)
+
+
+def install_fake_retriever(latency: float = 0.0, embedding_latency: float = 0.0) -> FakeQdrant:
+    """Troca o embedding e o Qdrant usados pelo retrieve_information (cache, formatação e blobs seguem reais)."""
+    from agent.utils import tools
+
+    qdrant = FakeQdrant(latency)
+    async_qdrant = AsyncFakeQdrant(qdrant)
+
+    def embed(text: str) -> list:
+        if embedding_latency:
+            time.sleep(embedding_latency)
+        digest = content_key(text)
+        return [int(digest[i:i + 2], 16) / 255.0 for i in range(0, 16, 2)]
+
+    async def aembed(text: str) -> list:
+        if embedding_latency:
+            await asyncio.sleep(embedding_latency)
+        digest = content_key(text)
+        return [int(digest[i:i + 2], 16) / 255.0 for i in range(0, 16, 2)]
+
+    tools.get_cached_embedding = embed
+    tools.aget_cached_embedding = aembed
+    tools.get_qdrant_client = lambda: qdrant
+    tools.get_async_qdrant_client = lambda: async_qdrant
+    return qdrant
+
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 60_000
+
+
+class FakePdfRenderer:
+    """PDF já pronto: o worker do outbox só anexa os bytes."""
+
+    def ready(self, guide):
+        return PDF_BYTES
+
+    def render(self, guide, timeout=None):
+        return PDF_BYTES
+
+
+class FakeSmtp:
+    """Conexão SMTP fake com latência por mensagem; conta as mensagens entregues."""
+
+    delivered = 0
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.connections = 1
+
+    def send(self, msg):
+        if self.latency:
+            time.sleep(self.latency)
+        FakeSmtp.delivered += 1
+
+    def close(self):
+        pass
+
+
+def install_fake_outbox(path: str, smtp_latency: float = 0.0):
+    """Troca o outbox único do processo (usado pelo send_pdf) por um com SMTP e PDF fake."""
+    from agent.utils import outbox as outbox_module
+
+    outbox = outbox_module.Outbox(path=path, connection_factory=lambda: FakeSmtp(smtp_latency),
+                                  renderer=FakePdfRenderer()).start()
+    outbox_module._outbox_instance = outbox
+    return outbox
@@ -0,0 +1,170 @@
+"""Servidor local compatível com a API de chat da OpenAI, para exercitar o gateway sem cotas.
+
+Uso:
+    python -m benchmarks.fake_openai_server --port 8001 --latency 0.8 --error-rate 0.1
+
+E aponte o gateway para ele:
+    LLM_PROVIDERS="" LLM_OPENAI_COMPAT='[{"name": "fake1", "base_url": "http://127.0.0.1:8001/v1"}]'
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Resposta simulada pelo servidor fake. 【1】"
+
+
+def _sample_from_schema(schema: dict, default_string: str):
+    """Gera um objeto mínimo que satisfaz um JSON schema simples."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {name: _sample_from_schema(sub, default_string) for name, sub in props.items()}
+    if kind == "array":
+        return []
+    if kind in ("integer", "number"):
+        return 0
+    if kind == "boolean":
+        return False
+    return default_string
+
+
+class FakeOpenAIServer:
+    """Servidor em thread própria. `reply` pode ser um texto fixo ou uma função(request) -> texto."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, status_on_error=500, reply=DEFAULT_REPLY, default_string="chat_node",
+                 tokens_per_s=None):
+        self.latency = latency
+        # Se definido, simula a taxa de saída do modelo (~4 caracteres por token)
+        self.tokens_per_s = tokens_per_s
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.status_on_error = status_on_error
+        self.reply = reply
+        self.default_string = default_string
+        self.requests = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler(), bind_and_activate=False)
+        # A fila padrão (5) derruba conexões quando muitas sessões conectam ao mesmo tempo
+        self._httpd.request_queue_size = 1024
+        self._httpd.daemon_threads = True
+        self._httpd.server_bind()
+        self._httpd.server_activate()
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _content_for(self, body: dict) -> str:
+        fmt = body.get("response_format") or {}
+        if fmt.get("type") == "json_schema":
+            schema = fmt.get("json_schema", {}).get("schema", {})
+            return json.dumps(_sample_from_schema(schema, self.default_string))
+        if fmt.get("type") == "json_object":
+            return json.dumps({"resultado": self.default_string})
+        return self.reply(body) if callable(self.reply) else self.reply
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+
+                content = server._content_for(body)
+                delay = server.latency + random.uniform(-server.jitter, server.jitter)
+                if server.tokens_per_s:
+                    delay += (len(content) / 4) / server.tokens_per_s
+                time.sleep(max(0.0, delay))
+                if random.random() < server.error_rate:
+                    self._send_json(server.status_on_error, {"error": {"message": "erro simulado", "type": "server_error"}})
+                    return
+
+                usage = {"prompt_tokens": 10, "completion_tokens": max(1, len(content) // 4), "total_tokens": 10 + max(1, len(content) // 4)}
+                completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+                model = body.get("model", "fake-model")
+
+                if body.get("stream"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for piece in [content[i:i + 16] for i in range(0, len(content), 16)] or [""]:
+                        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                                 "model": model, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    final = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                    self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                    return
+
+                self._send_json(200, {
+                    "id": completion_id,
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor fake compatível com OpenAI")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tokens-per-s", type=float, default=None)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    args = parser.parse_args()
+
+    srv = FakeOpenAIServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                           reply=args.reply, tokens_per_s=args.tokens_per_s)
+    print(f"🔹 Servidor fake ouvindo em {srv.base_url}")
+    try:
+        srv._httpd.serve_forever()
+    except KeyboardInterrupt:
+        srv.stop()
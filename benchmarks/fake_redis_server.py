@@ -0,0 +1,165 @@
+"""Servidor local que fala o protocolo do Redis (RESP2), para testar a camada compartilhada sem Redis.
+
+Implementa só os comandos usados pelo app (os mesmos do LocalKV) e MULTI/EXEC.
+
+Uso:
+    python -m benchmarks.fake_redis_server --port 6399
+
+E aponte o app para ele:
+    KV_URL=redis://127.0.0.1:6399/0
+"""
+import argparse
+import socketserver
+import threading
+
+from agent.utils.kv import LocalKV
+
+# Comandos cuja resposta de sucesso é "+OK"
+_OK_COMMANDS = {"SET", "FLUSHDB", "LTRIM", "SELECT", "CLIENT"}
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        return b":1\r\n" if value else b":0\r\n"
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, dict):
+        value = [item for pair in value.items() for item in pair]
+    items = list(value)
+    return b"*%d\r\n" % len(items) + b"".join(_encode(item) for item in items)
+
+
+class FakeRedisServer:
+    """Servidor RESP em thread própria sobre um LocalKV."""
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.kv = LocalKV()
+        self.commands = 0
+        self._server = socketserver.ThreadingTCPServer((host, port), self._handler(), bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def execute(self, name: str, args: list):
+        kv = self.kv
+        if name == "PING":
+            return b"PONG"
+        if name == "HELLO":
+            if args and args[0] != b"2":
+                raise ValueError("NOPROTO sem suporte ao RESP3")
+            return {b"server": b"fake-redis", b"proto": 2}
+        if name in ("SELECT", "CLIENT"):
+            return True
+        if name == "SET":
+            key, value, *opts = args
+            opts = [o.decode().upper() for o in opts]
+            ex = int(opts[opts.index("EX") + 1]) if "EX" in opts else None
+            return kv.set(key, value, ex=ex, nx="NX" in opts)
+        if name == "HSET":
+            key, *pairs = args
+            return kv.hset(key, mapping=dict(zip(pairs[::2], pairs[1::2])))
+        simple = {
+            "GET": kv.get, "DEL": kv.delete, "EXISTS": kv.exists, "EXPIRE": kv.expire, "TTL": kv.ttl,
+            "KEYS": kv.keys, "DBSIZE": kv.dbsize, "FLUSHDB": kv.flushdb, "HSETNX": kv.hsetnx,
+            "HGETALL": kv.hgetall, "LPUSH": kv.lpush, "LRANGE": kv.lrange, "LINDEX": kv.lindex,
+            "LTRIM": kv.ltrim, "LLEN": kv.llen, "SADD": kv.sadd, "SMEMBERS": kv.smembers,
+        }
+        if name not in simple:
+            raise ValueError(f"unknown command '{name}'")
+        return simple[name](*args)
+
+    def reply(self, name: str, args: list) -> bytes:
+        try:
+            result = self.execute(name, args)
+        except (TypeError, ValueError) as e:
+            return f"-ERR {e}\r\n".encode()
+        if name in _OK_COMMANDS and result is True:
+            return b"+OK\r\n"
+        if name == "PING":
+            return b"+PONG\r\n"
+        return _encode(result)
+
+    def _handler(self):
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def _read_command(self):
+                line = self.rfile.readline()
+                if not line:
+                    return None
+                if not line.startswith(b"*"):
+                    return line.split()  # comando inline (ex.: redis-cli/telnet)
+                parts = []
+                for _ in range(int(line[1:])):
+                    size = int(self.rfile.readline()[1:])
+                    parts.append(self.rfile.read(size + 2)[:-2])
+                return parts
+
+            def handle(self):
+                queued = None  # comandos dentro de MULTI
+                while True:
+                    command = self._read_command()
+                    if not command:
+                        return
+                    server.commands += 1
+                    name, args = command[0].decode().upper(), command[1:]
+                    if name == "MULTI":
+                        queued = []
+                        self.wfile.write(b"+OK\r\n")
+                    elif name == "DISCARD":
+                        queued = None
+                        self.wfile.write(b"+OK\r\n")
+                    elif name == "EXEC":
+                        with server.kv._lock:
+                            replies = [server.reply(n, a) for n, a in (queued or [])]
+                        queued = None
+                        self.wfile.write(b"*%d\r\n" % len(replies) + b"".join(replies))
+                    elif queued is not None:
+                        queued.append((name, args))
+                        self.wfile.write(b"+QUEUED\r\n")
+                    else:
+                        self.wfile.write(server.reply(name, args))
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor fake compatível com o protocolo do Redis")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+
+    srv = FakeRedisServer(args.host, args.port)
+    print(f"🔹 Servidor RESP ouvindo em {srv.url}")
+    try:
+        srv._server.serve_forever()
+    except KeyboardInterrupt:
+        srv.stop()
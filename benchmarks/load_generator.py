@@ -0,0 +1,343 @@
+"""Gerador de carga: N usuárias simultâneas, cada uma com seu thread_id, em degraus crescentes.
+
+Cada usuária repete roteiros realistas com pausas entre as mensagens (tempo de leitura/digitação):
+    faq    boas-vindas + três perguntas (parte delas com busca nos documentos)
+    guia   boas-vindas + pedido do guia + dados pessoais + saúde (respostas do caso.txt) + confirmação
+    email  o roteiro do guia seguido do pedido de envio por email (send_pdf -> outbox)
+
+Alvos:
+    grafo  o grafo no próprio processo (ainvoke), como o servidor do langgraph.json
+    http   o server.py por HTTP/SSE; sem --url sobe um uvicorn local com o mesmo grafo
+
+Por padrão LLM, busca, SMTP e PDF são os fakes de benchmarks/fake_backends.py com latência
+configurável (`--real` usa os provedores do .env). Para cada degrau mostra vazão, latência dos
+turnos, filas (admissão do gateway, atraso do event loop, 503 do servidor) e memória por sessão.
+
+Uso:
+    python -m benchmarks.load_generator --usuarios 10 50 100 200 --duracao 30 --latencia 0.8
+    python -m benchmarks.load_generator --alvo http --usuarios 20 40 --mix faq=6,guia=3,email=1
+    python -m benchmarks.load_generator --alvo http --url http://127.0.0.1:8000 --real --usuarios 5
+"""
+import os
+import gc
+import json
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+# Lidos na importação dos módulos do agente: sem especulação, PDF nem cache de guias, blobs em um diretório temporário
+os.environ.setdefault("GUIDE_SPECULATION", "0")
+os.environ.setdefault("PDF_PRERENDER", "0")
+os.environ.setdefault("GUIDE_CACHE", "0")
+os.environ.setdefault("BLOB_DIR", tempfile.mkdtemp(prefix="load_blobs_"))
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+
+from benchmarks.common import load_caso, percentile
+from benchmarks.fake_backends import FakeSmtp, fake_gateway, install_fake_outbox, install_fake_retriever
+from agent.agent import create_agent_graph
+from agent.utils.admission import get_admission
+from agent.utils.guide import PERSONAL_FIELDS, HEALTH_FIELDS
+from agent.utils.outbox import get_outbox
+
+FAQ_QUESTIONS = [
+    "Quais são os sintomas mais comuns da menopausa?",
+    "Segundo os documentos, o que alivia as ondas de calor?",
+    "Com que idade a menopausa costuma começar?",
+    "Segundo os documentos, a reposição hormonal aumenta o risco de câncer?",
+    "Como melhorar o sono nessa fase?",
+    "Segundo os documentos, quais exames devo fazer?",
+]
+EMAIL_REQUEST = "Pode enviar o guia para o meu email?"
+
+
+# ==== Roteiros ====
+
+def script_steps(kind: str, rng: random.Random, caso: dict, user: int) -> list:
+    """(tipo do turno, entrada do grafo) de uma conversa do roteiro."""
+    steps = [("boas_vindas", {"message": "Olá"})]
+    if kind == "faq":
+        for question in rng.sample(FAQ_QUESTIONS, 3):
+            steps.append(("busca" if "documentos" in question else "chat", {"message": question}))
+        return steps
+    personal = {k: caso[k] for k in PERSONAL_FIELDS}
+    personal["email"] = f"usuaria{user}@exemplo.com"
+    steps += [
+        ("guia_inicio", {"message": "Quero gerar um guia para a minha consulta"}),
+        ("guia_dados", {"resume": personal}),
+        ("guia_saude", {"resume": {k: caso[k] for k in HEALTH_FIELDS}}),
+        ("guia_geracao", {"resume": {"confirmation": True}}),
+    ]
+    if kind == "email":
+        steps.append(("email", {"message": EMAIL_REQUEST}))
+    return steps
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# ==== Alvos ====
+
+class GraphTarget:
+    """Turnos direto no grafo (ainvoke) no event loop deste processo."""
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    async def turn(self, thread_id: str, step: dict) -> int:
+        payload = ({"messages": [HumanMessage(content=step["message"])]} if "message" in step
+                   else Command(resume=step["resume"]))
+        await self.graph.ainvoke(payload, {"configurable": {"thread_id": thread_id}})
+        return 200
+
+    async def server_metrics(self):
+        return None
+
+    async def close(self):
+        pass
+
+
+class HttpTarget:
+    """Turnos pelo server.py: POST com a resposta SSE lida até o evento "done"."""
+
+    def __init__(self, base_url: str, max_connections: int):
+        self.base_url = base_url.rstrip("/")
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(300.0),
+                                        limits=httpx.Limits(max_connections=max_connections))
+
+    async def turn(self, thread_id: str, step: dict) -> int:
+        route = "turn" if "message" in step else "resume"
+        async with self.client.stream("POST", f"{self.base_url}/threads/{thread_id}/{route}", json=step) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return response.status_code
+            async for line in response.aiter_lines():
+                if line.startswith("event: error"):
+                    return 500
+                if line.startswith("event: done"):
+                    break
+        return 200
+
+    async def server_metrics(self):
+        try:
+            return (await self.client.get(f"{self.base_url}/metrics")).json()
+        except Exception:
+            return None
+
+    async def close(self):
+        await self.client.aclose()
+
+
+def start_local_server(graph, llm) -> str:
+    """Sobe o server.py (create_app com o grafo dado) em um uvicorn numa thread e retorna a URL."""
+    import uvicorn
+    from server import create_app
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    # Limite de turnos simultâneos alto: a fila que interessa medir é a do gateway e do event loop
+    app = create_app(graph=graph, llm=llm, max_inflight=10_000)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+# ==== Medição ====
+
+def rss_bytes() -> int:
+    """Memória residente atual do processo (Linux); 0 onde /proc não existe."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+class LoopLag:
+    """Atraso do event loop: quanto um sleep curto passa do prazo (fila de callbacks prontos)."""
+
+    def __init__(self, interval_s: float = 0.05):
+        self.interval_s = interval_s
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval_s)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval_s))
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+class Level:
+    def __init__(self):
+        self.latencies = {}  # tipo do turno -> segundos
+        self.errors = 0
+        self.rejected = 0
+        self.conversations = 0
+        self.active = 0
+        self.peak_active = 0
+
+    def record(self, kind: str, seconds: float):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    @property
+    def all_latencies(self):
+        return [s for values in self.latencies.values() for s in values]
+
+
+async def simulated_user(user, target, level, deadline, mix, caso, pause, ramp, seed):
+    rng = random.Random(seed * 100_003 + user)
+    await asyncio.sleep(rng.uniform(0, ramp))
+    kinds, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        thread_id = f"carga-{uuid.uuid4()}"
+        level.conversations += 1
+        level.active += 1
+        level.peak_active = max(level.peak_active, level.active)
+        try:
+            for kind, step in script_steps(rng.choices(kinds, weights)[0], rng, caso, user):
+                if time.monotonic() >= deadline:
+                    break
+                start = time.perf_counter()
+                try:
+                    status = await target.turn(thread_id, step)
+                except Exception as e:
+                    status = 0
+                    print(f"[WARNING] Usuária {user}: {e}")
+                if status == 503:
+                    level.rejected += 1
+                    break
+                if status != 200:
+                    level.errors += 1
+                    break
+                level.record(kind, time.perf_counter() - start)
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * pause)
+        finally:
+            level.active -= 1
+
+
+async def run_level(target, users, duration, mix, caso, pause, seed):
+    level = Level()
+    deadline = time.monotonic() + duration
+    ramp = min(duration / 4, 5.0)
+    with LoopLag() as lag:
+        start = time.perf_counter()
+        await asyncio.gather(*(simulated_user(u, target, level, deadline, mix, caso, pause, ramp, seed)
+                               for u in range(users)))
+        wall = time.perf_counter() - start
+    return level, wall, lag.samples
+
+
+def ms(values, q):
+    return percentile(values, q) * 1000 if values else 0.0
+
+
+async def main(args):
+    caso = load_caso()
+    mix = parse_mix(args.mix)
+    llm = None
+    if not args.real:
+        install_fake_retriever(args.latencia_busca, args.latencia_busca)
+        install_fake_outbox(os.path.join(tempfile.mkdtemp(prefix="load_outbox_"), "outbox.sqlite"), args.latencia_smtp)
+        llm = fake_gateway(args.latencia)
+
+    graph = None
+    if args.alvo == "grafo" or not args.url:
+        graph = create_agent_graph(checkpointer=InMemorySaver(), llm=llm)
+    if args.alvo == "grafo":
+        target = GraphTarget(graph)
+    else:
+        url = args.url or await asyncio.to_thread(start_local_server, graph, llm)
+        target = HttpTarget(url, max(args.usuarios) * 2)
+
+    gc.collect()
+    baseline_rss = rss_bytes()
+    sessions = 0
+    history = []
+    print(f"🔹 Alvo {args.alvo}, mix {mix}, {args.duracao:.0f}s por degrau, pausa ~{args.pausa:.1f}s, "
+          f"LLM {'real' if args.real else f'fake ({args.latencia:.2f}s)'}\n")
+    print(f"{'usuárias':>8} {'turnos':>7} {'turnos/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'erros':>6} {'503':>5} {'lag p95':>8} {'adm p95':>8} {'fila':>5} {'RSS MB':>7} {'KB/sessão':>10}")
+    try:
+        for users in args.usuarios:
+            level, wall, lag = await run_level(target, users, args.duracao, mix, caso, args.pausa, args.seed)
+            sessions += level.conversations
+            gc.collect()
+            rss = rss_bytes()
+            admission = get_admission().metrics()
+            server = await target.server_metrics()
+            if server:
+                admission = server.get("admissao", admission)
+            latencies = level.all_latencies
+            per_session_kb = (rss - baseline_rss) / sessions / 1024 if sessions and rss else 0.0
+            print(f"{users:>8} {len(latencies):>7} {len(latencies) / wall:>9.1f} {ms(latencies, 0.5):>8.0f} "
+                  f"{ms(latencies, 0.95):>8.0f} {ms(latencies, 0.99):>8.0f} {level.errors:>6} {level.rejected:>5} "
+                  f"{ms(lag, 0.95):>8.1f} {admission['espera_p95_s'] * 1000:>8.0f} {admission['fila']:>5} "
+                  f"{rss / 2**20:>7.0f} {per_session_kb:>10.1f}")
+            history.append({
+                "usuarias": users, "turnos": len(latencies), "turnos_por_s": len(latencies) / wall,
+                "p50_ms": ms(latencies, 0.5), "p95_ms": ms(latencies, 0.95), "p99_ms": ms(latencies, 0.99),
+                "erros": level.errors, "rejeitados_503": level.rejected, "lag_p95_ms": ms(lag, 0.95),
+                "admissao": admission, "rss_mb": rss / 2**20, "kb_por_sessao": per_session_kb,
+                "sessoes": sessions, "pico_conversas_ativas": level.peak_active,
+                "por_tipo": {kind: {"n": len(v), "p50_ms": ms(v, 0.5), "p95_ms": ms(v, 0.95)}
+                             for kind, v in level.latencies.items()},
+            })
+    finally:
+        await target.close()
+
+    print("\n   p95 por tipo de turno (ms):")
+    kinds = sorted({kind for entry in history for kind in entry["por_tipo"]})
+    print(f"   {'usuárias':>8} " + " ".join(f"{kind:>12}" for kind in kinds))
+    for entry in history:
+        row = " ".join(f"{entry['por_tipo'][k]['p95_ms']:>12.0f}" if k in entry["por_tipo"] else f"{'-':>12}"
+                       for k in kinds)
+        print(f"   {entry['usuarias']:>8} {row}")
+
+    if not args.real:
+        print(f"\n   outbox: {get_outbox().counts()} ({FakeSmtp.delivered} entregues ao SMTP fake)")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"parametros": vars(args), "degraus": history}, f, ensure_ascii=False, indent=2)
+        print(f"\n[SISTEMA] Resultados gravados em {args.saida}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga de conversas simultâneas em degraus")
+    parser.add_argument("--usuarios", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--duracao", type=float, default=30.0, help="Segundos de cada degrau")
+    parser.add_argument("--mix", default="faq=6,guia=3,email=1", help="Pesos dos roteiros")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Pausa média entre mensagens de uma usuária (s)")
+    parser.add_argument("--alvo", choices=["grafo", "http"], default="grafo")
+    parser.add_argument("--url", help="Servidor já rodando (alvo http); sem ela sobe um local")
+    parser.add_argument("--real", action="store_true", help="Usa os provedores do .env em vez dos fakes")
+    parser.add_argument("--latencia", type=float, default=0.8, help="Latência de cada chamada ao LLM fake (s)")
+    parser.add_argument("--latencia-busca", type=float, default=0.05, help="Latência do embedding e do Qdrant fake (s)")
+    parser.add_argument("--latencia-smtp", type=float, default=0.2, help="Latência do envio SMTP fake (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--saida", help="Grava os degraus em JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,129 @@
+"""Envio do guia por email: SMTP inline (como o send_pdf fazia) x outbox com conexões reaproveitadas.
+
+Sobe um servidor SMTP local (aiosmtpd) que conta as conexões, simula o custo do handshake
+(STARTTLS + login) e recusa temporariamente (451) as primeiras mensagens, para exercitar as
+novas tentativas. Mede quanto a ferramenta espera, a vazão de entrega e quantas conexões foram abertas.
+
+Uso:
+    python -m benchmarks.outbox_smtp --emails 50 --handshake-ms 150 --falhas 5
+"""
+import os
+import asyncio
+import argparse
+import tempfile
+import time
+
+from aiosmtpd.controller import Controller
+
+from benchmarks.common import summarize
+from agent.utils import outbox as outbox_module
+from agent.utils.outbox import Outbox, SmtpConnection, compose_guide_email
+
+PDF_BYTES = b"%PDF-1.4\n" + b"0" * 60_000
+
+
+class CountingHandler:
+    def __init__(self, handshake_s: float, failures: int):
+        self.handshake_s = handshake_s
+        self.failures_left = failures
+        self.sessions = set()
+        self.received = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        # Custo de STARTTLS + login de um servidor real, pago uma vez por conexão
+        await asyncio.sleep(self.handshake_s)
+        self.sessions.add(id(session))
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.failures_left > 0:
+            self.failures_left -= 1
+            return "451 Tente novamente mais tarde"
+        self.received += 1
+        return "250 OK"
+
+
+class ReadyPdf:
+    """PDF já pré-renderizado (o caminho normal depois do generate_guide)."""
+
+    def ready(self, guide):
+        return PDF_BYTES
+
+    def render(self, guide, timeout=None):
+        return PDF_BYTES
+
+
+def run_inline(host, port, n):
+    """Como o send_pdf fazia: uma conexão por email, dentro da chamada da ferramenta."""
+    timings = []
+    for i in range(n):
+        t0 = time.perf_counter()
+        smtp = SmtpConnection(host, port, starttls=False)
+        smtp.send(compose_guide_email("tide@exemplo.com", f"usuaria{i}@exemplo.com", "<p>Olá</p>", PDF_BYTES))
+        smtp.close()
+        timings.append(time.perf_counter() - t0)
+    return timings
+
+
+def run_outbox(host, port, n, workers, path):
+    outbox = Outbox(path=path, workers=workers,
+                    connection_factory=lambda: SmtpConnection(host, port, starttls=False),
+                    renderer=ReadyPdf()).start()
+    timings = []
+    start = time.perf_counter()
+    for i in range(n):
+        t0 = time.perf_counter()
+        outbox.enqueue(f"usuaria{i}@exemplo.com", "<p>Olá</p>", f"guia {i}", thread_id=f"t{i}")
+        timings.append(time.perf_counter() - t0)
+    drained = outbox.drain(timeout=120)
+    wall = time.perf_counter() - start
+    outbox.stop()
+    return timings, wall, drained, outbox.stats()
+
+
+def report(name, timings, wall, connections, delivered):
+    t = summarize(timings)
+    print(f"{name:<12} {t['p50'] * 1000:>12.2f} {t['p95'] * 1000:>12.2f} {delivered / wall:>10.1f} {connections:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do envio de emails: inline x outbox")
+    parser.add_argument("--emails", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--handshake-ms", type=float, default=150)
+    parser.add_argument("--falhas", type=int, default=5, help="Mensagens recusadas com 451 no modo outbox")
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    # Novas tentativas rápidas para o benchmark não esperar o backoff de produção
+    outbox_module.OUTBOX_BACKOFF_S = 0.05
+    outbox_module.OUTBOX_POLL_S = 0.05
+
+    host = "127.0.0.1"
+    print(f"🔹 {args.emails} emails, handshake de {args.handshake_ms:.0f} ms por conexão\n")
+    print(f"{'modo':<12} {'espera p50 (ms)':>12} {'espera p95 (ms)':>12} {'emails/s':>10} {'conexões':>9}")
+
+    handler = CountingHandler(args.handshake_ms / 1000, failures=0)
+    controller = Controller(handler, hostname=host, port=args.port)
+    controller.start()
+    try:
+        start = time.perf_counter()
+        timings = run_inline(host, args.port, args.emails)
+        report("inline", timings, time.perf_counter() - start, len(handler.sessions), handler.received)
+    finally:
+        controller.stop()
+
+    handler = CountingHandler(args.handshake_ms / 1000, failures=args.falhas)
+    controller = Controller(handler, hostname=host, port=args.port)
+    controller.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            timings, wall, drained, stats = run_outbox(host, args.port, args.emails, args.workers,
+                                                       os.path.join(tmp, "outbox.sqlite"))
+        report("outbox", timings, wall, len(handler.sessions), handler.received)
+    finally:
+        controller.stop()
+
+    print(f"\n   fila esvaziada: {drained}; recebidos pelo servidor: {handler.received}/{args.emails}")
+    print(f"   {stats}")
@@ -0,0 +1,91 @@
+"""Teste de resistência dos checkpointers: memória do processo e tamanho em disco por sessão.
+
+Simula muitas sessões completas (boas-vindas + formulário único + guia) contra o servidor fake
+e, a cada intervalo, registra a memória alocada (tracemalloc) e o tamanho do banco + WAL.
+Compara o InMemorySaver com o checkpointer SQLite podado (com e sem compressão).
+
+Uso:
+    python -m benchmarks.soak_checkpointer --sessions 500 --every 50
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+from benchmarks.bench_guide_flow import FlowDriver, flow_unico
+from benchmarks.bench_guide_modes import fake_reply
+from benchmarks.common import load_caso
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from agent.agent import create_agent_graph
+from agent.utils import guide
+from agent.utils.checkpointer import PrunedSqliteSaver
+from agent.utils.gateway import LLMGateway, openai_compatible_provider
+
+
+def disk_bytes(path):
+    if path is None:
+        return 0
+    return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+
+
+def soak(name, saver, db_path, llm, caso, sessions, every):
+    graph = create_agent_graph(checkpointer=saver, llm=llm, form_mode="unico")
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    curve = []
+    start = time.perf_counter()
+    for i in range(1, sessions + 1):
+        driver = FlowDriver(graph)
+        graph.invoke({"messages": [HumanMessage(content="Olá")]}, driver.config)
+        flow_unico(driver, caso, corrections=0)
+        if i % every == 0 or i == sessions:
+            gc.collect()
+            mem = tracemalloc.get_traced_memory()[0] - base
+            curve.append((i, mem, disk_bytes(db_path)))
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - start
+
+    print(f"\n== {name} ({elapsed:.1f}s, {elapsed / sessions * 1000:.0f} ms/sessão)")
+    print(f"{'sessões':>8} {'memória (KB)':>13} {'disco (KB)':>11} {'KB/sessão (mem+disco)':>22}")
+    for i, mem, disk in curve:
+        print(f"{i:>8} {mem / 1024:>13.0f} {disk / 1024:>11.0f} {(mem + disk) / 1024 / i:>22.1f}")
+    if isinstance(saver, PrunedSqliteSaver):
+        print(f"   {saver.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak test dos checkpointers")
+    parser.add_argument("--sessions", type=int, default=300)
+    parser.add_argument("--every", type=int, default=50)
+    parser.add_argument("--keep-last", type=int, default=5)
+    args = parser.parse_args()
+
+    guide.GUIDE_CACHE = False
+    server = FakeOpenAIServer(reply=fake_reply, default_string="guide_node").start()
+    llm = LLMGateway([openai_compatible_provider("fake", server.base_url, "fake-model")])
+    caso = load_caso()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, "raw.sqlite")
+        zstd_path = os.path.join(tmp, "zstd.sqlite")
+        savers = [
+            ("InMemorySaver", InMemorySaver(), None),
+            ("SQLite podado, msgpack", PrunedSqliteSaver.from_path(raw_path, serde=JsonPlusSerializer(),
+                                                                  keep_last=args.keep_last), raw_path),
+            ("SQLite podado, msgpack+zstd", PrunedSqliteSaver.from_path(zstd_path, keep_last=args.keep_last),
+             zstd_path),
+        ]
+        for name, saver, path in savers:
+            soak(name, saver, path, llm, caso, args.sessions, args.every)
+            if path:
+                saver.maintenance()
+                print(f"   após manutenção: {disk_bytes(path) / 1024:.0f} KB em disco")
+                saver.conn.close()
+    server.stop()
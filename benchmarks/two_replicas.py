@@ -0,0 +1,115 @@
+"""Duas réplicas (processos) alternando os turnos da mesma conversa sobre a camada compartilhada.
+
+Sobe o servidor RESP local e o servidor fake de LLM; cada réplica é um processo com o próprio
+grafo, apontando para o mesmo KV_URL. Os turnos do mesmo thread_id alternam entre as réplicas
+e o script confere que cada uma enxerga o estado, os blobs e o cache de guias gravados pela outra.
+
+Uso:
+    python -m benchmarks.two_replicas
+"""
+import multiprocessing as mp
+import os
+import uuid
+
+from benchmarks.bench_guide_modes import fake_reply
+from benchmarks.common import load_caso
+from benchmarks.fake_openai_server import FakeOpenAIServer
+from benchmarks.fake_redis_server import FakeRedisServer
+
+
+def replica(name, llm_url, conn):
+    from langchain_core.messages import HumanMessage
+    from langgraph.types import Command
+    from agent.agent import create_agent_graph
+    from agent.utils.blobs import resolve
+    from agent.utils.checkpointer import get_checkpointer
+    from agent.utils.gateway import LLMGateway, openai_compatible_provider
+
+    llm = LLMGateway([openai_compatible_provider("fake", llm_url, "fake-model")])
+    graph = create_agent_graph(checkpointer=get_checkpointer(), llm=llm, form_mode="unico")
+
+    while True:
+        command = conn.recv()
+        if command is None:
+            return
+        kind, thread_id, data = command
+        config = {"configurable": {"thread_id": thread_id}}
+        if kind == "message":
+            graph.invoke({"messages": [HumanMessage(content=data)]}, config)
+        elif kind == "resume":
+            graph.invoke(Command(resume=data), config)
+        snapshot = graph.get_state(config)
+        values = snapshot.values or {}
+        user_data = values.get("user_data") or {}
+        conn.send({
+            "replica": name,
+            "pid": os.getpid(),
+            "mensagens": len(values.get("messages", [])),
+            "proximo": list(snapshot.next),
+            "interrupcao": snapshot.interrupts[0].value if snapshot.interrupts else None,
+            "nome": user_data.get("nome"),
+            "guia": resolve(user_data.get("guide")) if user_data.get("guide") else None,
+        })
+
+
+def main():
+    caso = load_caso()
+    answers = {k: str(v) for k, v in caso.items()}
+    redis_srv = FakeRedisServer().start()
+    llm_srv = FakeOpenAIServer(reply=fake_reply, default_string="guide_node").start()
+
+    # As réplicas herdam o KV_URL (lido na importação dos módulos do agente)
+    os.environ["KV_URL"] = redis_srv.url
+    ctx = mp.get_context("spawn")
+    replicas = {}
+    for name in ("A", "B"):
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=replica, args=(name, llm_srv.base_url, child), daemon=True)
+        proc.start()
+        replicas[name] = (proc, parent)
+
+    def turn(name, kind, thread_id, data=None):
+        _, conn = replicas[name]
+        conn.send((kind, thread_id, data))
+        result = conn.recv()
+        print(f"  [{result['replica']} pid={result['pid']}] {kind:<8} mensagens={result['mensagens']:<3} "
+              f"próximo={result['proximo']}")
+        return result
+
+    thread_id = str(uuid.uuid4())
+    print(f"🔹 Conversa {thread_id[:8]} alternando entre as réplicas A e B")
+    r = turn("A", "message", thread_id, "Olá")
+    assert r["mensagens"] == 2
+    r = turn("B", "message", thread_id, "Quero gerar um guia para a consulta")
+    assert r["proximo"] == ["questionnaire"], "B não continuou a conversa de A"
+    r = turn("A", "resume", thread_id, answers)
+    assert r["guia"], "A não gerou o guia"
+    guide = r["guia"]
+    r = turn("B", "state", thread_id)
+    assert r["guia"] == guide, "B não resolveu o blob do guia gravado por A"
+    r = turn("B", "message", thread_id, "Quero refazer o guia")
+    assert r["interrupcao"]["valores"]["nome"] == caso["nome"], "o formulário de B não veio preenchido"
+    r = turn("A", "resume", thread_id, {"exit": True})
+    assert r["proximo"] == []
+
+    # Outra conversa com as mesmas respostas, na outra réplica: o guia vem do cache compartilhado
+    requests_before = llm_srv.requests
+    other = str(uuid.uuid4())
+    print(f"🔹 Conversa {other[:8]} com as mesmas respostas, começando em B")
+    turn("B", "message", other, "Olá")
+    turn("B", "message", other, "Quero um guia")
+    r = turn("B", "resume", other, answers)
+    generation_calls = llm_srv.requests - requests_before - 1  # descontando o roteador
+    assert r["guia"] == guide and generation_calls == 0, "o guia não veio do cache compartilhado"
+
+    for proc, conn in replicas.values():
+        conn.send(None)
+        proc.join(timeout=10)
+    print(f"\n✅ Estado, blobs e cache de guias compartilhados entre as réplicas "
+          f"({redis_srv.kv.dbsize()} chaves no KV, {redis_srv.commands} comandos).")
+    llm_srv.stop()
+    redis_srv.stop()
+
+
+if __name__ == "__main__":
+    main()
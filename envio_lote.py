@@ -0,0 +1,242 @@
+"""Envio de guias em lote (campanhas e lotes de pacientes das clínicas parceiras).
+
+Lê um JSONL com as respostas do questionário (uma paciente por linha, com os mesmos campos do
+caso.txt), gera os guias em paralelo dentro de um limite de chamadas de LLM por minuto,
+renderiza os PDFs no pool de processos e coloca os emails no outbox, que envia por conexões
+SMTP reaproveitadas. Cada linha concluída vai para um arquivo de progresso: rodar de novo
+retoma de onde parou, sem gerar nem enviar duas vezes.
+
+Uso:
+    python envio_lote.py pacientes.jsonl --rpm 60 --concorrencia 8 --aguardar-envio
+    python envio_lote.py pacientes.jsonl --sem-email --pdf-dir pdfs/
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+
+import dotenv
+
+from agent.utils.gateway import get_gateway
+from agent.utils.guide import (
+    GUIDE_CACHE, GUIDE_END, GUIDE_MODE, GUIDE_SECTIONS, SECTION_FAILED_NOTE,
+    agenerate_guide_content, extract_guide, get_guide_cache, guide_cache_key, user_data_hash, validate_answers,
+)
+from agent.utils.outbox import get_outbox, guide_email_body, SENT, FAILED
+from agent.utils.pdf import get_pdf_renderer
+from agent.utils.ratelimit import TokenBucket
+from agent.utils.resilience import DEPENDENCY_TIMEOUTS_S
+
+dotenv.load_dotenv()
+
+# --- Configurações Globais ---
+# Chamadas de LLM por minuto permitidas ao lote (deixe folga para as conversas do app)
+LOTE_LLM_RPM = float(os.getenv("LOTE_LLM_RPM", "60"))
+LOTE_CONCORRENCIA = int(os.getenv("LOTE_CONCORRENCIA", "8"))
+
+# Situações registradas no arquivo de progresso
+QUEUED, DONE, ERROR = "na_fila", "concluido", "erro"
+
+
+def read_rows(path: str):
+    """(número da linha, respostas) de cada linha não vazia do JSONL."""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                yield line_no, json.loads(line)
+
+
+def row_key(line_no: int, row: dict) -> str:
+    """Identifica a linha pelo conteúdo: editar uma linha faz ela ser processada de novo."""
+    return f"{line_no}:{user_data_hash(row)[:12]}:{row.get('email', '')}"
+
+
+class Progress:
+    """Arquivo JSONL só de acréscimos com o resultado de cada linha (o último registro vale)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[record["chave"]] = record
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def done(self, key: str) -> bool:
+        return self.records.get(key, {}).get("status") in (QUEUED, DONE)
+
+    def append(self, record: dict):
+        with self._lock:
+            self.records[record["chave"]] = record
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class BatchRunner:
+    """Gera, renderiza e enfileira os guias das linhas, com concorrência e vazão de LLM limitadas."""
+
+    def __init__(self, llm, progress: Progress, bucket: TokenBucket, concurrency: int = LOTE_CONCORRENCIA,
+                 renderer=None, outbox=None, send_email: bool = True, pdf_dir: str = None):
+        self.llm = llm
+        self.progress = progress
+        self.bucket = bucket
+        self.renderer = renderer or get_pdf_renderer()
+        self.outbox = outbox
+        if self.outbox is None and send_email:
+            self.outbox = get_outbox()
+        self.send_email = send_email
+        self.pdf_dir = pdf_dir
+        self._slots = asyncio.Semaphore(concurrency)
+        # Chamadas de LLM de um guia (uma por seção no modo "secoes")
+        self.calls_per_guide = len(GUIDE_SECTIONS) if GUIDE_MODE == "secoes" else 1
+        self.timings = {"guia": [], "pdf": [], "fila": []}
+        self.processed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.cached = 0
+
+    async def _guide(self, row: dict) -> str:
+        # Guias já em cache não gastam a cota de LLM
+        if GUIDE_CACHE and await asyncio.to_thread(get_guide_cache().get, guide_cache_key(self.llm, row, GUIDE_MODE)):
+            self.cached += 1
+        else:
+            await self.bucket.atake(self.calls_per_guide)
+        content = await agenerate_guide_content(self.llm, row)
+        if GUIDE_END not in content or SECTION_FAILED_NOTE in content:
+            raise RuntimeError("guia incompleto (alguma seção falhou)")
+        return extract_guide(content)
+
+    async def process(self, line_no: int, row: dict):
+        key = row_key(line_no, row)
+        if self.progress.done(key):
+            self.skipped += 1
+            return
+        record = {"chave": key, "linha": line_no, "email": row.get("email")}
+        try:
+            errors = validate_answers(row)
+            if errors:
+                raise ValueError(f"respostas inválidas: {errors}")
+
+            async with self._slots:
+                t0 = time.perf_counter()
+                guide = await self._guide(row)
+                self.timings["guia"].append(time.perf_counter() - t0)
+
+            # O pool de PDF tem sua própria fila: a vaga do LLM já fica livre para outra linha
+            t0 = time.perf_counter()
+            pdf_bytes = await asyncio.wait_for(asyncio.wrap_future(self.renderer.submit(guide)),
+                                               DEPENDENCY_TIMEOUTS_S["pdf"])
+            self.timings["pdf"].append(time.perf_counter() - t0)
+            if self.pdf_dir:
+                path = os.path.join(self.pdf_dir, f"guia_linha_{line_no}.pdf")
+                await asyncio.to_thread(_write_bytes, path, pdf_bytes)
+                record["pdf"] = path
+
+            if self.send_email:
+                t0 = time.perf_counter()
+                # O PDF já está no cache do renderizador: o worker do outbox só anexa
+                record["outbox_id"] = await asyncio.to_thread(
+                    self.outbox.enqueue, row["email"], guide_email_body(row.get("nome", "Usuária")), guide,
+                    thread_id=f"lote:{key}",
+                )
+                self.timings["fila"].append(time.perf_counter() - t0)
+                record["status"] = QUEUED
+            else:
+                record["status"] = DONE
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            record.update(status=ERROR, erro=str(e))
+            print(f"[ERROR] Linha {line_no}: {e}")
+        self.progress.append(record)
+
+    async def run(self, rows) -> float:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.process(line_no, row) for line_no, row in rows))
+        return time.perf_counter() - start
+
+
+def _write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def delivery_counts(outbox, progress: Progress) -> dict:
+    """Situação no outbox dos emails deste lote."""
+    counts = {}
+    for record in progress.records.values():
+        if record.get("status") != QUEUED:
+            continue
+        status = outbox.status(f"lote:{record['chave']}")
+        state = status["status"] if status else "desconhecido"
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+def _p(values, q):
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def report(runner: BatchRunner, total: int, wall: float):
+    print(f"\n🔹 {total} linhas em {wall:.1f}s: {runner.processed} processadas, "
+          f"{runner.skipped} já concluídas antes, {runner.errors} com erro, {runner.cached} guias do cache")
+    if runner.processed:
+        print(f"   vazão: {runner.processed / wall * 60:.1f} guias/min")
+    for stage, values in runner.timings.items():
+        if values:
+            print(f"   {stage:<5} média {statistics.mean(values):.2f}s  p50 {_p(values, 0.5):.2f}s  "
+                  f"p95 {_p(values, 0.95):.2f}s")
+    print(f"   limite de LLM: {runner.bucket.stats()}")
+    print(f"   pdf: {runner.renderer.stats()}")
+
+
+async def main(args):
+    rows = list(read_rows(args.entrada))
+    progress = Progress(args.progresso or f"{args.entrada}.progresso.jsonl")
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+    llm = get_gateway()
+    # Uma rajada de até um guia inteiro, depois `rpm` chamadas por minuto
+    calls = len(GUIDE_SECTIONS) if GUIDE_MODE == "secoes" else 1
+    bucket = TokenBucket.per_minute(args.rpm, burst=max(calls, args.rpm / 60))
+    runner = BatchRunner(llm, progress, bucket, args.concorrencia, send_email=not args.sem_email,
+                         pdf_dir=args.pdf_dir)
+    try:
+        wall = await runner.run(rows)
+        report(runner, len(rows), wall)
+        if runner.send_email and args.aguardar_envio:
+            print("\n📧 Aguardando o outbox enviar os emails...")
+            t0 = time.perf_counter()
+            drained = await asyncio.to_thread(runner.outbox.drain, args.aguardar_envio)
+            counts = delivery_counts(runner.outbox, progress)
+            sent = counts.get(SENT, 0)
+            print(f"   {'fila esvaziada' if drained else 'tempo esgotado'} em {time.perf_counter() - t0:.1f}s: "
+                  f"{sent} enviados, {counts.get(FAILED, 0)} falharam, situação {counts}")
+            print(f"   outbox: {runner.outbox.stats()}")
+    finally:
+        progress.close()
+        runner.renderer.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera e envia guias em lote a partir de um JSONL de respostas")
+    parser.add_argument("entrada", help="JSONL com as respostas (uma paciente por linha)")
+    parser.add_argument("--rpm", type=float, default=LOTE_LLM_RPM, help="Chamadas de LLM por minuto")
+    parser.add_argument("--concorrencia", type=int, default=LOTE_CONCORRENCIA, help="Guias gerados ao mesmo tempo")
+    parser.add_argument("--progresso", help="Arquivo de progresso (padrão: <entrada>.progresso.jsonl)")
+    parser.add_argument("--sem-email", action="store_true", help="Só gera e renderiza (use com --pdf-dir)")
+    parser.add_argument("--pdf-dir", help="Também grava os PDFs neste diretório")
+    parser.add_argument("--aguardar-envio", type=float, nargs="?", const=600, default=0,
+                        help="Espera o outbox enviar os emails (segundos; padrão 600)")
+    asyncio.run(main(parser.parse_args()))
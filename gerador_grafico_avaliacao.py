@@ -1,7 +1,11 @@
+import argparse
 import seaborn as sns
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+from armazenamento_resultados import ler_colunas, listar_execucoes, RESULTADOS_DIR
+
+COLUNAS_CLASSIFICACAO = ["id_pergunta", "baseline_classificacao", "tide_classificacao"]
 # ==========================================
 # 6. GERADOR DE GRÁFICOS
 # ==========================================
@@ -69,8 +73,34 @@ def imprimir_paragrafo_conclusao(df, total_perguntas):
     print("="*70 + "\n")
 
 
-nome_ficheiro = "resultados_avaliacao_Teste final.csv"
-df_resultados = pd.read_csv(nome_ficheiro, encoding="utf-8")
+def carregar_resultados(execucoes=None, diretorio=RESULTADOS_DIR):
+    """Só as classificações das execuções pedidas (todas por padrão); respostas e contextos não são lidos."""
+    return pd.DataFrame.from_records(ler_colunas(COLUNAS_CLASSIFICACAO, execucoes, diretorio),
+                                     columns=COLUNAS_CLASSIFICACAO + ["execucao"])
+
+def imprimir_resumo_por_execucao(df):
+    resumo = df.groupby("execucao").agg(
+        perguntas=("id_pergunta", "size"),
+        baseline_corretas=("baseline_classificacao", lambda s: (s == "correta").mean() * 100),
+        tide_corretas=("tide_classificacao", lambda s: (s == "correta").mean() * 100),
+    )
+    print("\n📈 Respostas corretas (%) por execução:")
+    print(resumo.round(1).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gráfico e parágrafo a partir dos resultados da avaliação")
+    parser.add_argument("--execucao", nargs="*", help=f"Execuções a agregar (padrão: todas em '{RESULTADOS_DIR}')")
+    parser.add_argument("--csv", help="Lê um CSV antigo (resultados_avaliacao.csv) em vez do armazenamento")
+    args = parser.parse_args()
+
+    if args.csv:
+        df_resultados = pd.read_csv(args.csv, encoding="utf-8", usecols=COLUNAS_CLASSIFICACAO)
+    else:
+        df_resultados = carregar_resultados(args.execucao)
+        print(f"🔹 {len(df_resultados)} avaliações de {df_resultados['execucao'].nunique()} execução(ões): "
+              f"{', '.join(args.execucao or listar_execucoes())}")
+        imprimir_resumo_por_execucao(df_resultados)
 
-gerar_graficos(df_resultados)
-imprimir_paragrafo_conclusao(df_resultados, 100)
\ No newline at end of file
+    gerar_graficos(df_resultados)
+    imprimir_paragrafo_conclusao(df_resultados, len(df_resultados))
\ No newline at end of file
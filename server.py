@@ -0,0 +1,340 @@
+"""Serviço HTTP (ASGI) do grafo: turnos de chat, retomada de interrupções e estado, com streaming por SSE.
+
+O Streamlit (ou qualquer outro cliente) pode virar só uma camada de interface sobre este serviço,
+e o backend pode ser testado sob carga de forma independente.
+
+Uso:
+    uvicorn server:app --host 0.0.0.0 --port 8000
+
+Rotas:
+    POST /threads/{thread_id}/turn     {"message": "..."}          -> SSE
+    POST /threads/{thread_id}/resume   {"resume": {...}}           -> SSE
+    GET  /threads/{thread_id}/state                                -> JSON
+    GET  /healthz | /readyz | /metrics
+"""
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+import dotenv
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+from langgraph.types import Command
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from agent.agent import create_agent_graph
+from agent.utils.admission import get_admission
+from agent.utils.blobs import resolve
+from agent.utils.checkpointer import get_checkpointer
+from agent.utils.gateway import get_gateway
+from agent.utils.guide import normalize_content
+from agent.utils.outbox import get_outbox
+from agent.utils.resilience import turn_deadline, CircuitBreaker
+
+dotenv.load_dotenv()
+
+# --- Configurações Globais ---
+# Turnos simultâneos por processo; acima disso o serviço responde 503 (o balanceador tenta outra réplica)
+SERVER_MAX_INFLIGHT = int(os.getenv("SERVER_MAX_INFLIGHT", "32"))
+# Quanto um turno pode esperar por uma vaga antes do 503 (0 = rejeita na hora)
+SERVER_QUEUE_WAIT_S = float(os.getenv("SERVER_QUEUE_WAIT_S", "0.25"))
+SERVER_RETRY_AFTER_S = int(os.getenv("SERVER_RETRY_AFTER_S", "2"))
+# Comentário SSE periódico para proxies não derrubarem a conexão durante a geração do guia
+SERVER_SSE_PING_S = float(os.getenv("SERVER_SSE_PING_S", "15"))
+READINESS_TIMEOUT_S = 2.0
+
+# Nós cujos tokens são repassados ao cliente (o roteador gera JSON; o guia chega inteiro no final)
+STREAMED_NODES = {"chat_node"}
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def _text(content) -> str:
+    text = str(resolve(normalize_content(content)))
+    return text.replace("[INICIO_GUIA]", "").replace("[FIM_GUIA]", "").strip()
+
+
+def _message_payload(message):
+    """Mensagem do estado no formato da API; None para as que não aparecem na conversa."""
+    if isinstance(message, HumanMessage):
+        return {"role": "user", "content": str(message.content)}
+    if isinstance(message, AIMessage) and message.content and not message.tool_calls:
+        return {"role": "assistant", "content": _text(message.content)}
+    return None
+
+
+class TurnResponse(StreamingResponse):
+    """Resposta SSE do turno que devolve a vaga mesmo se o corpo nunca for iterado (cliente saiu antes)."""
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # Encerra o gerador suspenso (desconexão no meio do turno) antes de liberar a conversa
+                await self.body_iterator.aclose()
+            finally:
+                self._release()
+
+
+class GraphService:
+    """Estado do processo: o grafo compilado, a vaga de concorrência e as métricas."""
+
+    def __init__(self, graph=None, llm=None, max_inflight: int = SERVER_MAX_INFLIGHT,
+                 queue_wait_s: float = SERVER_QUEUE_WAIT_S):
+        self.graph = graph
+        self.llm = llm
+        self.max_inflight = max_inflight
+        self.queue_wait_s = queue_wait_s
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._busy_threads = set()
+        self.inflight = 0
+        self.turns = 0
+        self.errors = 0
+        self.rejected = 0
+        self.conflicts = 0
+        self._latencies = deque(maxlen=1000)
+
+    def start(self):
+        if self.graph is None:
+            # Checkpoints persistidos (SQLite local ou camada compartilhada)
+            self.llm = self.llm or get_gateway()
+            self.graph = create_agent_graph(checkpointer=get_checkpointer(), llm=self.llm)
+        return self
+
+    # --- Contrapressão ---
+
+    async def admit(self) -> bool:
+        if self.queue_wait_s <= 0:
+            if self._slots.locked():
+                return False
+            await self._slots.acquire()
+            return True
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_wait_s)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # --- Execução ---
+
+    async def _events(self, input_data, thread_id: str):
+        """Eventos SSE de um turno: tokens do chat, ferramentas, mensagens finais e interrupções."""
+        config = {"configurable": {"thread_id": thread_id}}
+        with turn_deadline():
+            async for mode, payload in self.graph.astream(input_data, config, stream_mode=["messages", "updates"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if (isinstance(chunk, AIMessageChunk) and metadata.get("langgraph_node") in STREAMED_NODES
+                            and isinstance(chunk.content, str) and chunk.content):
+                        yield _sse("token", {"content": chunk.content})
+                    continue
+
+                for node, update in payload.items():
+                    if node == "__interrupt__":
+                        for item in update:
+                            yield _sse("interrupt", {"value": item.value})
+                        continue
+                    for message in (update or {}).get("messages", []) if isinstance(update, dict) else []:
+                        if isinstance(message, AIMessage) and message.tool_calls:
+                            for call in message.tool_calls:
+                                yield _sse("tool", {"name": call["name"], "args": call["args"]})
+                        elif isinstance(message, ToolMessage):
+                            yield _sse("tool_result", {"name": message.name})
+                        elif isinstance(message, AIMessage) and message.content:
+                            yield _sse("message", {"node": node, "content": _text(message.content)})
+
+        snapshot = await self.graph.aget_state(config)
+        yield _sse("done", {"next": list(snapshot.next)})
+
+    async def _with_heartbeat(self, events):
+        """Repassa os eventos e envia um comentário SSE se a execução ficar muito tempo em silêncio."""
+        queue = asyncio.Queue()
+
+        async def produce():
+            try:
+                async for event in events:
+                    await queue.put(event)
+            except Exception as e:
+                self.errors += 1
+                print(f"[ERROR AGENT] Falha no turno: {e}")
+                await queue.put(_sse("error", {"detail": str(e)}))
+            finally:
+                await queue.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SERVER_SSE_PING_S)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            producer.cancel()
+
+    def _lease(self, thread_id: str):
+        """Conta o turno (a vaga e a conversa já foram tomadas); retorna a liberação, idempotente."""
+        self.inflight += 1
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self._busy_threads.discard(thread_id)
+            self.inflight -= 1
+            self._slots.release()
+
+        return release
+
+    async def stream_turn(self, input_data, thread_id: str, release):
+        start = time.perf_counter()
+        try:
+            async for event in self._with_heartbeat(self._events(input_data, thread_id)):
+                yield event
+        finally:
+            release()
+            self.turns += 1
+            self._latencies.append(time.perf_counter() - start)
+
+    async def run(self, input_data, thread_id: str):
+        """Resposta SSE do turno, ou 503/409 se não houver vaga ou a conversa já estiver em execução."""
+        if thread_id in self._busy_threads:
+            self.conflicts += 1
+            return JSONResponse({"detail": "Esta conversa já tem um turno em andamento."}, status_code=409)
+        # Marcada antes do await da vaga: outra requisição da mesma conversa já recebe 409
+        self._busy_threads.add(thread_id)
+        try:
+            admitted = await self.admit()
+        except BaseException:
+            self._busy_threads.discard(thread_id)  # requisição cancelada enquanto esperava a vaga
+            raise
+        if not admitted:
+            self._busy_threads.discard(thread_id)
+            self.rejected += 1
+            return JSONResponse({"detail": "Serviço ocupado, tente novamente."}, status_code=503,
+                                headers={"Retry-After": str(SERVER_RETRY_AFTER_S)})
+        release = self._lease(thread_id)
+        # A vaga é devolvida no fim do corpo ou, se ele nunca começar, quando a resposta termina
+        return TurnResponse(self.stream_turn(input_data, thread_id, release), release,
+                            media_type="text/event-stream",
+                            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    async def state(self, thread_id: str) -> dict:
+        snapshot = await self.graph.aget_state({"configurable": {"thread_id": thread_id}})
+        values = snapshot.values or {}
+        messages = [m for m in map(_message_payload, values.get("messages", [])) if m]
+        user_data = {k: v for k, v in (values.get("user_data") or {}).items() if k != "guide"}
+        return {
+            "thread_id": thread_id,
+            "messages": messages,
+            "next": list(snapshot.next),
+            "interrupts": [item.value for item in snapshot.interrupts],
+            "user_data": user_data,
+            "has_guide": bool((values.get("user_data") or {}).get("guide")),
+        }
+
+    async def ready(self) -> dict:
+        checks = {"grafo": self.graph is not None, "vagas": self.inflight < self.max_inflight}
+        try:
+            await asyncio.wait_for(self.graph.checkpointer.aget_tuple({"configurable": {"thread_id": "readyz"}}),
+                                   READINESS_TIMEOUT_S)
+            checks["checkpointer"] = True
+        except Exception:
+            checks["checkpointer"] = False
+        # Pronto para LLM se ao menos um provedor não estiver com o circuit breaker aberto
+        stats = self.llm.stats() if hasattr(self.llm, "stats") else {}
+        checks["llm"] = not stats or any(p["breaker"] != CircuitBreaker.OPEN for p in stats.values())
+        return checks
+
+    def metrics(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))], 3) if latencies else None
+
+        return {
+            "em_andamento": self.inflight,
+            "limite": self.max_inflight,
+            "turnos": self.turns,
+            "erros": self.errors,
+            "rejeitados_503": self.rejected,
+            "conflitos_409": self.conflicts,
+            "turno_p50_s": pct(0.50),
+            "turno_p95_s": pct(0.95),
+            "admissao": get_admission().metrics(),
+            "outbox": get_outbox().stats(),
+        }
+
+
+def create_app(graph=None, llm=None, max_inflight: int = SERVER_MAX_INFLIGHT,
+               queue_wait_s: float = SERVER_QUEUE_WAIT_S):
+    """Cria o app ASGI. `graph`/`llm` permitem servir um grafo já montado (ex.: com LLM fake nos benchmarks)."""
+    service = GraphService(graph, llm, max_inflight, queue_wait_s)
+
+    async def turn(request: Request):
+        body = await request.json()
+        message = str(body.get("message", "")).strip()
+        if not message:
+            return JSONResponse({"detail": "Campo 'message' obrigatório."}, status_code=422)
+        return await service.run({"messages": [HumanMessage(content=message)]}, request.path_params["thread_id"])
+
+    async def resume(request: Request):
+        body = await request.json()
+        if "resume" not in body:
+            return JSONResponse({"detail": "Campo 'resume' obrigatório."}, status_code=422)
+        return await service.run(Command(resume=body["resume"]), request.path_params["thread_id"])
+
+    async def state(request: Request):
+        return JSONResponse(await service.state(request.path_params["thread_id"]))
+
+    async def healthz(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    async def readyz(request: Request):
+        checks = await service.ready()
+        ok = all(checks.values())
+        return JSONResponse({"status": "ok" if ok else "indisponivel", **checks}, status_code=200 if ok else 503)
+
+    async def metrics(request: Request):
+        return JSONResponse(service.metrics())
+
+    @asynccontextmanager
+    async def lifespan(app):
+        service.start()
+        # Emails do guia saem em segundo plano; pendentes de execuções anteriores são retomados
+        get_outbox()
+        yield
+
+    app = Starlette(
+        routes=[
+            Route("/threads/{thread_id}/turn", turn, methods=["POST"]),
+            Route("/threads/{thread_id}/resume", resume, methods=["POST"]),
+            Route("/threads/{thread_id}/state", state, methods=["GET"]),
+            Route("/healthz", healthz, methods=["GET"]),
+            Route("/readyz", readyz, methods=["GET"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.service = service
+    return app
+
+
+app = create_app()